@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Compare the unpacked model2 prediction (one pair per padded row) with the
+# packed one (several pairs per row, block-diagonal attention) on CPU:
+# pairs per second of both and the largest score difference.
+
+import os
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.packing import build_packed_model, PackedPairsDataseq, predict_packed
+from nl2sql import model2
+from keras_bert import get_checkpoint_paths
+
+
+# ## Configuration
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task2_model_path = 'task2_model.h5'
+num_queries = 500
+max_len = 120
+pack_lens = [120, 256]
+num_threads = os.cpu_count()
+result_file = 'packing_benchmark.json'
+
+
+# ## Build pairs and models
+
+K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=num_threads,
+                                               inter_op_parallelism_threads=2,
+                                               device_count={'GPU': 0})))
+
+val_data = read_data(val_data_file, read_tables(val_table_file))[:num_queries]
+qc_pairs = model2.QuestionCondPairsDataset(val_data,
+                                           candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+                                           has_label=False,
+                                           model_1_outputs=[dict(query.sql) for query in val_data])
+
+model, tokenizer = model2.construct_model(paths)
+model.load_weights(task2_model_path)
+packed_model = build_packed_model(model)
+print('~~ {} pairs'.format(len(qc_pairs)))
+
+
+# ## Benchmark
+
+qc_pairs_seq = model2.QuestionCondPairsDataseq(qc_pairs, tokenizer, is_train=False, max_len=max_len,
+                                               sampler=model2.FullSampler(), shuffle=False, batch_size=128)
+model.predict_on_batch(qc_pairs_seq[0])  # 预热
+start = time.time()
+unpacked_scores = model.predict_generator(qc_pairs_seq)
+unpacked_seconds = time.time() - start
+results = {'num_pairs': len(qc_pairs),
+           'unpacked': {'seconds': unpacked_seconds, 'pairs_per_sec': len(qc_pairs) / unpacked_seconds}}
+
+for pack_len in pack_lens:
+    packed_seq = PackedPairsDataseq(qc_pairs, tokenizer, max_len=max_len, pack_len=pack_len,
+                                    batch_size=max(1, 128 * max_len // pack_len))
+    packed_model.predict_on_batch(packed_seq[0])
+    start = time.time()
+    packed_scores = predict_packed(packed_model, packed_seq)
+    seconds = time.time() - start
+    results['packed_{}'.format(pack_len)] = {
+        'seconds': seconds,
+        'pairs_per_sec': len(qc_pairs) / seconds,
+        'pairs_per_row': len(qc_pairs) / len(packed_seq.rows),
+        'max_abs_diff': float(np.max(np.abs(packed_scores - unpacked_scores)))
+    }
+
+for name, result in results.items():
+    print(name, result)
+with open(result_file, 'w') as f:
+    json.dump(results, f, indent=2)
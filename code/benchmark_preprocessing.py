@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Micro-benchmarks of the preprocessing code on seeded synthetic data, so
+# they can run in CI without the competition data. The timings are written to
+# `results_file` and compared with `baseline_file`; the script exits with 1
+# when a benchmark is slower than the baseline beyond its tolerance, or when
+# there is no baseline for the current data settings (run once with
+# `update_baseline = True` on the reference machine to write it).
+
+import os
+import sys
+import json
+import atexit
+import shutil
+import platform
+import tempfile
+
+import numpy as np
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.synthetic import SyntheticGenerator
+from nl2sql.utils.timing import time_it, summarize, compare_with_baseline
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+seed = 42
+num_tables = 200
+queries_per_table = 10
+wide_ratio = 0.1
+repeats = 5
+
+results_file = 'benchmark_results.json'
+baseline_file = 'benchmark_baseline.json'
+update_baseline = False  # 用本次结果覆盖 baseline（同时记录机器和数据参数）
+tolerance = 0.2
+tolerances = {'build_candidate_cache': 0.3, 'qc_pairs_dataset': 0.3}
+
+
+# ## Synthetic data
+
+data_dir = tempfile.mkdtemp(prefix='nl2sql_benchmark_')
+atexit.register(shutil.rmtree, data_dir, True)
+table_file = os.path.join(data_dir, 'tables.json')
+data_file = os.path.join(data_dir, 'data.json')
+SyntheticGenerator(seed=seed, wide_ratio=wide_ratio).write(table_file, data_file, num_tables, queries_per_table)
+
+tables = read_tables(table_file)
+queries = read_data(data_file, tables)
+
+# 用合成数据中出现的字符构造词表
+chars = set()
+for query in queries:
+    chars.update(query.question.text.lower())
+    for col_name, _ in query.table.header:
+        chars.update(col_name.lower())
+    for row in query.table.rows:
+        for value in row:
+            chars.update(str(value).lower())
+special_tokens = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[unused1]', '[unused11]', '[unused12]']
+token_dict = {token: i for i, token in enumerate(special_tokens + sorted(chars))}
+
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+pair_tokenizer = model2.SimpleTokenizer(token_dict)
+
+
+# ## Benchmarks
+
+results = {}
+
+
+def run(name, fn, num_items):
+    timings, result = time_it(fn, repeats=repeats)
+    results[name] = summarize(timings, num_items)
+    print('{:<24} median {:8.4f}s  {:10.1f} items/s'.format(
+        name, results[name]['median'], results[name]['items_per_sec']))
+    return result
+
+
+run('read_tables', lambda: read_tables(table_file), num_tables)
+run('read_data', lambda: read_data(data_file, tables), len(queries))
+run('query_tokenizer', lambda: [query_tokenizer.encode(q) for q in queries], len(queries))
+run('label_encoder', lambda: [label_encoder.encode(q.sql, len(q.table.header)) for q in queries], len(queries))
+
+train_dataseq = model1.DataSequence(queries, query_tokenizer, label_encoder, is_train=True,
+                                    shuffle=False, shuffle_header=False, max_len=160, batch_size=32)
+run('dataseq_getitem', lambda: [train_dataseq[i] for i in range(len(train_dataseq))], len(queries))
+
+window_dataseq = model1.DataSequence(queries, query_tokenizer, label_encoder, is_train=True,
+                                     shuffle=False, shuffle_header=False, max_len=160, batch_size=32,
+                                     column_window=True)
+run('dataseq_getitem_window', lambda: [window_dataseq[i] for i in range(len(window_dataseq))], len(queries))
+
+
+def build_candidate_cache():
+    extractor = model2.CandidateCondsExtractor(share_candidates=True)
+    extractor.build_candidate_cache(queries)
+    return extractor
+
+
+run('build_candidate_cache', build_candidate_cache, len(queries))
+qc_pairs = run('qc_pairs_dataset',
+               lambda: model2.QuestionCondPairsDataset(
+                   queries, candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False)),
+               len(queries))
+
+qc_pairs_seq = model2.QuestionCondPairsDataseq(qc_pairs, pair_tokenizer, sampler=model2.FullSampler(),
+                                               shuffle=False, batch_size=128)
+run('pairs_dataseq_getitem', lambda: [qc_pairs_seq[i] for i in range(len(qc_pairs_seq))], len(qc_pairs))
+
+scores = np.random.RandomState(seed).rand(len(qc_pairs))
+run('merge_result', lambda: model2.merge_result(qc_pairs, scores, 0.5), len(qc_pairs))
+
+
+# ## Compare with baseline
+
+# 数据参数不同的 baseline 没有可比性；机器不同时只提示
+data_settings = {'seed': seed, 'num_tables': num_tables,
+                 'queries_per_table': queries_per_table, 'wide_ratio': wide_ratio}
+machine = {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+           'cpu_count': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__}
+meta = {'data': data_settings, 'machine': machine}
+
+with open(results_file, 'w') as f:
+    json.dump(dict(results, _meta=meta), f, indent=2)
+
+if update_baseline:
+    with open(baseline_file, 'w') as f:
+        json.dump(dict(results, _meta=meta), f, indent=2)
+    print('~~ baseline written to {}'.format(baseline_file))
+    sys.exit(0)
+
+if not os.path.exists(baseline_file):
+    print('~~ no baseline at {}, run with update_baseline = True to write one'.format(baseline_file))
+    sys.exit(1)
+with open(baseline_file) as f:
+    baseline_meta = json.load(f).get('_meta', {})
+if baseline_meta.get('data') != data_settings:
+    print('~~ baseline was measured with {}, not {}; run with update_baseline = True to replace it'.format(
+        baseline_meta.get('data'), data_settings))
+    sys.exit(1)
+if baseline_meta.get('machine') != machine:
+    print('~~ baseline was measured on {}, timings may not be comparable'.format(baseline_meta.get('machine')))
+
+regressions = 0
+for name, base, current, ratio, ok in compare_with_baseline(results, baseline_file, tolerance, tolerances):
+    print('{:<24} baseline {:8.4f}s  current {:8.4f}s  {:6.2f}x  {}'.format(
+        name, base, current, ratio, 'ok' if ok else 'REGRESSION'))
+    regressions += not ok
+sys.exit(1 if regressions else 0)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Bulk prediction of a large JSONL file: model1 -> model2 shard by shard,
+# each shard's sqls are written to output_dir/part-xxxxx.jsonl and committed
+# in output_dir/manifest.json. Re-running after a crash resumes from the
+# last finished shard.
+
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_tables
+from nl2sql.utils.bulk import BulkRunner
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+table_file = '../data/test/test.tables.json'
+data_file = '../data/test/test.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_model_path = 'task1_best_model.h5'
+task2_model_path = 'task2_model.h5'
+
+output_dir = 'bulk_output'
+shard_size = 10000
+final_output_file = 'final_output.json'  # 全部完成后把所有 shard 合并到该文件，None 表示不合并
+
+column_window = False  # 需与 model1 训练时的设置一致
+prune_empty_conds = False
+threshold = 0.995
+
+
+# ## Load Models
+
+# 表格只读入一次，预测过程中不会更新，因此不订阅 Tables 的更新；ResultCache 按表的
+# content_hash 自行失效。长期运行、会 push / update_rows 表格的服务需要订阅
+# CandidateCondsExtractor.refresh_table 和 SqlExecutor.refresh_table
+tables = read_tables(table_file)
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+
+task1_model = model1.construct_model(paths)
+task1_model.load_weights(task1_model_path)
+
+task2_model, pair_tokenizer = model2.construct_model(paths)
+task2_model.load_weights(task2_model_path)
+
+
+# ## Predict
+
+def predict_queries(queries):
+    dataseq = model1.DataSequence(
+        data=queries,
+        tokenizer=query_tokenizer,
+        label_encoder=label_encoder,
+        is_train=False,
+        shuffle_header=False,
+        max_len=160,
+        shuffle=False,
+        batch_size=32,
+        column_window=column_window
+    )
+    task1_result = model1.predict_sqls(task1_model, dataseq)
+
+    qc_pairs = model2.QuestionCondPairsDataset(
+        queries,
+        candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+        has_label=False,
+        model_1_outputs=task1_result,
+        prune_empty_conds=prune_empty_conds
+    )
+    task2_result = {}
+    if len(qc_pairs) > 0:
+        qc_pairs_seq = model2.QuestionCondPairsDataseq(qc_pairs, pair_tokenizer, is_train=False,
+                                                       sampler=model2.FullSampler(), shuffle=False,
+                                                       batch_size=128)
+        scores = task2_model.predict_generator(qc_pairs_seq)
+        task2_result = model2.merge_result(qc_pairs, scores, threshold=threshold)
+
+    for query_id, pred_sql in enumerate(task1_result):
+        pred_sql['conds'] = list(task2_result.get(query_id, []))
+    return task1_result
+
+
+runner = BulkRunner(output_dir, shard_size=shard_size)
+manifest = runner.run(data_file, tables, predict_queries)
+print('~~ {} queries in {} shards'.format(manifest['num_queries'], len(manifest['shards'])))
+
+if final_output_file is not None:
+    runner.concat(final_output_file)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Knowledge distillation: train compact students of model1 / model2 on the
+# soft labels of the trained teachers, and compare accuracy and CPU latency.
+
+import sys
+import json
+
+from keras.callbacks import ModelCheckpoint
+from keras.optimizers import Adam
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.optimizer import RAdam
+from nl2sql.utils.timing import TimedModel
+from nl2sql.utils.distill import (build_student_bert, init_student_from_teacher,
+                                  soft_target_loss, DistillationSequence)
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_model_path = 'task1_best_model.h5'
+task2_model_path = 'task2_model.h5'
+task1_student_path = 'task1_student_model.h5'
+task2_student_path = 'task2_student_model.h5'
+
+# 学生模型的每一层由教师模型的哪一层初始化（从 0 开始）
+student_layers = [2, 5, 8, 11]
+alpha = 0.5  # hard label 与 teacher soft label 的权重
+
+task1_epochs = 30
+task2_epochs = 5
+batch_size = 32
+threshold = 0.995
+
+max_total_acc_drop = 0.02  # task1 学生模型 total_acc 允许的最大下降
+max_pair_acc_drop = 0.02  # task2 学生模型 pair_acc 允许的最大下降
+report_file = 'distillation_report.json'
+
+
+# ## Read Data
+
+train_tables = read_tables(train_table_file)
+train_data = read_data(train_data_file, train_tables)
+
+val_tables = read_tables(val_table_file)
+val_data = read_data(val_data_file, val_tables)
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+
+
+# ## Distill model1
+
+task1_teacher = model1.construct_model(paths)
+task1_teacher.load_weights(task1_model_path)
+
+task1_student = model1.build_model(build_student_bert(paths.config, len(student_layers)))
+init_student_from_teacher(task1_teacher, task1_student, student_layers)
+task1_student.compile(
+    loss=soft_target_loss(alpha),
+    optimizer=RAdam(lr=1e-5)
+)
+
+train_dataseq = model1.DataSequence(
+    data=train_data,
+    tokenizer=query_tokenizer,
+    label_encoder=label_encoder,
+    shuffle_header=False,
+    is_train=True,
+    max_len=160,
+    batch_size=batch_size
+)
+
+val_dataseq = model1.DataSequence(
+    data=val_data,
+    tokenizer=query_tokenizer,
+    label_encoder=label_encoder,
+    is_train=False,
+    shuffle_header=False,
+    max_len=160,
+    shuffle=False,
+    batch_size=batch_size
+)
+
+callbacks = [
+    model1.EvaluateCallback(val_dataseq),
+    ModelCheckpoint(filepath=task1_student_path,
+                    monitor='val_tot_acc',
+                    mode='max',
+                    save_best_only=True,
+                    save_weights_only=True)
+]
+task1_student.fit_generator(DistillationSequence(train_dataseq, task1_teacher),
+                            epochs=task1_epochs, callbacks=callbacks)
+task1_student.load_weights(task1_student_path)
+
+
+def evaluate_task1(model):
+    timed_model = TimedModel(model)
+    pred_sqls = model1.predict_sqls(timed_model, val_dataseq)
+    metrics = model1.evaluate_sqls(pred_sqls, [query.sql for query in val_data])
+    metrics['latency_ms'] = timed_model.latency_ms()
+    return metrics
+
+
+task1_report = {'teacher': evaluate_task1(task1_teacher), 'student': evaluate_task1(task1_student)}
+
+
+# ## Distill model2
+
+task2_teacher, pair_tokenizer = model2.construct_model(paths)
+task2_teacher.load_weights(task2_model_path)
+
+task2_student = model2.build_model(build_student_bert(paths.config, len(student_layers)))
+init_student_from_teacher(task2_teacher, task2_student, student_layers)
+task2_student.compile(
+    loss={'output_similarity': soft_target_loss(alpha, binary=True)},
+    optimizer=Adam(1e-5)
+)
+
+tr_qc_pairs = model2.QuestionCondPairsDataset(
+    train_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False)
+)
+tr_qc_pairs_seq = model2.QuestionCondPairsDataseq(tr_qc_pairs, pair_tokenizer,
+                                                  sampler=model2.NegativeSampler(), shuffle=True)
+# teacher 在取 batch 时做预测，只用一个 worker
+task2_student.fit_generator(DistillationSequence(tr_qc_pairs_seq, task2_teacher),
+                            epochs=task2_epochs, workers=1)
+task2_student.save_weights(task2_student_path)
+
+val_qc_pairs = model2.QuestionCondPairsDataset(
+    val_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True)
+)
+val_qc_pairs_seq = model2.QuestionCondPairsDataseq(val_qc_pairs, pair_tokenizer,
+                                                   sampler=model2.FullSampler(), shuffle=False,
+                                                   batch_size=128)
+
+
+def evaluate_task2(model):
+    timed_model = TimedModel(model)
+    scores, labels = [], []
+    for batch_id in range(len(val_qc_pairs_seq)):
+        inputs, outputs = val_qc_pairs_seq[batch_id]
+        scores += list(timed_model.predict_on_batch(inputs).reshape(-1))
+        labels += list(outputs['output_similarity'].reshape(-1))
+    metrics = model2.evaluate_pairs(scores, labels, threshold)
+    metrics['latency_ms'] = timed_model.latency_ms()
+    return metrics
+
+
+task2_report = {'teacher': evaluate_task2(task2_teacher), 'student': evaluate_task2(task2_student)}
+
+
+# ## Report
+
+for task, report in [('task1', task1_report), ('task2', task2_report)]:
+    report['speedup'] = report['teacher']['latency_ms'] / report['student']['latency_ms']
+    print('~~ {} speedup: {:.2f}x'.format(task, report['speedup']))
+    for name in report['teacher']:
+        print('{:<20} teacher: {:<12.4f} student: {:.4f}'.format(
+            name, report['teacher'][name], report['student'][name]))
+
+failed = False
+for task, report, metric, max_drop in [('task1', task1_report, 'total_acc', max_total_acc_drop),
+                                       ('task2', task2_report, 'pair_acc', max_pair_acc_drop)]:
+    drop = report['teacher'][metric] - report['student'][metric]
+    report['{}_drop'.format(metric)] = drop
+    if drop > max_drop:
+        print('~~ {} student {} dropped by {:.4f} (> {})'.format(task, metric, drop, max_drop))
+        failed = True
+
+with open(report_file, 'w') as f:
+    json.dump({'task1': task1_report, 'task2': task2_report}, f, indent=2)
+
+# 任一学生模型超出允许的精度下降时以非零状态退出，报告仍然写出
+sys.exit(1 if failed else 0)
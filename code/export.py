@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Export model1 / model2 to frozen, constant-folded inference graphs and
+# benchmark them against the keras path on CPU.
+
+import json
+
+import keras.backend as K
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.freeze import freeze_model, FrozenModel, compare_latency
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_model_path = 'task1_best_model.h5'
+task2_model_path = 'task2_model.h5'
+
+task1_graph_file = 'task1_frozen.pb'
+task2_graph_file = 'task2_frozen.pb'
+
+benchmark_batches = 20
+benchmark_file = 'frozen_benchmark.json'
+
+
+# ## Read Data
+
+val_tables = read_tables(val_table_file)
+val_data = read_data(val_data_file, val_tables)
+
+token_dict = load_vocabulary(paths.vocab)
+
+
+# ## Export model1
+
+K.clear_session()
+K.set_learning_phase(0)
+
+task1_model = model1.construct_model(paths)
+task1_model.load_weights(task1_model_path)
+print('~~ task1 signature: {}'.format(freeze_model(task1_model, task1_graph_file)))
+
+val_dataseq = model1.DataSequence(
+    data=val_data,
+    tokenizer=model1.QueryTokenizer(token_dict),
+    label_encoder=model1.SqlLabelEncoder(),
+    is_train=False,
+    shuffle_header=False,
+    max_len=160,
+    shuffle=False,
+    batch_size=32
+)
+task1_frozen = FrozenModel(task1_graph_file)
+task1_benchmark = compare_latency(task1_model, task1_frozen, val_dataseq, num_batches=benchmark_batches)
+print('~~ task1 benchmark: {}'.format(task1_benchmark))
+task1_frozen.close()
+
+
+# ## Export model2
+
+K.clear_session()
+K.set_learning_phase(0)
+
+task2_model, pair_tokenizer = model2.construct_model(paths)
+task2_model.load_weights(task2_model_path)
+print('~~ task2 signature: {}'.format(freeze_model(task2_model, task2_graph_file)))
+
+val_qc_pairs = model2.QuestionCondPairsDataset(
+    val_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+    has_label=False
+)
+val_qc_pairs_seq = model2.QuestionCondPairsDataseq(val_qc_pairs, pair_tokenizer, is_train=False,
+                                                   sampler=model2.FullSampler(), shuffle=False,
+                                                   batch_size=128)
+task2_frozen = FrozenModel(task2_graph_file)
+task2_benchmark = compare_latency(task2_model, task2_frozen, val_qc_pairs_seq, num_batches=benchmark_batches)
+print('~~ task2 benchmark: {}'.format(task2_benchmark))
+task2_frozen.close()
+
+
+with open(benchmark_file, 'w') as f:
+    json.dump({'task1': task1_benchmark, 'task2': task2_benchmark}, f, indent=2)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Compare bert freezing / progressive unfreezing schedules: train model1 and
+# model2 with each schedule and report time per epoch and final accuracy.
+
+import json
+
+import numpy as np
+import keras.backend as K
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.distill import get_bert_layer
+from nl2sql.utils.layer_freezing import UnfreezeSchedule
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+# {epoch: 冻结的层数（含 embedding）}
+schedules = {
+    'full': {0: 0},
+    'freeze_8': {0: 8},
+    'unfreeze_8_4_0': {0: 8, 2: 4, 4: 0},
+    'unfreeze_12_6_0': {0: 12, 1: 6, 3: 0}
+}
+
+task1_epochs = 6
+task2_epochs = 3
+batch_size = 32
+threshold = 0.995
+report_file = 'freezing_report.json'
+
+
+# ## Read Data
+
+train_tables = read_tables(train_table_file)
+train_data = read_data(train_data_file, train_tables)
+
+val_tables = read_tables(val_table_file)
+val_data = read_data(val_data_file, val_tables)
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+pair_tokenizer = model2.SimpleTokenizer(token_dict)
+
+train_dataseq = model1.DataSequence(train_data, query_tokenizer, label_encoder, is_train=True,
+                                    shuffle_header=False, max_len=160, batch_size=batch_size)
+val_dataseq = model1.EncodedSequence(
+    model1.DataSequence(val_data, query_tokenizer, label_encoder, is_train=False,
+                        shuffle=False, shuffle_header=False, max_len=160, batch_size=batch_size))
+
+tr_qc_pairs = model2.QuestionCondPairsDataset(
+    train_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False)
+)
+val_qc_pairs = model2.QuestionCondPairsDataset(
+    val_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True)
+)
+val_qc_pairs_seq = model2.QuestionCondPairsDataseq(val_qc_pairs, pair_tokenizer,
+                                                   sampler=model2.FullSampler(), shuffle=False,
+                                                   batch_size=128)
+
+
+# ## Train with every schedule
+
+def run_task1(schedule):
+    model = model1.construct_model(paths, num_frozen_layers=schedule[0])
+    unfreeze = UnfreezeSchedule(get_bert_layer(model), schedule)
+    model.fit_generator(train_dataseq, epochs=task1_epochs, callbacks=[unfreeze])
+
+    decoded = model1.predict_decoded(model, val_dataseq)
+    metrics = model1.evaluate_decoded(decoded, [query.sql for query in val_data])
+    metrics['epoch_times'] = unfreeze.epoch_times
+    return metrics
+
+
+def run_task2(schedule):
+    model, _ = model2.construct_model(paths, num_frozen_layers=schedule[0])
+    unfreeze = UnfreezeSchedule(get_bert_layer(model), schedule)
+    tr_qc_pairs_seq = model2.QuestionCondPairsDataseq(tr_qc_pairs, pair_tokenizer,
+                                                      sampler=model2.NegativeSampler(), shuffle=True,
+                                                      batch_size=batch_size)
+    model.fit_generator(tr_qc_pairs_seq, epochs=task2_epochs, callbacks=[unfreeze])
+
+    scores, labels = [], []
+    for batch_id in range(len(val_qc_pairs_seq)):
+        inputs, outputs = val_qc_pairs_seq[batch_id]
+        scores.append(model.predict_on_batch(inputs).reshape(-1))
+        labels.append(outputs['output_similarity'].reshape(-1))
+    metrics = model2.evaluate_pairs(np.concatenate(scores), np.concatenate(labels), threshold)
+    metrics['epoch_times'] = unfreeze.epoch_times
+    return metrics
+
+
+report = {'task1': {}, 'task2': {}}
+for name, schedule in schedules.items():
+    report['task1'][name] = run_task1(schedule)
+    K.clear_session()
+    report['task2'][name] = run_task2(schedule)
+    K.clear_session()
+
+
+# ## Report
+
+for task, task_report in report.items():
+    print('~~ {}'.format(task))
+    for name, metrics in task_report.items():
+        acc_name = 'total_acc' if task == 'task1' else 'pair_acc'
+        print('{:<20} {:.1f}s/epoch  {}: {:.4f}'.format(
+            name, np.mean(metrics['epoch_times']), acc_name, metrics[acc_name]))
+
+with open(report_file, 'w') as f:
+    json.dump(report, f, indent=2)
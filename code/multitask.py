@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Train model1 heads and the model2 pair classifier on one shared bert
+# encoder, in alternating batches.
+
+from keras.callbacks import ModelCheckpoint, LambdaCallback
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql import model1, model2, multitask
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+shared_model_path = 'shared_best_model.h5'
+
+batch_size = 32
+num_epochs = 10
+# 逐步解冻共享的 bert：{epoch: 冻结的层数（含 embedding）}，例如 {0: 8, 2: 4, 4: 0}；None 表示所有层一开始就参与训练
+unfreeze_schedule = None
+
+
+# ## Read Data
+
+train_tables = read_tables(train_table_file)
+train_data = read_data(train_data_file, train_tables)
+
+val_tables = read_tables(val_table_file)
+val_data = read_data(val_data_file, val_tables)
+
+
+# ## Build Model
+
+shared_model, pair_tokenizer = multitask.construct_model(
+    paths, num_frozen_layers=unfreeze_schedule[0] if unfreeze_schedule else 0)
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+
+
+# ## Build DataSequence
+
+train_dataseq = model1.DataSequence(
+    data=train_data,
+    tokenizer=query_tokenizer,
+    label_encoder=label_encoder,
+    shuffle_header=False,
+    is_train=True,
+    max_len=160,
+    batch_size=batch_size
+)
+
+val_dataseq = model1.DataSequence(
+    data=val_data,
+    tokenizer=query_tokenizer,
+    label_encoder=label_encoder,
+    is_train=False,
+    shuffle_header=False,
+    max_len=160,
+    shuffle=False,
+    batch_size=batch_size
+)
+
+tr_qc_pairs = model2.QuestionCondPairsDataset(
+    train_data,
+    candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False)
+)
+tr_qc_pairs_seq = model2.QuestionCondPairsDataseq(tr_qc_pairs, pair_tokenizer,
+                                                  sampler=model2.NegativeSampler(), shuffle=True,
+                                                  batch_size=batch_size)
+
+
+# ## Train
+
+evaluate_callback = model1.EvaluateCallback(val_dataseq)
+evaluate_callback.set_model(shared_model.task1)
+
+checkpoint_callback = ModelCheckpoint(filepath=shared_model_path,
+                                      monitor='val_tot_acc',
+                                      mode='max',
+                                      save_best_only=True,
+                                      save_weights_only=True)
+checkpoint_callback.set_model(shared_model.joint)
+
+callbacks = [evaluate_callback, checkpoint_callback]
+if unfreeze_schedule:
+    def apply_unfreeze_schedule(epoch, logs):
+        # 第 0 个 epoch 的冻结层数已在 construct_model 中设置
+        if epoch > 0 and epoch in unfreeze_schedule:
+            shared_model.freeze(unfreeze_schedule[epoch])
+            print('~~ epoch {}: {} bert layers frozen'.format(epoch, unfreeze_schedule[epoch]))
+
+    callbacks.insert(0, LambdaCallback(on_epoch_begin=apply_unfreeze_schedule))
+
+history = shared_model.fit_alternating(train_dataseq, tr_qc_pairs_seq, epochs=num_epochs,
+                                       callbacks=callbacks)
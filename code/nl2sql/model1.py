@@ -0,0 +1,857 @@
+import re
+import json
+import math
+import numpy as np
+from types import SimpleNamespace
+
+import keras.backend as K
+from keras.layers import Input, Dense, Lambda, Multiply, Masking, Concatenate
+from keras.models import Model
+from keras.preprocessing.sequence import pad_sequences
+from keras.callbacks import Callback
+from keras.utils.data_utils import Sequence
+from keras.utils import multi_gpu_model
+from keras_bert import load_trained_model_from_checkpoint
+
+from nl2sql.utils import SQL, MultiSentenceTokenizer, Query, metrics
+from nl2sql.utils.optimizer import RAdam
+from nl2sql.utils.layer_freezing import freeze_bert_layers
+from nl2sql.utils.pretokenized import save_ragged, RaggedArray
+
+
+def remove_brackets(s):
+    '''
+    Remove brackets [] () from text
+    '''
+    return re.sub(r'[\(\（].*[\)\）]', '', s)
+
+
+class QueryTokenizer(MultiSentenceTokenizer):
+    """
+    Tokenize query (question + table header) and encode to integer sequence.
+    Using reserved tokens [unused11] and [unused12] for classification
+    """
+
+    col_type_token_dict = {'text': '[unused11]', 'real': '[unused12]'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._header_tokens = {}  # schema hash -> 每列的 tokens，相同 schema 的表只切分一次
+
+    def header_tokens(self, header):
+        if header.schema_hash not in self._header_tokens:
+            header_tokens = []
+            for col_name, col_type in header:
+                col_type_token = self.col_type_token_dict[col_type]
+                col_name = remove_brackets(col_name)
+                col_name_tokens = self._tokenize(col_name)
+                header_tokens.append([col_type_token] + col_name_tokens)
+            self._header_tokens[header.schema_hash] = header_tokens
+        return self._header_tokens[header.schema_hash]
+
+    def tokenize(self, query: Query, col_orders=None):
+        """
+        Tokenize quesiton and columns and concatenate.
+
+        Parameters:
+        query (Query): A query object contains question and table
+        col_orders (list or numpy.array): For re-ordering the header columns
+
+        Returns:
+        token_idss: token ids for bert encoder
+        segment_ids: segment ids for bert encoder
+        header_ids: positions of columns
+        """
+
+        question_tokens = [self._token_cls] + self._tokenize(query.question.text)
+
+        if col_orders is None:
+            col_orders = np.arange(len(query.table.header))
+
+        all_header_tokens = self.header_tokens(query.table.header)
+        header_tokens = [all_header_tokens[i] for i in col_orders]  # 把列名混乱顺序
+
+        all_tokens = [question_tokens] + header_tokens
+        return self._pack(*all_tokens)
+
+    def encode(self, query: Query, col_orders=None):
+        tokens, tokens_lens = self.tokenize(query, col_orders)
+        token_ids = self._convert_tokens_to_ids(tokens)
+        segment_ids = [0] * len(token_ids)
+        header_indices = np.cumsum(tokens_lens)
+        return token_ids, segment_ids, header_indices[:-1]
+
+
+class SqlLabelEncoder:
+    """
+    Convert SQL object into training labels.
+    """
+    def encode(self, sql: SQL, num_cols):
+        cond_conn_op_label = sql.cond_conn_op
+
+        sel_agg_label = np.ones(num_cols, dtype='int32') * len(SQL.agg_sql_dict)
+        for col_id, agg_op in zip(sql.sel, sql.agg):
+            if col_id < num_cols:
+                sel_agg_label[col_id] = agg_op
+
+        cond_op_label = np.ones(num_cols, dtype='int32') * len(SQL.op_sql_dict)
+        # sql.conds中的元素都是长度为3的list（代表一个查询条件），
+        # 第1个元素col_id是查询条件中的条件列名，第2个元素cond_op是逻辑运算符，第三个元素是条件值，这里直接不要条件值是啥意思？？？
+        # 条件值在model2里面预测，看readme中的“方案介绍”部分。。。
+        for col_id, cond_op, _ in sql.conds:
+            if col_id < num_cols:
+                cond_op_label[col_id] = cond_op
+
+        return cond_conn_op_label, sel_agg_label, cond_op_label
+
+    def decode(self, cond_conn_op_label, sel_agg_label, cond_op_label):
+        cond_conn_op = int(cond_conn_op_label)
+        sel, agg, conds = [], [], []
+
+        for col_id, (agg_op, cond_op) in enumerate(zip(sel_agg_label, cond_op_label)):
+            if agg_op < len(SQL.agg_sql_dict):
+                sel.append(col_id)
+                agg.append(int(agg_op))
+            if cond_op < len(SQL.op_sql_dict):
+                conds.append([col_id, int(cond_op)])
+        return {
+            'sel': sel,
+            'agg': agg,
+            'cond_conn_op': cond_conn_op,
+            'conds': conds
+        }
+
+    def decode_batch(self, preds_cond_conn_op, preds_sel_agg, preds_cond_op, header_lens):
+        """
+        Vectorized decoding of a whole batch of model1 outputs, same result as
+        calling `decode` row by row after the "force one column" trick
+        """
+        header_lens = np.asarray(header_lens)
+        num_cols = preds_sel_agg.shape[1]
+        col_mask = np.arange(num_cols)[None, :] < header_lens[:, None]  # (batch, num_cols)
+
+        # force to select at least one column for agg
+        sel_agg_without_no_op = np.where(col_mask[..., None], preds_sel_agg[..., :-1], -np.inf)
+        row_max = sel_agg_without_no_op.max(axis=(1, 2)) if num_cols else np.full(len(header_lens), -np.inf)
+        is_row_max = (preds_sel_agg == row_max[:, None, None]) & col_mask[..., None]
+        agg_ids = np.argmax(np.where(is_row_max, 1, preds_sel_agg), axis=-1)
+        op_ids = np.argmax(preds_cond_op, axis=-1)
+
+        return DecodedSqls(
+            cond_conn_op=np.argmax(preds_cond_conn_op, axis=-1),
+            agg_ids=agg_ids,
+            sel_mask=col_mask & (agg_ids < len(SQL.agg_sql_dict)),
+            op_ids=op_ids,
+            cond_mask=col_mask & (op_ids < len(SQL.op_sql_dict))
+        )
+
+
+class DecodedSqls:
+    """
+    Compact array form of decoded model1 outputs, one row per query:
+        - cond_conn_op: (batch,)
+        - agg_ids / op_ids: (batch, num_cols) agg / cond op id of every column
+        - sel_mask / cond_mask: (batch, num_cols) whether the column is in sel / conds
+    """
+    def __init__(self, cond_conn_op, agg_ids, sel_mask, op_ids, cond_mask):
+        self.cond_conn_op = cond_conn_op
+        self.agg_ids = agg_ids
+        self.sel_mask = sel_mask
+        self.op_ids = op_ids
+        self.cond_mask = cond_mask
+
+    def __len__(self):
+        return len(self.cond_conn_op)
+
+    @classmethod
+    def concatenate(cls, decoded_list):
+        if not decoded_list:
+            return cls(*[np.zeros((0,) * ndim, dtype=dtype)
+                         for ndim, dtype in [(1, 'int64'), (2, 'int64'), (2, bool), (2, 'int64'), (2, bool)]])
+        num_cols = max(decoded.agg_ids.shape[1] for decoded in decoded_list)
+
+        def pad(array):
+            return np.pad(array, [(0, 0), (0, num_cols - array.shape[1])], mode='constant')
+
+        return cls(
+            cond_conn_op=np.concatenate([decoded.cond_conn_op for decoded in decoded_list]),
+            agg_ids=np.concatenate([pad(decoded.agg_ids) for decoded in decoded_list]),
+            sel_mask=np.concatenate([pad(decoded.sel_mask) for decoded in decoded_list]),
+            op_ids=np.concatenate([pad(decoded.op_ids) for decoded in decoded_list]),
+            cond_mask=np.concatenate([pad(decoded.cond_mask) for decoded in decoded_list])
+        )
+
+    def to_dicts(self):
+        sqls = []
+        cond_conn_op = self.cond_conn_op.tolist()
+        agg_ids = self.agg_ids.tolist()
+        op_ids = self.op_ids.tolist()
+        for i in range(len(self)):
+            sel = np.flatnonzero(self.sel_mask[i]).tolist()
+            cond_cols = np.flatnonzero(self.cond_mask[i]).tolist()
+            sqls.append({
+                'sel': sel,
+                'agg': [agg_ids[i][col_id] for col_id in sel],
+                'cond_conn_op': cond_conn_op[i],
+                'conds': [[col_id, op_ids[i][col_id]] for col_id in cond_cols]
+            })
+        return sqls
+
+
+class DataSequence(Sequence):
+    """
+    Generate training data in batches
+
+    params:
+        - column_window: 把表头切分成若干个窗口，每个窗口和问题拼接后不超过 max_len，
+          一个 query 的所有窗口在同一个 batch 中编码，超宽的表不再被截断
+    """
+    TOKEN_IDS_INPUT = 'input_token_ids'
+
+    def __init__(self,
+                 data,
+                 tokenizer,
+                 label_encoder,
+                 is_train=True,
+                 max_len=160,
+                 batch_size=32,
+                 shuffle=True,
+                 shuffle_header=True,
+                 global_indices=None,
+                 column_window=False):
+
+        self.data = data
+        self.batch_size = batch_size
+        self.tokenizer = tokenizer
+        self.label_encoder = label_encoder
+        self.shuffle = shuffle
+        self.shuffle_header = shuffle_header
+        self.is_train = is_train
+        self.max_len = max_len
+        self.column_window = column_window
+
+        if global_indices is None:
+            self._global_indices = np.arange(len(data))
+        else:
+            self._global_indices = global_indices
+
+        if shuffle:
+            np.random.shuffle(self._global_indices)
+
+    def _pad_sequences(self, seqs, max_len=None):
+        padded = pad_sequences(seqs, maxlen=None, padding='post', truncating='post')
+        if max_len is not None:
+            padded = padded[:, :max_len]
+        return padded
+
+    def batch_data(self, batch_id):
+        batch_data_indices = \
+            self._global_indices[batch_id * self.batch_size: (batch_id + 1) * self.batch_size]
+        return [self.data[i] for i in batch_data_indices]
+
+    def _encode_query(self, query, col_orders):
+        # token_ids是把查询文本和列名（包含列的数据类型）拼接到一起，中间用预先定义的分隔符隔开。
+        # header_ids是列名在token_ids中的起始位置，其长度等于列的数量。
+        # segment_ids好像是全0，长度与token_ids相同（似乎是用于标记当前位置是否为分词位置的？但这里并没有用到分词，所以全0？）
+        # 不管是查询文本还是列名，都视作字符序列，而不用分词。
+        # 字符转化为整数形式的id，方法在keras_bert的Tokenizer类中
+        token_ids, segment_ids, header_ids = self.tokenizer.encode(query, col_orders)
+        header_ids = [hid for hid in header_ids if hid < self.max_len]  # 截断超长部分
+        col_orders = col_orders[: len(header_ids)]  # 跟随header_ids的长度，如果header_ids因为超长被截断一部分，这里col_orders也同样截断
+        return [(token_ids, segment_ids, header_ids, col_orders)]
+
+    def _encode_column_windows(self, query, col_orders):
+        tokens, tokens_lens = self.tokenizer.tokenize(query, col_orders)
+        question_len = tokens_lens[0]
+        col_starts = np.cumsum(tokens_lens)[:-1]
+
+        windows, window, window_len = [], [], question_len
+        for i, col_len in enumerate(tokens_lens[1:]):
+            if window and window_len + col_len > self.max_len:
+                windows.append(window)
+                window, window_len = [], question_len
+            window.append(i)
+            window_len += col_len
+        if window:
+            windows.append(window)
+
+        rows = []
+        for window in windows:
+            window_tokens = tokens[:question_len]
+            header_ids = []
+            for i in window:
+                header_ids.append(len(window_tokens))
+                window_tokens = window_tokens + tokens[col_starts[i]: col_starts[i] + tokens_lens[i + 1]]
+            token_ids = self.tokenizer._convert_tokens_to_ids(window_tokens)
+            segment_ids = [0] * len(token_ids)
+            # 问题本身超过 max_len 时，窗口中的列仍然可能被截断
+            header_ids = [hid for hid in header_ids if hid < self.max_len]
+            rows.append((token_ids, segment_ids, header_ids, col_orders[window[: len(header_ids)]]))
+        return rows
+
+    @metrics.timed('model1_encode_batch_seconds')
+    def get_window_batch(self, batch_id):
+        """
+        Returns:
+        inputs: model inputs, one row per (query, column window)
+        outputs: training labels of each row, None if not is_train
+        row_query_ids: index of the query in the batch of each row
+        row_col_orders: original column ids of the header_ids of each row
+        """
+        batch_data = self.batch_data(batch_id)
+        metrics.observe('model1_batch_fill', len(batch_data) / self.batch_size, metrics.FILL_BUCKETS)
+
+        TOKEN_IDS, SEGMENT_IDS = [], []
+        HEADER_IDS, HEADER_MASK = [], []
+
+        COND_CONN_OP = []
+        SEL_AGG = []
+        COND_OP = []
+
+        row_query_ids, row_col_orders = [], []
+
+        for query_id, query in enumerate(batch_data):
+            table = query.table
+
+            col_orders = np.arange(len(table.header))
+            if self.shuffle_header:
+                np.random.shuffle(col_orders)
+
+            if self.column_window:
+                rows = self._encode_column_windows(query, col_orders)
+            else:
+                rows = self._encode_query(query, col_orders)
+
+            if self.is_train:
+                sql = query.sql
+                # cond_conn_op是一个整数，表示查询条件之间的连接符号，0表示没有连接符号（即只有0个或1个查询条件），1表示and，2表示or（由这种表达方式可知，最多只能有2个查询条件）
+                # sel_agg是一个list，长度为表的列数，这个list的元素为整数，表示各列是否出现在select子句中以及对应的聚合函数，0表示select子句中有这个列但没有聚合函数，1～5分别表示有这个列且对应聚合函数为avg、max、min、count、sum，6表示没有这个列。
+                # cond_op是一个list，长度为表的列数，这个list的元素为整数，表示各列是否出现在查询条件中以及对应的逻辑运算符，0～3分别表示查询条件中有这个列且对应的逻辑运算符分别为 >、<、==、!=，4表示没有这个列
+                cond_conn_op, sel_agg, cond_op = self.label_encoder.encode(sql, num_cols=len(table.header))
+
+            for token_ids, segment_ids, header_ids, header_col_orders in rows:
+                TOKEN_IDS.append(token_ids)
+                SEGMENT_IDS.append(segment_ids)
+                HEADER_IDS.append(header_ids)
+                HEADER_MASK.append([1] * len(header_ids))  # 一个长度等于列数的全1的向量，用于构造batch填充后作为掩码
+                row_query_ids.append(query_id)
+                row_col_orders.append(header_col_orders)
+
+                if self.is_train:
+                    COND_CONN_OP.append(cond_conn_op)
+                    SEL_AGG.append(sel_agg[header_col_orders])
+                    COND_OP.append(cond_op[header_col_orders])
+
+        TOKEN_IDS = self._pad_sequences(TOKEN_IDS, max_len=self.max_len)
+        SEGMENT_IDS = self._pad_sequences(SEGMENT_IDS, max_len=self.max_len)
+        HEADER_IDS = self._pad_sequences(HEADER_IDS)
+        HEADER_MASK = self._pad_sequences(HEADER_MASK)
+
+        inputs = {
+            'input_token_ids': TOKEN_IDS,
+            'input_segment_ids': SEGMENT_IDS,
+            'input_header_ids': HEADER_IDS,
+            'input_header_mask': HEADER_MASK
+        }
+
+        outputs = None
+        if self.is_train:
+            SEL_AGG = self._pad_sequences(SEL_AGG)
+            SEL_AGG = np.expand_dims(SEL_AGG, axis=-1)
+            COND_CONN_OP = np.expand_dims(COND_CONN_OP, axis=-1)
+            COND_OP = self._pad_sequences(COND_OP)
+            COND_OP = np.expand_dims(COND_OP, axis=-1)
+
+            outputs = {
+                'output_sel_agg': SEL_AGG,
+                'output_cond_conn_op': COND_CONN_OP,
+                'output_cond_op': COND_OP
+            }
+        return inputs, outputs, row_query_ids, row_col_orders
+
+    def __getitem__(self, batch_id):
+        inputs, outputs, _, _ = self.get_window_batch(batch_id)
+        if self.is_train:
+            return inputs, outputs
+        else:
+            return inputs
+
+    def __len__(self):
+        return math.ceil(len(self.data) / self.batch_size)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self._global_indices)
+
+    def batch_keys(self, batch_id):
+        return self._global_indices[batch_id * self.batch_size: (batch_id + 1) * self.batch_size].tolist()
+
+    def get_state(self):
+        return {'global_indices': self._global_indices}
+
+    def set_state(self, state):
+        self._global_indices = np.asarray(state['global_indices'])
+
+
+class EncodedSequence(Sequence):
+    """
+    Keep the encoded batches of a non-shuffled DataSequence in memory, so that
+    repeated predictions (e.g. validation after every epoch) tokenize only once
+    """
+    def __init__(self, dataseq):
+        if dataseq.shuffle or dataseq.shuffle_header:
+            raise ValueError('only a DataSequence without shuffling can be cached')
+        self.dataseq = dataseq
+        self.data = dataseq.data
+        self.label_encoder = dataseq.label_encoder
+        self.column_window = dataseq.column_window
+        self._window_batches = [dataseq.get_window_batch(i) for i in range(len(dataseq))]
+        self._batch_data = [dataseq.batch_data(i) for i in range(len(dataseq))]
+
+    def batch_data(self, batch_id):
+        return self._batch_data[batch_id]
+
+    @metrics.timed('model1_cached_batch_seconds')
+    def get_window_batch(self, batch_id):
+        return self._window_batches[batch_id]
+
+    def __getitem__(self, batch_id):
+        inputs, outputs, _, _ = self._window_batches[batch_id]
+        if self.dataseq.is_train:
+            return inputs, outputs
+        else:
+            return inputs
+
+    def __len__(self):
+        return len(self._window_batches)
+
+
+def save_encoded_queries(prefix, queries, tokenizer):
+    """
+    Tokenize the question and every column of each query once (no truncation)
+    and save them as ragged arrays, with the number of columns and the sqls,
+    to be read back by `EncodedQueries`
+    """
+    segments, num_cols = [], []
+    for query in queries:
+        tokens, tokens_lens = tokenizer.tokenize(query)
+        token_ids = np.array(tokenizer._convert_tokens_to_ids(tokens), dtype='int32')
+        # 第一段是问题，之后每列一段
+        segments.extend(np.split(token_ids, np.cumsum(tokens_lens)[:-1]))
+        num_cols.append(len(query.table.header))
+    save_ragged(prefix + '.segments', segments)
+    np.save(prefix + '.num_cols.npy', np.array(num_cols, dtype='int64'))
+    with open(prefix + '.sqls.json', 'w') as f:
+        json.dump([dict(query.sql) for query in queries], f, ensure_ascii=False)
+
+
+class EncodedQuery:
+    """
+    Stand-in for a Query in a DataSequence over `EncodedQueries`: only its
+    position, its sql and the number of columns of its table
+    """
+    __slots__ = ('index', 'sql', 'table')
+
+    def __init__(self, index, sql, num_cols):
+        self.index = index
+        self.sql = sql
+        self.table = SimpleNamespace(header=range(num_cols))
+
+
+class EncodedQueries:
+    """
+    Read-only, memory mapped queries saved by `save_encoded_queries`. Use it as
+    the data of a DataSequence (column_window=False) together with its
+    `tokenizer`, the batches are the same as with the original queries and
+    QueryTokenizer.
+    """
+    def __init__(self, prefix):
+        self.segments = RaggedArray(prefix + '.segments')
+        self.num_cols = np.load(prefix + '.num_cols.npy')
+        self.segment_starts = np.concatenate([[0], np.cumsum(self.num_cols + 1)])
+        with open(prefix + '.sqls.json') as f:
+            self.sqls = [SQL.from_dict(sql) for sql in json.load(f)]
+        self.tokenizer = EncodedQueryTokenizer(self)
+
+    def __len__(self):
+        return len(self.num_cols)
+
+    def __getitem__(self, i):
+        return EncodedQuery(i, self.sqls[i], int(self.num_cols[i]))
+
+
+class EncodedQueryTokenizer:
+    """
+    `encode` of QueryTokenizer reading the saved token ids of an `EncodedQueries`
+    """
+    def __init__(self, encoded_queries):
+        self.encoded_queries = encoded_queries
+
+    def encode(self, query: EncodedQuery, col_orders=None):
+        segments = self.encoded_queries.segments
+        start = self.encoded_queries.segment_starts[query.index]
+        if col_orders is None:
+            col_orders = np.arange(len(query.table.header))
+        parts = [segments[start]] + [segments[start + 1 + col_id] for col_id in col_orders]
+        token_ids = np.concatenate(parts).tolist()
+        segment_ids = [0] * len(token_ids)
+        header_indices = np.cumsum([len(part) for part in parts])
+        return token_ids, segment_ids, header_indices[:-1]
+
+
+# output sizes
+num_sel_agg = len(SQL.agg_sql_dict) + 1
+num_cond_op = len(SQL.op_sql_dict) + 1
+num_cond_conn_op = len(SQL.conn_sql_dict)
+
+
+def seq_gather(x):
+    seq, idxs = x
+    idxs = K.cast(idxs, 'int32')
+    return K.tf.batch_gather(seq, idxs)
+
+
+def build_model(bert_model, hidden_size=None, heads=None):
+    """
+    If `hidden_size` is set, `bert_model` is the upper part of a split encoder
+    (see nl2sql.utils.feature_cache.split_bert): it takes the cached hidden
+    states of the frozen lower layers as input `input_hidden_states`, in place
+    of the segment ids.
+    If `heads` (a model built by this function) is given, its output layers are
+    reused instead of creating new ones, so the two models share every weight.
+    """
+    def output_layer(units, name):
+        if heads is not None:
+            return heads.get_layer(name)
+        return Dense(units, activation='softmax', name=name)
+
+    # Input 这个方法似乎会默认在你指定的shape前面再加一个None的维度，比如你指定shape为(3,4)，那么实际上创建的tensor的维度为(None, 3, 4)，可能是需要默认创建batch维度
+    inp_token_ids = Input(shape=(None,), name='input_token_ids', dtype='int32')
+    inp_segment_ids = Input(shape=(None,), name='input_segment_ids', dtype='int32')
+    inp_header_ids = Input(shape=(None,), name='input_header_ids', dtype='int32')
+    inp_header_mask = Input(shape=(None, ), name='input_header_mask')
+
+    if hidden_size:
+        inp_hidden_states = Input(shape=(None, hidden_size), name='input_hidden_states')
+        bert_inputs = [inp_token_ids, inp_hidden_states]
+    else:
+        bert_inputs = [inp_token_ids, inp_segment_ids]
+
+    x = bert_model(bert_inputs)  # (None, seq_len, 768)  # x的这三个维度，None是batch维度，seq_len是序列维度，768是bert输出的embedding的长度？？？
+
+    # predict cond_conn_op。预测条件连接符
+    # x有三个维度，下面x[:, 0]这样的写法是对前两个维度进行索引，相当于x[:, 0, :]
+    # 从bert的输出序列中只取第一个元素用于条件连接符预测
+    x_for_cond_conn_op = Lambda(lambda x: x[:, 0])(x)  # (None, 768)
+    p_cond_conn_op = output_layer(num_cond_conn_op, 'output_cond_conn_op')(x_for_cond_conn_op)
+
+    # predict sel_agg。预测查询列及聚合函数
+    # 下面这个这里应用seq_gather方法（其中用到batch_gather方法），使得bert输出序列中，只有对应于列名起始位置的元素被应用到预测查询列及聚合函数中，这样处理后，列名的长度（列名包含的字符数）就不再是一个变量。
+    x_for_header = Lambda(seq_gather, name='header_seq_gather')([x, inp_header_ids])  # (None, h_len, 768)
+    header_mask = Lambda(lambda x: K.expand_dims(x, axis=-1))(inp_header_mask)  # (None, h_len, 1) # h_len 是列数
+
+    x_for_header = Multiply()([x_for_header, header_mask])  # 逐元素相乘
+    x_for_header = Masking()(x_for_header)
+
+    p_sel_agg = output_layer(num_sel_agg, 'output_sel_agg')(x_for_header)
+
+    # 预测条件列及逻辑运算符
+    x_for_cond_op = Concatenate(axis=-1)([x_for_header, p_sel_agg])  # 把预测查询列及聚合函数得到的概率，和bert输出的对应列的embedding拼接到一起
+    p_cond_op = output_layer(num_cond_op, 'output_cond_op')(x_for_cond_op)
+
+    model = Model(
+        bert_inputs + [inp_header_ids, inp_header_mask],
+        [p_cond_conn_op, p_sel_agg, p_cond_op]
+    )
+    return model
+
+
+def construct_model(paths, num_gpus=1, learning_rate=1e-5, accum_steps=1, num_frozen_layers=0):
+    bert_model = load_trained_model_from_checkpoint(paths.config, paths.checkpoint, seq_len=None)
+    freeze_bert_layers(bert_model, num_frozen_layers)
+
+    model = build_model(bert_model)
+    if num_gpus > 1:
+        print('using {} gpus'.format(num_gpus))
+        model = multi_gpu_model(model, gpus=num_gpus)
+
+    model.compile(
+        loss='sparse_categorical_crossentropy',
+        optimizer=RAdam(lr=learning_rate, accum_steps=accum_steps)
+    )
+    return model
+
+
+def outputs_to_sqls(preds_cond_conn_op, preds_sel_agg, preds_cond_op, header_lens, label_encoder):
+    """
+    Generate sqls from model outputs
+    """
+    return label_encoder.decode_batch(preds_cond_conn_op, preds_sel_agg, preds_cond_op,
+                                      header_lens).to_dicts()
+
+
+def merge_column_windows(preds_cond_conn_op, preds_sel_agg, preds_cond_op,
+                         row_query_ids, row_col_orders, header_lens):
+    """
+    Merge the outputs of the column windows back to one row per query.
+    cond_conn_op is averaged over the windows of a query (all zeros for a
+    query without windows), columns that did not fit in any window are
+    predicted as not selected.
+    """
+    num_queries = len(header_lens)
+    max_num_cols = max(header_lens)
+
+    merged_cond_conn_op = np.zeros((num_queries, preds_cond_conn_op.shape[-1]), dtype=preds_cond_conn_op.dtype)
+    np.add.at(merged_cond_conn_op, row_query_ids, preds_cond_conn_op)
+    num_windows = np.bincount(np.asarray(row_query_ids, dtype='int64'), minlength=num_queries)
+    # 没有任何窗口的 query（如表头为空）保持全 0，不做除法
+    merged_cond_conn_op /= np.maximum(num_windows, 1)[:, None]
+
+    merged_sel_agg = np.zeros((num_queries, max_num_cols, num_sel_agg), dtype=preds_sel_agg.dtype)
+    merged_sel_agg[..., -1] = 1
+    merged_cond_op = np.zeros((num_queries, max_num_cols, num_cond_op), dtype=preds_cond_op.dtype)
+    merged_cond_op[..., -1] = 1
+    for row_id, (query_id, col_orders) in enumerate(zip(row_query_ids, row_col_orders)):
+        merged_sel_agg[query_id, col_orders] = preds_sel_agg[row_id, :len(col_orders)]
+        merged_cond_op[query_id, col_orders] = preds_cond_op[row_id, :len(col_orders)]
+    return merged_cond_conn_op, merged_sel_agg, merged_cond_op
+
+
+def predict_decoded(model, dataseq, progress=None):
+    """
+    Run model1 over a non-training DataSequence, returns a `DecodedSqls`
+    """
+    decoded_list = []
+    batch_ids = range(len(dataseq))
+    if progress is not None:
+        batch_ids = progress(batch_ids)
+    for batch_id in batch_ids:
+        if dataseq.column_window:
+            batch_data, _, row_query_ids, row_col_orders = dataseq.get_window_batch(batch_id)
+            header_lens = [len(query.table.header) for query in dataseq.batch_data(batch_id)]
+            with metrics.timer('model1_predict_batch_seconds'):
+                preds = model.predict_on_batch(batch_data)
+            preds = merge_column_windows(*preds, row_query_ids, row_col_orders, header_lens)
+        else:
+            batch_data = dataseq[batch_id]
+            if isinstance(batch_data, tuple):
+                batch_data = batch_data[0]
+            header_lens = np.sum(batch_data['input_header_mask'], axis=-1)
+            with metrics.timer('model1_predict_batch_seconds'):
+                preds = model.predict_on_batch(batch_data)
+        preds_cond_conn_op, preds_sel_agg, preds_cond_op = preds
+        with metrics.timer('model1_decode_batch_seconds'):
+            decoded_list.append(dataseq.label_encoder.decode_batch(preds_cond_conn_op, preds_sel_agg,
+                                                                   preds_cond_op, header_lens))
+        metrics.inc('model1_queries_predicted_total', len(header_lens))
+    return DecodedSqls.concatenate(decoded_list)
+
+
+def predict_sqls(model, dataseq, progress=None):
+    """
+    Run model1 over a non-training DataSequence and decode the sqls
+    """
+    return predict_decoded(model, dataseq, progress=progress).to_dicts()
+
+
+def evaluate_sqls(pred_sqls, true_sqls):
+    """
+    Logical form accuracies of model1 predictions (cond values are not compared)
+    """
+    conn_correct = 0
+    agg_correct = 0
+    conds_correct = 0
+    conds_col_id_correct = 0
+    all_correct = 0
+    num_queries = len(true_sqls)
+
+    for pred_sql, true_sql in zip(pred_sqls, true_sqls):
+        n_correct = 0
+        if pred_sql['cond_conn_op'] == true_sql.cond_conn_op:
+            conn_correct += 1
+            n_correct += 1
+
+        pred_aggs = set(zip(pred_sql['sel'], pred_sql['agg']))
+        true_aggs = set(zip(true_sql.sel, true_sql.agg))
+        if pred_aggs == true_aggs:
+            agg_correct += 1
+            n_correct += 1
+
+        pred_conds = set([(cond[0], cond[1]) for cond in pred_sql['conds']])
+        true_conds = set([(cond[0], cond[1]) for cond in true_sql.conds])
+
+        if pred_conds == true_conds:
+            conds_correct += 1
+            n_correct += 1
+
+        pred_conds_col_ids = set([cond[0] for cond in pred_sql['conds']])
+        true_conds_col_ids = set([cond[0] for cond in true_sql['conds']])
+        if pred_conds_col_ids == true_conds_col_ids:
+            conds_col_id_correct += 1
+
+        if n_correct == 3:
+            all_correct += 1
+
+    return {
+        'conn_acc': conn_correct / num_queries,
+        'agg_acc': agg_correct / num_queries,
+        'conds_acc': conds_correct / num_queries,
+        'conds_col_id_acc': conds_col_id_correct / num_queries,
+        'total_acc': all_correct / num_queries
+    }
+
+
+def encode_true_sqls(true_sqls, num_cols):
+    """
+    Encode ground truth sqls into the array form of `DecodedSqls`.
+
+    Returns the arrays and a (num_queries,) bool array `agg_exact` / `conds_exact`
+    telling whether the sel / conds of a query are fully described by them: a sql
+    with a column id >= num_cols or one column with several aggs / ops can never
+    be predicted by model1, and is counted as wrong in `evaluate_decoded`
+    """
+    num_queries = len(true_sqls)
+    cond_conn_op = np.zeros(num_queries, dtype='int64')
+    agg_ids = np.zeros((num_queries, num_cols), dtype='int64')
+    sel_mask = np.zeros((num_queries, num_cols), dtype=bool)
+    op_ids = np.zeros((num_queries, num_cols), dtype='int64')
+    cond_mask = np.zeros((num_queries, num_cols), dtype=bool)
+    agg_exact = np.ones(num_queries, dtype=bool)
+    conds_exact = np.ones(num_queries, dtype=bool)
+    cond_cols_exact = np.ones(num_queries, dtype=bool)
+
+    for i, sql in enumerate(true_sqls):
+        cond_conn_op[i] = sql.cond_conn_op
+        for col_id, agg_op in set(zip(sql.sel, sql.agg)):
+            if col_id >= num_cols or sel_mask[i, col_id]:
+                agg_exact[i] = False
+                continue
+            sel_mask[i, col_id] = True
+            agg_ids[i, col_id] = agg_op
+        for col_id, cond_op in set((cond[0], cond[1]) for cond in sql.conds):
+            if col_id >= num_cols:
+                conds_exact[i] = cond_cols_exact[i] = False
+                continue
+            if cond_mask[i, col_id]:
+                conds_exact[i] = False
+                continue
+            cond_mask[i, col_id] = True
+            op_ids[i, col_id] = cond_op
+
+    decoded = DecodedSqls(cond_conn_op, agg_ids, sel_mask, op_ids, cond_mask)
+    return decoded, agg_exact, conds_exact, cond_cols_exact
+
+
+def evaluate_decoded(decoded, true_sqls):
+    """
+    Same metrics as `evaluate_sqls`, computed on the arrays of a `DecodedSqls`
+    """
+    num_cols = decoded.agg_ids.shape[1]
+    true, agg_exact, conds_exact, cond_cols_exact = encode_true_sqls(true_sqls, num_cols)
+
+    conn_correct = decoded.cond_conn_op == true.cond_conn_op
+    agg_correct = agg_exact & np.all(
+        (decoded.sel_mask == true.sel_mask) & (~true.sel_mask | (decoded.agg_ids == true.agg_ids)), axis=1)
+    cond_cols_correct = np.all(decoded.cond_mask == true.cond_mask, axis=1)
+    conds_correct = conds_exact & cond_cols_correct & np.all(
+        ~true.cond_mask | (decoded.op_ids == true.op_ids), axis=1)
+    cond_cols_correct &= cond_cols_exact
+    all_correct = conn_correct & agg_correct & conds_correct
+
+    return {
+        'conn_acc': float(conn_correct.mean()),
+        'agg_acc': float(agg_correct.mean()),
+        'conds_acc': float(conds_correct.mean()),
+        'conds_col_id_acc': float(cond_cols_correct.mean()),
+        'total_acc': float(all_correct.mean())
+    }
+
+
+def stratified_sample(data, sample_size, seed=42):
+    """
+    Sample `sample_size` queries keeping the proportion of every
+    (cond_conn_op, number of sel, number of conds) group
+    """
+    groups = {}
+    for i, query in enumerate(data):
+        key = (query.sql.cond_conn_op, len(query.sql.sel), len(query.sql.conds))
+        groups.setdefault(key, []).append(i)
+
+    rng = np.random.RandomState(seed)
+    ratio = min(1.0, sample_size / len(data))
+    indices = []
+    for key in sorted(groups):
+        group = groups[key]
+        num_samples = max(1, int(round(len(group) * ratio)))
+        indices.extend(rng.choice(group, min(num_samples, len(group)), replace=False))
+    return [data[i] for i in sorted(indices)]
+
+
+class EvaluateCallback(Callback):
+    """
+    Evaluate on the val set with the encoded batches cached once.
+
+    params:
+        - sample_size: 如果设置，每个 epoch 结束（以及每 eval_steps 个 batch）只在固定的分层采样子集上评估，
+          训练结束时再在完整的 val 集上评估一次，结果保存在 full_metrics
+        - eval_steps: 每隔多少个 batch 在子集上评估一次，None 表示只在 epoch 结束时评估
+    """
+    def __init__(self, val_dataseq, sample_size=None, eval_steps=None, seed=42):
+        self.val_dataseq = val_dataseq
+        self.sample_size = sample_size
+        self.eval_steps = eval_steps
+        self.seed = seed
+        self.full_metrics = None
+        self.step_history = []
+        self._full_seq = None
+        self._sample_seq = None
+        self._steps = 0
+
+    def _subset_dataseq(self, data):
+        dataseq = self.val_dataseq
+        return DataSequence(data, dataseq.tokenizer, dataseq.label_encoder, is_train=False,
+                            max_len=dataseq.max_len, batch_size=dataseq.batch_size, shuffle=False,
+                            shuffle_header=False, column_window=dataseq.column_window)
+
+    def _get_full_seq(self):
+        if self._full_seq is None:
+            self._full_seq = EncodedSequence(self.val_dataseq)
+        return self._full_seq
+
+    def _get_eval_seq(self):
+        if self.sample_size is None or self.sample_size >= len(self.val_dataseq.data):
+            return self._get_full_seq()
+        if self._sample_seq is None:
+            data = stratified_sample(self.val_dataseq.data, self.sample_size, self.seed)
+            self._sample_seq = EncodedSequence(self._subset_dataseq(data))
+        return self._sample_seq
+
+    def evaluate(self, dataseq):
+        decoded = predict_decoded(self.model, dataseq)
+        return evaluate_decoded(decoded, [query.sql for query in dataseq.data])
+
+    def on_batch_end(self, batch, logs=None):
+        self._steps += 1
+        if self.eval_steps and self._steps % self.eval_steps == 0:
+            scores = self.evaluate(self._get_eval_seq())
+            self.step_history.append((self._steps, scores))
+            print(' - step {} sampled val total_acc: {:.4f}'.format(self._steps, scores['total_acc']))
+
+    def on_epoch_end(self, epoch, logs=None):
+        scores = self.evaluate(self._get_eval_seq())
+
+        for name in ['conn_acc', 'agg_acc', 'conds_acc', 'conds_col_id_acc', 'total_acc']:
+            print('{}: {}'.format(name, scores[name]))
+
+        logs['val_tot_acc'] = scores['total_acc']
+        logs['conn_acc'] = scores['conn_acc']
+        logs['conds_acc'] = scores['conds_acc']
+        logs['conds_col_id_acc'] = scores['conds_col_id_acc']
+
+    def on_train_end(self, logs=None):
+        if self._get_eval_seq() is self._get_full_seq():
+            return
+        self.full_metrics = self.evaluate(self._get_full_seq())
+        print('~~ full val set:')
+        for name in ['conn_acc', 'agg_acc', 'conds_acc', 'conds_col_id_acc', 'total_acc']:
+            print('{}: {}'.format(name, self.full_metrics[name]))
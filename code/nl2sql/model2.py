@@ -0,0 +1,639 @@
+import math
+import json
+import re
+import random
+import numpy as np
+from collections import defaultdict
+
+import cn2an
+from tqdm import tqdm_notebook as tqdm
+from keras_bert import load_vocabulary, Tokenizer, load_trained_model_from_checkpoint
+from keras.utils.data_utils import Sequence
+from keras.preprocessing.sequence import pad_sequences
+from keras.layers import Input, Lambda, Dense
+from keras.models import Model
+from keras.optimizers import Adam
+from keras.utils import multi_gpu_model
+
+from nl2sql.utils import metrics
+from nl2sql.utils.memory import current_rss, pair_nbytes
+from nl2sql.utils.executor import NumericIndex
+from nl2sql.utils.layer_freezing import freeze_bert_layers
+from nl2sql.utils.pretokenized import save_ragged, RaggedArray
+
+
+def is_float(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def cn_to_an(string):
+    try:
+        return str(cn2an.cn2an(string, 'normal'))
+    except ValueError:
+        return string
+
+
+def an_to_cn(string):
+    try:
+        return str(cn2an.an2cn(string))
+    except ValueError:
+        return string
+
+
+def str_to_num(string):
+    try:
+        float_val = float(cn_to_an(string))
+        if int(float_val) == float_val:
+            return str(int(float_val))
+        else:
+            return str(float_val)
+    except ValueError:
+        return None
+
+
+def str_to_year(string):
+    year = string.replace('年', '')
+    year = cn_to_an(year)
+    if is_float(year) and float(year) < 1900:
+        year = int(year) + 2000
+        return str(year)
+    else:
+        return None
+
+
+def load_json(json_file):
+    result = []
+    if json_file:
+        with open(json_file) as file:
+            for line in file:
+                result.append(json.loads(line))
+    return result
+
+
+class QuestionCondPair:
+    def __init__(self, query_id, question, cond_text, cond_sql, label):
+        self.query_id = query_id
+        self.question = question  # 查询文本
+        self.cond_text = cond_text  # 拼凑出来的查询条件的文本形式，如“影片名称是密室逃生”
+        self.cond_sql = cond_sql  # cond_text对应的sql形式
+        self.label = label  # 拼凑出的查询条件cond_sql是否真的出现在正确的查询条件中
+
+    def __repr__(self):
+        repr_str = ''
+        repr_str += 'query_id: {}\n'.format(self.query_id)
+        repr_str += 'question: {}\n'.format(self.question)
+        repr_str += 'cond_text: {}\n'.format(self.cond_text)
+        repr_str += 'cond_sql: {}\n'.format(self.cond_sql)
+        repr_str += 'label: {}\n'.format(self.label)
+        return repr_str
+
+
+class NegativeSampler:
+    """
+    从 question - cond pairs 中采样
+    """
+    def __init__(self, neg_sample_ratio=10):
+        self.neg_sample_ratio = neg_sample_ratio
+
+    def sample(self, data):  # data是一个QuestionCondPairsDataset对象
+        positive_data = [d for d in data if d.label == 1]
+        negative_data = [d for d in data if d.label == 0]
+        negative_sample = random.sample(negative_data,
+                                        len(positive_data) * self.neg_sample_ratio)
+        return positive_data + negative_sample
+
+
+class FullSampler:
+    """
+    不抽样，返回所有的 pairs
+
+    """
+    def sample(self, data):  # data是一个QuestionCondPairsDataset对象
+        return data
+
+
+class CandidateCondsExtractor:
+    """
+    params:
+        - share_candidates: 在同 table 同 column 中共享 real 型 candidates
+    """
+    CN_NUM = '〇一二三四五六七八九零壹贰叁肆伍陆柒捌玖貮两'
+    CN_UNIT = '十拾百佰千仟万萬亿億兆点'
+
+    def __init__(self, share_candidates=True):
+        self.share_candidates = share_candidates
+        self._cached = False
+        self._numeric_indexes = {}
+
+    def numeric_index(self, table):
+        """
+        Sorted index of the real columns of `table`, built once per table content
+        """
+        if table.content_hash not in self._numeric_indexes:
+            self._numeric_indexes[table.content_hash] = NumericIndex(table)
+        return self._numeric_indexes[table.content_hash]
+
+    @metrics.timed('build_candidate_cache_seconds')
+    def build_candidate_cache(self, queries):
+        self.cache = defaultdict(set)
+        self._queries = queries
+        self._table_queries = defaultdict(list)  # table id -> 该表上的 query 下标，用于表更新后局部重建
+        print('building candidate cache')
+        for query_id, query in tqdm(enumerate(queries), total=len(queries)):
+            self._table_queries[query.table.id].append(query_id)
+            value_in_question = self.extract_values_from_text(query.question.text)
+            num_candidates = 0
+
+            for col_id in range(len(query.table.header)):
+                cond_values = self.column_candidates(query, col_id, value_in_question)
+                cache_key = self.get_cache_key(query_id, query, col_id)
+                self.cache[cache_key].update(cond_values)
+                num_candidates += len(cond_values)
+            metrics.observe('candidates_per_query', num_candidates, metrics.COUNT_BUCKETS)
+        self._cached = True
+
+    def column_candidates(self, query, col_id, value_in_question):
+        col_type = query.table.header.types[col_id]
+        value_in_column = self.extract_values_from_column(query, col_id)
+        if col_type == 'text':
+            cond_values = value_in_column
+        elif col_type == 'real':
+            if len(value_in_column) == 1:  # 这是什么原理？从列里面匹配到了唯一值，才认为它是一个值？
+                cond_values = value_in_column + value_in_question
+            else:
+                cond_values = value_in_question
+        return cond_values
+
+    def refresh_table(self, table, changed_col_ids=None, old_content_hash=None):
+        """
+        After `table` replaced an older version of it (see `Tables.subscribe`),
+        point the queries on it to the new version and rebuild only the
+        candidates of its changed columns, and the changed columns of its
+        numeric index
+        """
+        if changed_col_ids is None:
+            changed_col_ids = set(range(len(table.header)))
+        numeric_index = self._numeric_indexes.pop(old_content_hash, None)
+        if numeric_index is not None:
+            numeric_index.refresh(table, changed_col_ids)
+            self._numeric_indexes[table.content_hash] = numeric_index
+        if not self._cached:
+            return
+
+        # 只删除该表上 query 的变化列（以及表头变窄后多出的列）的缓存，不扫描整个缓存
+        num_cols = len(table.header)
+        query_ids = self._table_queries.get(table.id, [])
+        for query_id in query_ids:
+            query = self._queries[query_id]
+            stale_col_ids = set(changed_col_ids) | set(range(num_cols, len(query.table.header)))
+            for col_id in stale_col_ids:
+                self.cache.pop(self.get_cache_key(query_id, query, col_id), None)
+        for query_id in query_ids:
+            query = self._queries[query_id]
+            query.table = table
+            value_in_question = self.extract_values_from_text(query.question.text)
+            for col_id in changed_col_ids:
+                cache_key = self.get_cache_key(query_id, query, col_id)
+                self.cache[cache_key].update(self.column_candidates(query, col_id, value_in_question))
+        metrics.inc('candidate_cache_refreshes_total')
+
+    def get_cache_key(self, query_id, query, col_id):
+        if self.share_candidates:
+            return (query.table.id, col_id)
+        else:
+            return (query_id, query.table.id, col_id)
+
+    def extract_year_from_text(self, text):
+        values = []
+        num_year_texts = re.findall(r'[0-9][0-9]年', text)
+        values += ['20{}'.format(text[:-1]) for text in num_year_texts]
+        cn_year_texts = re.findall(r'[{}][{}]年'.format(self.CN_NUM, self.CN_NUM), text)
+        cn_year_values = [str_to_year(text) for text in cn_year_texts]
+        values += [value for value in cn_year_values if value is not None]
+        return values
+
+    def extract_num_from_text(self, text):
+        values = []
+        num_values = re.findall(r'[-+]?[0-9]*\.?[0-9]+', text)
+        values += num_values
+
+        cn_num_unit = self.CN_NUM + self.CN_UNIT
+        cn_num_texts = re.findall(r'[{}]*\.?[{}]+'.format(cn_num_unit, cn_num_unit), text)
+        cn_num_values = [str_to_num(text) for text in cn_num_texts]
+        values += [value for value in cn_num_values if value is not None]
+
+        cn_num_mix = re.findall(r'[0-9]*\.?[{}]+'.format(self.CN_UNIT), text)
+        for word in cn_num_mix:
+            num = re.findall(r'[-+]?[0-9]*\.?[0-9]+', word)
+            for n in num:
+                word = word.replace(n, an_to_cn(n))
+            str_num = str_to_num(word)
+            if str_num is not None:
+                values.append(str_num)
+        return values
+
+    def extract_values_from_text(self, text):
+        values = []
+        values += self.extract_year_from_text(text)
+        values += self.extract_num_from_text(text)
+        return list(set(values))
+
+    def extract_values_from_column(self, query, col_ids):
+        question = query.question.text
+        question_chars = set(query.question.text)  # 查询文本中的所有字符集合
+        unique_col_values = set(query.table.df.iloc[:, col_ids].astype(str))  # 该列中的所有值构成的集合
+        select_col_values = [v for v in unique_col_values
+                             if (question_chars & set(v))]  # 列里面的值和查询文本有重合的字符，才认为该值是一个value
+        return select_col_values
+
+
+class QuestionCondPairsDataset:
+    """
+    question - cond pairs 数据集
+    """
+    OP_PATTERN = {
+        'real':
+        [
+            {'cond_op_idx': 0, 'pattern': '{col_name}大于{value}'},
+            {'cond_op_idx': 1, 'pattern': '{col_name}小于{value}'},
+            {'cond_op_idx': 2, 'pattern': '{col_name}是{value}'}
+        ],
+        'text':
+        [
+            {'cond_op_idx': 2, 'pattern': '{col_name}是{value}'}
+        ]
+    }
+
+    def __init__(self, queries, candidate_extractor, has_label=True, model_1_outputs=None,
+                 prune_empty_conds=False):
+        self.candidate_extractor = candidate_extractor
+        self.has_label = has_label  # 如果是训练集，has_label为True，如果是测试集则为False
+        self.model_1_outputs = model_1_outputs
+        self.prune_empty_conds = prune_empty_conds  # 丢弃在表中选不出任何行的 real 列数值条件，不送入 bert 打分
+        self.data = self.build_dataset(queries)
+
+    def build_dataset(self, queries):
+        if not self.candidate_extractor._cached:
+            self.candidate_extractor.build_candidate_cache(queries)
+
+        with metrics.timer('build_pairs_seconds'):
+            pair_data = self._build_pairs(queries)
+        metrics.inc('pairs_total', len(pair_data))
+        return pair_data
+
+    def _build_pairs(self, queries):
+        pair_data = []
+        for _, query_pairs in self.iter_query_pairs(queries):
+            pair_data += query_pairs
+        return pair_data
+
+    def iter_query_pairs(self, queries):
+        """
+        Yield (query_id, pairs of the query) one query at a time
+        """
+        for query_id, query in enumerate(queries):
+            query_pairs = []
+            select_col_id = self.get_select_col_id(query_id, query)
+            for col_id, (col_name, col_type) in enumerate(query.table.header):
+                if col_id not in select_col_id:
+                    continue
+
+                cache_key = self.candidate_extractor.get_cache_key(query_id, query, col_id)
+                # 候选值缓存是 set，排序后 pair 的顺序不依赖 PYTHONHASHSEED，各进程一致
+                values = sorted(self.candidate_extractor.cache.get(cache_key, []))
+                pattern = self.OP_PATTERN.get(col_type, [])
+                pairs = self.generate_pairs(query_id, query, col_id, col_name,
+                                            values, pattern)
+                metrics.observe('pairs_per_column', len(pairs), metrics.COUNT_BUCKETS)
+                query_pairs += pairs
+            yield query_id, query_pairs
+
+    def get_select_col_id(self, query_id, query):
+        if self.model_1_outputs:
+            select_col_id = [cond_col for cond_col, *_ in self.model_1_outputs[query_id]['conds']]
+        elif self.has_label:
+            select_col_id = [cond_col for cond_col, *_ in query.sql.conds]
+        else:
+            select_col_id = list(range(len(query.table.header)))
+        return select_col_id
+
+    def generate_pairs(self, query_id, query, col_id, col_name, values, op_patterns):
+        pairs = []
+        numeric_index = None
+        if self.prune_empty_conds:
+            numeric_index = self.candidate_extractor.numeric_index(query.table)
+        for value in values:
+            for op_pattern in op_patterns:
+                if numeric_index is not None and not numeric_index.selects_any(col_id, op_pattern['cond_op_idx'], value):
+                    metrics.inc('pruned_pairs_total')
+                    continue
+                cond = op_pattern['pattern'].format(col_name=col_name, value=value)
+                cond_sql = (col_id, op_pattern['cond_op_idx'], value)  # 拼凑出一个查询条件
+                real_sql = {}
+                if self.has_label:
+                    real_sql = {tuple(c) for c in query.sql.conds}  # real_sql是一个集合，集合里面的元素是tuple类型
+                label = 1 if cond_sql in real_sql else 0  # 拼凑出的查询条件是否真的出现在正确的查询条件中
+                pair = QuestionCondPair(query_id, query.question.text,
+                                        cond, cond_sql, label)
+                pairs.append(pair)
+        return pairs
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+
+class SimpleTokenizer(Tokenizer):
+    def _tokenize(self, text):
+        R = []
+        for c in text:
+            if c in self._token_dict:
+                R.append(c)
+            elif self._is_space(c):
+                R.append('[unused1]')
+            else:
+                R.append('[UNK]')
+        return R
+
+
+def build_model(bert_model, hidden_size=None, heads=None):
+    """
+    If `hidden_size` is set, `bert_model` is the upper part of a split encoder
+    taking the cached lower layer hidden states `input_hidden_states` in place of x2.
+    If `heads` (a model built by this function) is given, its output layer is
+    reused, so the two models share every weight.
+    """
+    # x1是QuestionCondPair的question字段和cond_text字段的拼接。x2是拼接的segment_ids。x2的长度和x1一样。在x2中，对应于x1中question的位置为0,对应于x1中cond_text的位置为1
+    # （question是查询文本，cond_text是拼凑出来的查询条件的文本形式，如“影片名称是密室逃生”）
+    # y是“cond_text是question中包含的查询条件“的概率
+    # x1、x2、y都在QuestionCondPairsDataseq类的__getitem__方法中构造
+    x1_in = Input(shape=(None,), name='input_x1', dtype='int32')
+    if hidden_size:
+        x2_in = Input(shape=(None, hidden_size), name='input_hidden_states')
+    else:
+        x2_in = Input(shape=(None,), name='input_x2')
+    x = bert_model([x1_in, x2_in])
+    x_cls = Lambda(lambda x: x[:, 0])(x)  # 取bert输出序列的第1个元素
+    if heads is not None:
+        output_similarity = heads.get_layer('output_similarity')
+    else:
+        output_similarity = Dense(1, activation='sigmoid', name='output_similarity')
+    y_pred = output_similarity(x_cls)
+
+    model = Model([x1_in, x2_in], y_pred)
+    return model
+
+
+def construct_model(paths, use_multi_gpus=False, num_frozen_layers=0, learning_rate=1e-5):
+    token_dict = load_vocabulary(paths.vocab)
+    tokenizer = SimpleTokenizer(token_dict)
+
+    bert_model = load_trained_model_from_checkpoint(
+        paths.config, paths.checkpoint, seq_len=None)
+    freeze_bert_layers(bert_model, num_frozen_layers)
+
+    model = build_model(bert_model)
+    if use_multi_gpus:
+        print('using multi-gpus')
+        model = multi_gpu_model(model, gpus=2)
+
+    model.compile(loss={'output_similarity': 'binary_crossentropy'},
+                  optimizer=Adam(learning_rate),
+                  metrics={'output_similarity': 'accuracy'})
+
+    return model, tokenizer
+
+
+class QuestionCondPairsDataseq(Sequence):
+    TOKEN_IDS_INPUT = 'input_x1'
+
+    def __init__(self, dataset, tokenizer, is_train=True, max_len=120,
+                 sampler=None, shuffle=False, batch_size=32):
+        self.dataset = dataset  # QuestionCondPairsDataset类型，遍历它，得到的元素是QuestionCondPair类型
+        self.tokenizer = tokenizer  # SimpleTokenizer类型，只是把字符串作一些简单的替换，比如将换行符、空格、缩进统一替换为空白符，未知字符统一替换为unknown
+        self.is_train = is_train
+        self.max_len = max_len
+        self.sampler = sampler
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        self.on_epoch_end()  # 这里面初始化了self.data，self.data是包含QuestionCondPair类型元素的list，在self.dataset的基础上经过采样，随机舍弃一些负样本
+
+    def _pad_sequences(self, seqs, max_len=None):
+        return pad_sequences(seqs, maxlen=max_len, padding='post', truncating='post')
+
+    @metrics.timed('model2_encode_batch_seconds')
+    def __getitem__(self, batch_id):
+        batch_data_indices = \
+            self.global_indices[batch_id * self.batch_size: (batch_id + 1) * self.batch_size]
+        batch_data = [self.data[i] for i in batch_data_indices]
+        metrics.observe('model2_batch_fill', len(batch_data) / self.batch_size, metrics.FILL_BUCKETS)
+
+        X1, X2 = [], []
+        Y = []
+
+        for data in batch_data:  # data是QuestionCondPair类型
+            x1, x2 = self.encode_pair(data)
+            X1.append(x1)
+            X2.append(x2)
+            if self.is_train:
+                Y.append([data.label])
+
+        X1 = self._pad_sequences(X1, max_len=self.max_len)
+        X2 = self._pad_sequences(X2, max_len=self.max_len)
+        inputs = {'input_x1': X1, 'input_x2': X2}
+        if self.is_train:
+            Y = self._pad_sequences(Y, max_len=1)
+            outputs = {'output_similarity': Y}
+            return inputs, outputs
+        else:
+            return inputs
+
+    def encode_pair(self, pair):
+        # self.tokenizer是SimpleTokenizer类型，继承自keras_bert.tokenizer.Tokenizer类型
+        # self.tokenizer.encode是keras_bert.tokenizer.Tokenizer里的方法，将first和second两个输入拼接到一起，返回的x1是拼接后的序列，x2则是segment_ids（也就是bert模型的第二个输入）,
+        return self.tokenizer.encode(first=pair.question.lower(), second=pair.cond_text.lower())
+
+    def on_epoch_end(self):
+        self.data = self.sampler.sample(self.dataset)  # 本来是负样本远多于正样本，为了使正样本不被负样本淹没，需要采样舍弃掉部分负样本，使得负样本与正样本的比例维持在合理范围内，比如负样本数量是正样本的10倍。
+        self.global_indices = np.arange(len(self.data))
+        if self.shuffle:
+            np.random.shuffle(self.global_indices)
+
+    def __len__(self):
+        return math.ceil(len(self.data) / self.batch_size)
+
+    def batch_keys(self, batch_id):
+        batch_data_indices = \
+            self.global_indices[batch_id * self.batch_size: (batch_id + 1) * self.batch_size]
+        return [(self.data[i].query_id, self.data[i].cond_sql) for i in batch_data_indices]
+
+    @staticmethod
+    def _pair_key(pair):
+        return json.dumps([pair.query_id] + list(pair.cond_sql), ensure_ascii=False)
+
+    def get_state(self):
+        # 采样结果以 (query_id, cond_sql) 保存，不依赖 pair 在 dataset 中的位置
+        return {
+            'sample_keys': np.array([self._pair_key(pair) for pair in self.data], dtype=str),
+            'global_indices': self.global_indices
+        }
+
+    def set_state(self, state):
+        pairs = {self._pair_key(pair): pair for pair in self.dataset}
+        try:
+            self.data = [pairs[key] for key in state['sample_keys'].tolist()]
+        except KeyError as e:
+            raise ValueError('checkpoint sample {} is not in the dataset, '
+                             'the data or the candidate extraction changed'.format(e))
+        self.global_indices = np.asarray(state['global_indices'])
+
+
+def save_encoded_pairs(prefix, dataset, tokenizer):
+    """
+    Tokenize every pair of a QuestionCondPairsDataset once (no truncation) and
+    save the token ids, the length of the question part, the labels, the
+    query ids and the cond sqls, to be read back by `EncodedPairs`
+    """
+    token_ids, first_lens = [], []
+    for pair in dataset:
+        x1, x2 = tokenizer.encode(first=pair.question.lower(), second=pair.cond_text.lower())
+        token_ids.append(x1)
+        first_lens.append(len(x2) - sum(x2))
+    save_ragged(prefix + '.token_ids', token_ids)
+    np.save(prefix + '.first_lens.npy', np.array(first_lens, dtype='int32'))
+    np.save(prefix + '.labels.npy', np.array([pair.label for pair in dataset], dtype='int8'))
+    np.save(prefix + '.query_ids.npy', np.array([pair.query_id for pair in dataset], dtype='int64'))
+    # cond_sql 用于 merge_result 以及 checkpoint 中保存采样结果的 key
+    with open(prefix + '.cond_sqls.json', 'w') as f:
+        json.dump([list(pair.cond_sql) for pair in dataset], f, ensure_ascii=False)
+
+
+class EncodedPair:
+    """
+    Stand-in for a QuestionCondPair in `EncodedPairsDataseq`
+    """
+    __slots__ = ('index', 'query_id', 'cond_sql', 'label')
+
+    def __init__(self, index, query_id, cond_sql, label):
+        self.index = index
+        self.query_id = query_id
+        self.cond_sql = cond_sql
+        self.label = label
+
+
+class EncodedPairs:
+    """
+    Read-only, memory mapped pairs saved by `save_encoded_pairs`, usable with
+    the samplers like a QuestionCondPairsDataset
+    """
+    def __init__(self, prefix):
+        self.token_ids = RaggedArray(prefix + '.token_ids')
+        self.first_lens = np.load(prefix + '.first_lens.npy', mmap_mode='r')
+        self.labels = np.load(prefix + '.labels.npy', mmap_mode='r')
+        self.query_ids = np.load(prefix + '.query_ids.npy', mmap_mode='r')
+        with open(prefix + '.cond_sqls.json') as f:
+            self.cond_sqls = [tuple(cond_sql) for cond_sql in json.load(f)]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return EncodedPair(i, int(self.query_ids[i]), self.cond_sqls[i], int(self.labels[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class EncodedPairsDataseq(QuestionCondPairsDataseq):
+    """
+    QuestionCondPairsDataseq over `EncodedPairs`, reading the saved token ids
+    instead of tokenizing, the batches are the same
+    """
+    def __init__(self, dataset, is_train=True, max_len=120, sampler=None, shuffle=False, batch_size=32):
+        super().__init__(dataset, None, is_train=is_train, max_len=max_len, sampler=sampler,
+                         shuffle=shuffle, batch_size=batch_size)
+
+    def encode_pair(self, pair):
+        x1 = self.dataset.token_ids[pair.index].tolist()
+        first_len = int(self.dataset.first_lens[pair.index])
+        return x1, [0] * first_len + [1] * (len(x1) - first_len)
+
+
+@metrics.timed('merge_result_seconds')
+def merge_result(qc_pairs, result, threshold):
+    select_result = defaultdict(set)
+    for pair, score in zip(qc_pairs, result):
+        if score > threshold:
+            select_result[pair.query_id].update([pair.cond_sql])
+    return dict(select_result)
+
+
+def _iter_pair_chunks(dataset, queries, memory_limit, batch_size):
+    chunk_pairs, max_pairs = [], None
+    for _, query_pairs in dataset.iter_query_pairs(queries):
+        if max_pairs is None and (chunk_pairs or query_pairs):
+            # 每个 pair 常驻的对象 + 一个 score，再留一半余量给编码后的 batch 和 keras 的中间结果
+            bytes_per_pair = pair_nbytes((chunk_pairs or query_pairs)[0]) + 4
+            max_pairs = max(batch_size, int((memory_limit - current_rss()) * 0.5 / bytes_per_pair))
+        if chunk_pairs and len(chunk_pairs) + len(query_pairs) > max_pairs:
+            yield chunk_pairs
+            chunk_pairs, max_pairs = [], None  # 下一个 chunk 按当时的 RSS 重新计算
+        chunk_pairs += query_pairs
+    if chunk_pairs:
+        yield chunk_pairs
+
+
+def predict_in_budget(model, queries, candidate_extractor, tokenizer, threshold, memory_limit,
+                      model_1_outputs=None, max_len=120, batch_size=128, tracker=None, prune_empty_conds=False):
+    """
+    Same result as building the QuestionCondPairsDataset of all `queries`,
+    scoring it with `predict_generator` and `merge_result`, but the pairs are
+    generated, scored and merged in chunks of whole queries, each chunk small
+    enough to keep the process RSS under `memory_limit` bytes.
+
+    params:
+        - tracker: MemoryTracker，记录每个 chunk 的内存
+    """
+    if not candidate_extractor._cached:
+        candidate_extractor.build_candidate_cache(queries)
+
+    # 同一个 dataset 依次装入每个 chunk 的 pairs，query_id 仍是在 queries 中的下标
+    chunk_dataset = QuestionCondPairsDataset([], candidate_extractor, has_label=False,
+                                             model_1_outputs=model_1_outputs,
+                                             prune_empty_conds=prune_empty_conds)
+    select_result = {}
+    for chunk_id, chunk_pairs in enumerate(_iter_pair_chunks(chunk_dataset, queries, memory_limit, batch_size)):
+        chunk_dataset.data = chunk_pairs
+        chunk_seq = QuestionCondPairsDataseq(chunk_dataset, tokenizer, is_train=False, max_len=max_len,
+                                             sampler=FullSampler(), shuffle=False, batch_size=batch_size)
+        if tracker is not None:
+            with tracker.stage('score_chunk_{}'.format(chunk_id)):
+                scores = model.predict_generator(chunk_seq)
+        else:
+            scores = model.predict_generator(chunk_seq)
+        select_result.update(merge_result(chunk_pairs, scores, threshold))
+        metrics.inc('pair_chunks_total')
+    chunk_dataset.data = []
+    return select_result
+
+
+def evaluate_pairs(scores, labels, threshold):
+    """
+    Pair level accuracy / precision / recall of the similarity scores at `threshold`
+    """
+    scores = np.asarray(scores).reshape(-1)
+    labels = np.asarray(labels).reshape(-1)
+    preds = (scores > threshold).astype('int32')
+    true_positive = float(np.sum(preds * labels))
+    return {
+        'pair_acc': float(np.mean(preds == labels)),
+        'precision': true_positive / max(np.sum(preds), 1),
+        'recall': true_positive / max(np.sum(labels), 1)
+    }
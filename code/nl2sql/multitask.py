@@ -0,0 +1,122 @@
+import time
+import numpy as np
+from collections import defaultdict
+
+from keras.models import Model
+from keras.optimizers import Adam
+from keras_bert import load_vocabulary, load_trained_model_from_checkpoint
+
+from nl2sql.utils.optimizer import RAdam
+from nl2sql.utils.layer_freezing import freeze_bert_layers, recompile
+from nl2sql import model1, model2
+
+
+class SharedEncoderModel:
+    """
+    model1 heads and the model2 pair classifier on one bert encoder.
+
+    `task1` and `task2` are the task specific entry points, they take the
+    same inputs and give the same outputs as the models of model1 / model2,
+    but share every encoder weight. `joint` holds all the weights once and
+    is used for saving / loading.
+    """
+    def __init__(self, bert_model):
+        self.bert_model = bert_model
+        self.task1 = model1.build_model(bert_model)
+        self.task2 = model2.build_model(bert_model)
+        self.joint = Model(self.task1.inputs + self.task2.inputs,
+                           self.task1.outputs + self.task2.outputs)
+
+    def compile(self, task1_learning_rate=1e-5, task2_learning_rate=1e-5):
+        self.task1.compile(
+            loss='sparse_categorical_crossentropy',
+            optimizer=RAdam(lr=task1_learning_rate)
+        )
+        self.task2.compile(loss={'output_similarity': 'binary_crossentropy'},
+                           optimizer=Adam(task2_learning_rate),
+                           metrics={'output_similarity': 'accuracy'})
+
+    def freeze(self, num_frozen_layers):
+        """
+        Freeze the lower `num_frozen_layers` layers of the shared encoder (see
+        `freeze_bert_layers`) and recompile both task models, keeping their
+        optimizer states
+        """
+        freeze_bert_layers(self.bert_model, num_frozen_layers)
+        recompile(self.task1)
+        recompile(self.task2)
+
+    def predict_task1(self, inputs):
+        return self.task1.predict_on_batch(inputs)
+
+    def predict_task2(self, inputs):
+        return self.task2.predict_on_batch(inputs)
+
+    def save_weights(self, filepath):
+        self.joint.save_weights(filepath)
+
+    def load_weights(self, filepath):
+        self.joint.load_weights(filepath)
+
+    def fit_alternating(self, task1_dataseq, task2_dataseq, epochs, callbacks=None):
+        """
+        Train both tasks in alternating batches. In each epoch every batch of
+        both sequences is used once, in a shuffled interleaved order.
+
+        The callbacks are not bound to a model here, call `set_model` on them
+        beforehand (e.g. `task1` for EvaluateCallback, `joint` for
+        ModelCheckpoint). They share one `logs` dict per epoch, so put the
+        callbacks producing metrics before the ones monitoring them.
+        """
+        callbacks = callbacks or []
+        for callback in callbacks:
+            callback.on_train_begin()
+
+        tasks = [(self.task1, task1_dataseq), (self.task2, task2_dataseq)]
+        history = defaultdict(list)
+        for epoch in range(epochs):
+            for callback in callbacks:
+                callback.on_epoch_begin(epoch)
+            epoch_start = time.time()
+
+            schedule = np.concatenate([np.full(len(dataseq), task_id)
+                                       for task_id, (_, dataseq) in enumerate(tasks)])
+            np.random.shuffle(schedule)
+            batch_cursors = [0] * len(tasks)
+            task_losses = [[] for _ in tasks]
+            for task_id in schedule:
+                model, dataseq = tasks[task_id]
+                inputs, outputs = dataseq[batch_cursors[task_id]]
+                batch_cursors[task_id] += 1
+                loss = model.train_on_batch(inputs, outputs)
+                task_losses[task_id].append(loss[0] if isinstance(loss, list) else loss)
+
+            for _, dataseq in tasks:
+                dataseq.on_epoch_end()
+
+            logs = {
+                'task1_loss': float(np.mean(task_losses[0])),
+                'task2_loss': float(np.mean(task_losses[1]))
+            }
+            print('Epoch {}/{} - {:.0f}s - task1_loss: {:.4f} - task2_loss: {:.4f}'.format(
+                epoch + 1, epochs, time.time() - epoch_start, logs['task1_loss'], logs['task2_loss']))
+            for callback in callbacks:
+                callback.on_epoch_end(epoch, logs)
+            for name, value in logs.items():
+                history[name].append(value)
+
+        for callback in callbacks:
+            callback.on_train_end()
+        return dict(history)
+
+
+def construct_model(paths, task1_learning_rate=1e-5, task2_learning_rate=1e-5, num_frozen_layers=0):
+    token_dict = load_vocabulary(paths.vocab)
+    pair_tokenizer = model2.SimpleTokenizer(token_dict)
+
+    bert_model = load_trained_model_from_checkpoint(paths.config, paths.checkpoint, seq_len=None)
+    freeze_bert_layers(bert_model, num_frozen_layers)
+
+    model = SharedEncoderModel(bert_model)
+    model.compile(task1_learning_rate, task2_learning_rate)
+    return model, pair_tokenizer
@@ -1,14 +1,26 @@
 import json
+import hashlib
+from collections import ChainMap
 
 import numpy as np
 import pandas as pd
 from keras_bert import Tokenizer
 
+from . import metrics
+
 
 class Header:
     def __init__(self, names: list, types: list):
         self.names = names
         self.types = types
+        self._schema_hash = None
+
+    @property
+    def schema_hash(self):
+        if self._schema_hash is None:
+            content = json.dumps([self.names, self.types], ensure_ascii=False)
+            self._schema_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        return self._schema_hash
 
     def __getitem__(self, idx):
         return self.names[idx], self.types[idx]
@@ -20,6 +32,19 @@ class Header:
         return ' | '.join(['{}({})'.format(n, t) for n, t in zip(self.names, self.types)])
 
 
+def changed_columns(old_rows, new_rows, num_cols):
+    """
+    Ids of the columns whose values differ, all columns if the number of rows differs
+    """
+    if len(old_rows) != len(new_rows):
+        return set(range(num_cols))
+    changed = set()
+    for old_row, new_row in zip(old_rows, new_rows):
+        if old_row != new_row:
+            changed.update(col_id for col_id in range(num_cols) if old_row[col_id] != new_row[col_id])
+    return changed
+
+
 class Table:
     def __init__(self, id, name, title, header: Header, rows, **kwargs):
         self.id = id
@@ -27,16 +52,119 @@ class Table:
         self.title = title
         self.header = header
         self.rows = rows
+        self.version = kwargs.get('version', 0)  # 内容每变化一次加 1
         self._df = None
+        self._content_hash = None
+        self._content_owner = None  # 内容相同的另一个 table，共享它的 rows 和 df
+
+    def copy(self):
+        """
+        New table object with the same id and content, sharing the header, rows
+        and dataframe until its content changes
+        """
+        table = Table(self.id, self.name, self.title, self.header, self.rows, version=self.version)
+        table.share_content(self)
+        return table
+
+    def share_content(self, other):
+        self.header = other.header
+        self.rows = other.rows
+        self._content_hash = other.content_hash
+        self._content_owner = other
+
+    def _built_df(self):
+        """
+        The dataframe of this content if it was already built (possibly by the
+        content owner), without building it
+        """
+        if self._df is not None:
+            return self._df
+        owner = self._content_owner
+        if owner is not None and owner.rows is self.rows:
+            return owner._built_df()
+        return None
+
+    def _set_rows(self, rows, changed_col_ids=None):
+        """
+        Replace the rows (never modified in place, they may be shared) and
+        refresh the changed columns of the dataframe, rebuilt lazily if the
+        number of rows changed or `changed_col_ids` is None
+        """
+        df = self._built_df()
+        if df is not None and changed_col_ids is not None and len(df) == len(rows):
+            if df is not self._df:
+                df = df.copy()  # 内容共享者的 df 不能修改
+            for col_id in changed_col_ids:
+                column = pd.DataFrame(data=[[row[col_id]] for row in rows], dtype=str)
+                df.iloc[:, col_id] = column.iloc[:, 0].values
+            metrics.inc('table_df_column_refreshes_total', len(changed_col_ids))
+            self._df = df
+        else:
+            self._df = None
+        self.rows = rows
+        self._content_owner = None
+        self._content_hash = None
+        self.version += 1
+
+    def replace_content(self, other):
+        """
+        Take the header and rows of a newer version of this table, returns the
+        ids of the changed columns
+        """
+        if other.header.names != self.header.names or other.header.types != self.header.types:
+            self.header = other.header
+            changed = set(range(len(other.header)))
+            self._set_rows(other.rows)
+        else:
+            changed = changed_columns(self.rows, other.rows, len(self.header))
+            self._set_rows(other.rows, changed)
+        self.name, self.title = other.name, other.title
+        return changed
+
+    def apply_delta(self, updated=None, added=None, removed=None):
+        """
+        Row level update, all row ids refer to the rows before the update:
+        `updated` {row_id: new row}, `added` rows appended, `removed` row ids.
+        Returns the ids of the changed columns.
+        """
+        num_cols = len(self.header)
+        rows = list(self.rows)
+        changed = set()
+        for row_id, row in (updated or {}).items():
+            changed.update(col_id for col_id in range(num_cols) if rows[row_id][col_id] != row[col_id])
+            rows[row_id] = row
+        if removed:
+            removed = set(removed)
+            rows = [row for row_id, row in enumerate(rows) if row_id not in removed]
+        if added:
+            rows += added
+        if removed or added:
+            changed = set(range(num_cols))
+        if changed:
+            self._set_rows(rows, changed)
+        return changed
 
     @property
     def df(self):
+        if self._content_owner is not None:
+            if self._content_owner.rows is self.rows:
+                return self._content_owner.df
+            self._content_owner = None  # 共享内容的 table 已更新
         if self._df is None:
             self._df = pd.DataFrame(data=self.rows,
                                     columns=self.header.names,
                                     dtype=str)
+            metrics.inc('table_df_builds_total')
         return self._df
 
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            content = json.dumps([self.header.names, self.header.types, self.rows],
+                                 ensure_ascii=False)
+            self._content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        return self._content_hash
+
     def _repr_html_(self):
         return self.df._repr_html_()
 
@@ -44,8 +172,10 @@ class Table:
 class Tables:
     table_dict = None
 
-    def __init__(self, table_list: list = None, table_dict: dict = None):
+    def __init__(self, table_list: list = None, table_dict: dict = None, pool=None):
         self.table_dict = {}
+        self.pool = pool  # TablePool，更新后的表也在其中共享
+        self._listeners = []
         if isinstance(table_list, list):
             for table in table_list:
                 self.table_dict[table.id] = table
@@ -53,16 +183,63 @@ class Tables:
             self.table_dict.update(table_dict)
 
     def push(self, table):
-        self.table_dict[table.id] = table
+        """
+        Add a table, returns the table now in the registry. A different version
+        of a table already in the registry is applied to a copy of it (the old
+        object may be shared with other registries, the pool and queries, so it
+        is never modified), which replaces it in this registry (in the top layer
+        of a chained view) and is passed to the listeners with the changed columns.
+        """
+        old = self.table_dict.get(table.id)
+        if old is None or old is table:
+            self.table_dict[table.id] = table
+            return table
+        if old.content_hash == table.content_hash:
+            return old
+        new = old.copy()
+        return self._replace(old, new, new.replace_content(table))
+
+    def update_rows(self, table_id, updated=None, added=None, removed=None):
+        """
+        Row level update of a table, see `Table.apply_delta`. Like `push`, the
+        updated copy replaces the table in this registry.
+        """
+        old = self[table_id]
+        new = old.copy()
+        changed = new.apply_delta(updated=updated, added=added, removed=removed)
+        if changed:
+            self._replace(old, new, changed)
+        return changed
+
+    def _replace(self, old, new, changed_col_ids):
+        if self.pool is not None:
+            new = self.pool.replace(old, new)
+        self.table_dict[new.id] = new
+        self._notify(new, changed_col_ids, old.content_hash)
+        return new
+
+    def subscribe(self, listener):
+        """
+        `listener(table, changed_col_ids, old_content_hash)` is called with the
+        new version after a table of this registry changed, e.g.
+        `CandidateCondsExtractor.refresh_table` (which also points its queries
+        to the new version). Other queries keep the old version until they are
+        given `tables[query.table.id]`.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, table, changed_col_ids, old_content_hash):
+        for listener in self._listeners:
+            listener(table, changed_col_ids, old_content_hash)
 
     def __len__(self):
         return len(self.table_dict)
 
     def __add__(self, other):
-        return Tables(
-            table_list=list(self.table_dict.values()) +
-            list(other.table_dict.values())
-        )
+        # 不复制 table，返回两者的链式视图，同 id 时 other 中的 table 优先；push 只写入新的一层
+        merged = Tables(pool=other.pool or self.pool)
+        merged.table_dict = ChainMap({}, other.table_dict, self.table_dict)
+        return merged
 
     def __getitem__(self, id):
         return self.table_dict[id]
@@ -72,6 +249,45 @@ class Tables:
             yield table_id, table
 
 
+class TablePool:
+    """
+    Share identical headers (by schema hash) and identical tables (by content
+    hash) between the tables read with this pool, e.g. the train / val / test
+    registries. Tables with the same content but different ids stay separate
+    objects sharing header, rows and dataframe.
+    """
+    def __init__(self):
+        self.headers = {}
+        self.tables = {}
+
+    def header(self, names, types):
+        header = Header(names, types)
+        return self.headers.setdefault(header.schema_hash, header)
+
+    def table(self, table):
+        owner = self.tables.setdefault(table.content_hash, table)
+        if owner is table:
+            return table
+        if owner.id == table.id:
+            return owner
+        table.share_content(owner)
+        return table
+
+    def replace(self, old, new):
+        """
+        Share the new version `new` of the table `old` like `table`. The old
+        content is forgotten if `old` owned it, objects still using it keep it.
+        """
+        if self.tables.get(old.content_hash) is old:
+            del self.tables[old.content_hash]
+        if new.header is not old.header:
+            new.header = self.header(new.header.names, new.header.types)
+        return self.table(new)
+
+    def stats(self):
+        return {'headers': len(self.headers), 'tables': len(self.tables)}
+
+
 def set_sql_compare_mode(mode):
     available_modes = {'all', 'agg', 'no_val', 'conn_and_agg'}
     if mode not in available_modes:
@@ -271,28 +487,36 @@ class QueryTokenizer(Tokenizer):
         return self._pack(*tokens_lists)
 
 
-def read_tables(table_file):
-    tables = Tables()
+def read_tables(table_file, pool: TablePool = None):
+    tables = Tables(pool=pool)
     with open(table_file, encoding='utf-8') as f:
         for line in f:
             tb = json.loads(line)
-            header = Header(tb.pop('header'), tb.pop('types'))
-            table = Table(header=header, **tb)
+            if pool is not None:
+                header = pool.header(tb.pop('header'), tb.pop('types'))
+                table = pool.table(Table(header=header, **tb))
+            else:
+                header = Header(tb.pop('header'), tb.pop('types'))
+                table = Table(header=header, **tb)
             tables.push(table)
     return tables
 
 
+def query_from_dict(data: dict, tables: Tables):
+    question = Question(text=data['question'])
+    table = tables[data['table_id']]
+    if 'sql' in data:
+        sql = SQL.from_dict(data['sql'])
+    else:
+        sql = None
+    return Query(question=question, table=table, sql=sql)
+
+
+@metrics.timed('read_data_seconds')
 def read_data(data_file, tables: Tables):
     queries = []
     with open(data_file, encoding='utf-8') as f:
         for line in f:
-            data = json.loads(line)
-            question = Question(text=data['question'])
-            table = tables[data['table_id']]
-            if 'sql' in data:
-                sql = SQL.from_dict(data['sql'])
-            else:
-                sql = None
-            query = Query(question=question, table=table, sql=sql)
-            queries.append(query)
+            queries.append(query_from_dict(json.loads(line), tables))
+    metrics.inc('queries_read_total', len(queries))
     return queries
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+
+from nl2sql.utils import query_from_dict
+
+
+def _write_json_atomic(json_file, obj):
+    tmp_file = json_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(obj, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, json_file)
+
+
+def read_lines_from(data_file, offset, max_lines):
+    """
+    Read at most `max_lines` non-empty lines starting at byte `offset`,
+    returns (lines, byte offset after the last line read)
+    """
+    lines = []
+    with open(data_file, 'rb') as f:
+        f.seek(offset)
+        while len(lines) < max_lines:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                lines.append(line.decode('utf-8'))
+        return lines, f.tell()
+
+
+class BulkRunner:
+    """
+    Run `predict_fn(queries) -> list of json-serializable results` over a
+    JSONL file of any size, `shard_size` lines at a time. The results of each
+    shard are written to their own JSONL file and the input byte offset after
+    the shard is committed to `manifest.json`, so a restarted run continues
+    after the last finished shard. Only one shard is held in memory.
+
+    params:
+        - shard_size: 每个 shard 的 query 数，也是一次送入 predict_fn 的 query 数
+    """
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, output_dir, shard_size=10000):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.manifest_file = os.path.join(output_dir, self.MANIFEST)
+
+    def load_manifest(self, data_file):
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if manifest['input'] != os.path.abspath(data_file):
+                raise ValueError('{} belongs to {}, not {}'.format(
+                    self.manifest_file, manifest['input'], data_file))
+            return manifest
+        return {'input': os.path.abspath(data_file), 'offset': 0, 'num_queries': 0, 'shards': [], 'done': False}
+
+    def shard_file(self, shard_id):
+        return os.path.join(self.output_dir, 'part-{:05d}.jsonl'.format(shard_id))
+
+    def run(self, data_file, tables, predict_fn):
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = self.load_manifest(data_file)
+        if manifest['done']:
+            print('~~ {} already finished'.format(self.output_dir))
+            return manifest
+        if manifest['shards']:
+            print('~~ resuming after shard {}, {} queries done'.format(
+                len(manifest['shards']) - 1, manifest['num_queries']))
+
+        while True:
+            lines, end_offset = read_lines_from(data_file, manifest['offset'], self.shard_size)
+            if not lines:
+                break
+
+            start = time.time()
+            queries = [query_from_dict(json.loads(line), tables) for line in lines]
+            results = predict_fn(queries)
+
+            # shard 先写临时文件再改名，manifest 在 shard 落盘之后才更新
+            shard_id = len(manifest['shards'])
+            shard_file = self.shard_file(shard_id)
+            with open(shard_file + '.tmp', 'w', encoding='utf-8') as f:
+                for result in results:
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(shard_file + '.tmp', shard_file)
+
+            manifest['shards'].append({
+                'file': os.path.basename(shard_file),
+                'start_offset': manifest['offset'],
+                'end_offset': end_offset,
+                'num_queries': len(queries),
+                'seconds': time.time() - start
+            })
+            manifest['offset'] = end_offset
+            manifest['num_queries'] += len(queries)
+            _write_json_atomic(self.manifest_file, manifest)
+            print('~~ shard {}: {} queries in {:.1f}s, {} in total'.format(
+                shard_id, len(queries), time.time() - start, manifest['num_queries']))
+
+        manifest['done'] = True
+        _write_json_atomic(self.manifest_file, manifest)
+        return manifest
+
+    def concat(self, output_file):
+        """
+        Concatenate the committed shards, in input order, into one file
+        """
+        with open(self.manifest_file) as f:
+            manifest = json.load(f)
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for shard in manifest['shards']:
+                with open(os.path.join(self.output_dir, shard['file']), encoding='utf-8') as f:
+                    for line in f:
+                        out.write(line)
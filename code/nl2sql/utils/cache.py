@@ -0,0 +1,194 @@
+import json
+import hashlib
+import sqlite3
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+
+def normalize_question(text):
+    """
+    NFC-normalize and strip the question text, so that visually identical
+    questions share one cache entry
+    """
+    return unicodedata.normalize('NFC', text).strip()
+
+
+def model_fingerprint(*weight_files, config=None):
+    """
+    Hash the content of the weight files and the inference settings in
+    `config` (a json-serializable dict), the fingerprint changes whenever any
+    of the models is retrained or a setting that changes the outputs is changed
+    """
+    sha1 = hashlib.sha1()
+    if config is not None:
+        sha1.update(json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for weight_file in weight_files:
+        with open(weight_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of final sqls, keyed by (question, table id, table content, models).
+
+    params:
+        - model_fingerprint: see `model_fingerprint`, entries of other models are dropped
+        - capacity: max number of entries kept in memory
+        - cache_file: optional sqlite file, entries in it survive restarts
+    """
+    def __init__(self, model_fingerprint, capacity=10000, cache_file=None):
+        self.model_fingerprint = model_fingerprint
+        self.capacity = capacity
+        self.cache_file = cache_file
+        self._entries = OrderedDict()  # key -> (table_id, table_hash, sql)
+        self._table_hashes = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._conn = None
+        if cache_file is not None:
+            self._open_store(cache_file)
+
+    def _open_store(self, cache_file):
+        self._conn = sqlite3.connect(cache_file)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                           'key TEXT PRIMARY KEY, table_id TEXT, table_hash TEXT, sql TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_table_id ON results (table_id)')
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'model_fingerprint'").fetchone()
+        if row is None or row[0] != self.model_fingerprint:
+            # 模型权重或预测配置变了，之前的结果全部作废
+            cursor = self._conn.execute('DELETE FROM results')
+            self.invalidations += max(cursor.rowcount, 0)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('model_fingerprint', ?)",
+                               (self.model_fingerprint,))
+        self._conn.commit()
+
+    def make_key(self, query):
+        table = query.table
+        key = '\t'.join([normalize_question(query.question.text),
+                         str(table.id),
+                         table.content_hash,
+                         self.model_fingerprint])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _check_table_version(self, table):
+        table_hash = table.content_hash
+        if table.id not in self._table_hashes:
+            # 首次见到这张表，清掉持久化存储中旧版本表格的结果
+            if self._conn is not None:
+                cursor = self._conn.execute('DELETE FROM results WHERE table_id = ? AND table_hash != ?',
+                                            (str(table.id), table_hash))
+                self.invalidations += max(cursor.rowcount, 0)
+        elif self._table_hashes[table.id] != table_hash:
+            self.invalidate_table(table.id)
+        self._table_hashes[table.id] = table_hash
+
+    def get(self, query):
+        self._check_table_version(query.table)
+        key = self.make_key(query)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][2]
+
+        if self._conn is not None:
+            row = self._conn.execute('SELECT sql FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                sql = json.loads(row[0])
+                self._remember(key, query.table, sql)
+                self.hits += 1
+                self.disk_hits += 1
+                return sql
+
+        self.misses += 1
+        return None
+
+    def put(self, query, sql):
+        self._check_table_version(query.table)
+        key = self.make_key(query)
+        self._remember(key, query.table, sql)
+        if self._conn is not None:
+            self._conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                               (key, str(query.table.id), query.table.content_hash,
+                                json.dumps(sql, ensure_ascii=False)))
+
+    def _remember(self, key, table, sql):
+        self._entries[key] = (table.id, table.content_hash, sql)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_table(self, table_id):
+        stale_keys = [key for key, (entry_table_id, *_) in self._entries.items()
+                      if entry_table_id == table_id]
+        for key in stale_keys:
+            del self._entries[key]
+        num_invalidated = len(stale_keys)
+        if self._conn is not None:
+            # 持久化存储中包含了内存中的全部条目
+            cursor = self._conn.execute('DELETE FROM results WHERE table_id = ?', (str(table_id),))
+            self._conn.commit()
+            num_invalidated = max(cursor.rowcount, num_invalidated)
+        self.invalidations += num_invalidated
+        self._table_hashes.pop(table_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._table_hashes.clear()
+        if self._conn is not None:
+            self._conn.execute('DELETE FROM results')
+            self._conn.commit()
+
+    def predict(self, queries, predict_fn):
+        """
+        Look up each query, run `predict_fn` on the misses only and fill the cache.
+        `predict_fn` takes a list of queries and returns a list of sqls.
+        """
+        results = [self.get(query) for query in queries]
+        miss_ids = defaultdict(list)  # 同一批中重复的 query 只预测一次
+        for i, sql in enumerate(results):
+            if sql is None:
+                miss_ids[self.make_key(queries[i])].append(i)
+        if miss_ids:
+            miss_sqls = predict_fn([queries[ids[0]] for ids in miss_ids.values()])
+            for ids, sql in zip(miss_ids.values(), miss_sqls):
+                # 经过一次json序列化，使命中与未命中时返回的结果完全一致
+                sql = json.loads(json.dumps(sql, ensure_ascii=False))
+                self.put(queries[ids[0]], sql)
+                for i in ids:
+                    results[i] = sql
+            self.flush()
+        return results
+
+    def flush(self):
+        if self._conn is not None:
+            self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def stats(self):
+        num_lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / num_lookups if num_lookups else 0.,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self._entries)
+        }
+
+    def dump_stats(self, stats_file):
+        with open(stats_file, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import random
+import shutil
+import numpy as np
+import keras.backend as K
+
+
+def _get_optimizer_weights(model):
+    model._make_train_function()
+    return K.batch_get_value(model.optimizer.weights)
+
+
+def save_checkpoint(checkpoint_dir, model, epoch, batch, dataseq, callbacks=None):
+    """
+    Save everything needed to continue training from batch `batch` of epoch
+    `epoch`: model weights, optimizer slots (RAdam iterations / ms / vs),
+    the state of the data sequence, the numpy / python RNG states and the
+    `best` value of monitoring callbacks (e.g. ModelCheckpoint).
+
+    The checkpoint is written to a temporary directory first and then renamed.
+    The previous checkpoint is moved to `checkpoint_dir + '.old'` until the
+    new one is in place, so after a kill during saving `find_checkpoint` still
+    finds a complete checkpoint.
+    """
+    tmp_dir = checkpoint_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    model.save_weights(os.path.join(tmp_dir, 'weights.h5'))
+
+    optimizer_weights = _get_optimizer_weights(model)
+    np.savez(os.path.join(tmp_dir, 'optimizer.npz'),
+             **{'w{}'.format(i): w for i, w in enumerate(optimizer_weights)})
+
+    np_rng = np.random.get_state()
+    arrays = {'np_rng_keys': np_rng[1]}
+    for name, value in dataseq.get_state().items():
+        arrays['dataseq.' + name] = value
+    np.savez(os.path.join(tmp_dir, 'state.npz'), **arrays)
+
+    state = {
+        'epoch': epoch,
+        'batch': batch,
+        'np_rng': [np_rng[0], int(np_rng[2]), int(np_rng[3]), float(np_rng[4])],
+        'py_rng': random.getstate(),
+        'callbacks_best': [float(getattr(cb, 'best', np.nan)) for cb in callbacks or []],
+        'time': time.time()
+    }
+    with open(os.path.join(tmp_dir, 'state.json'), 'w') as f:
+        json.dump(state, f)
+
+    if os.path.exists(checkpoint_dir):
+        old_dir = checkpoint_dir + '.old'
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(checkpoint_dir, old_dir)
+        os.rename(tmp_dir, checkpoint_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(tmp_dir, checkpoint_dir)
+
+
+def find_checkpoint(checkpoint_dir):
+    """
+    Directory of the latest complete checkpoint, `checkpoint_dir` or the
+    previous one left in `checkpoint_dir + '.old'` by an interrupted save,
+    None if there is none
+    """
+    for path in [checkpoint_dir, checkpoint_dir + '.old']:
+        if os.path.exists(os.path.join(path, 'state.json')):
+            return path
+    return None
+
+
+def load_checkpoint(checkpoint_dir, model, dataseq, callbacks=None):
+    """
+    Restore a checkpoint written by `save_checkpoint`, returns (epoch, batch)
+    to continue from
+    """
+    model.load_weights(os.path.join(checkpoint_dir, 'weights.h5'))
+
+    model._make_train_function()
+    with np.load(os.path.join(checkpoint_dir, 'optimizer.npz')) as f:
+        optimizer_weights = [f['w{}'.format(i)] for i in range(len(f.files))]
+    K.batch_set_value(zip(model.optimizer.weights, optimizer_weights))
+
+    with open(os.path.join(checkpoint_dir, 'state.json')) as f:
+        state = json.load(f)
+    with np.load(os.path.join(checkpoint_dir, 'state.npz')) as f:
+        arrays = {name: f[name] for name in f.files}
+
+    dataseq.set_state({name[len('dataseq.'):]: value for name, value in arrays.items()
+                       if name.startswith('dataseq.')})
+
+    algorithm, pos, has_gauss, cached_gaussian = state['np_rng']
+    np.random.set_state((algorithm, arrays['np_rng_keys'], pos, has_gauss, cached_gaussian))
+    version, internal_state, gauss_next = state['py_rng']
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+    for callback, best in zip(callbacks or [], state['callbacks_best']):
+        if hasattr(callback, 'best') and not np.isnan(best):
+            callback.best = best
+    return state['epoch'], state['batch']
+
+
+def fit_resumable(model, dataseq, epochs, checkpoint_dir, save_every=500, callbacks=None):
+    """
+    Train `model` on a DataSequence / QuestionCondPairsDataseq like
+    `fit_generator(workers=0)`, saving a checkpoint every `save_every` batches
+    and at the end of every epoch. If a checkpoint exists (`find_checkpoint`), training
+    continues from the saved epoch and batch, with the same data order.
+
+    Batches are produced in the training thread, so the RNG states saved at a
+    batch boundary are exact (TF dropout seeds are not part of the checkpoint).
+    The callbacks get `set_model(model.callback_model or model)` and per-batch /
+    per-epoch `loss` logs.
+    """
+    callbacks = callbacks or []
+    callback_model = getattr(model, 'callback_model', None) or model
+    for callback in callbacks:
+        callback.set_model(callback_model)
+        callback.set_params({'epochs': epochs, 'steps': len(dataseq), 'verbose': 1,
+                             'do_validation': False, 'metrics': ['loss']})
+
+    start_epoch, start_batch = 0, 0
+    resume_dir = find_checkpoint(checkpoint_dir)
+    if resume_dir is not None:
+        start_epoch, start_batch = load_checkpoint(resume_dir, model, dataseq, callbacks)
+        print('~~ resume from epoch {} batch {}'.format(start_epoch + 1, start_batch))
+
+    for callback in callbacks:
+        callback.on_train_begin()
+
+    history = {'loss': []}
+    for epoch in range(start_epoch, epochs):
+        for callback in callbacks:
+            callback.on_epoch_begin(epoch)
+        epoch_start = time.time()
+
+        losses = []
+        first_batch = start_batch if epoch == start_epoch else 0
+        for batch in range(first_batch, len(dataseq)):
+            for callback in callbacks:
+                callback.on_batch_begin(batch)
+            inputs, outputs = dataseq[batch]
+            loss = model.train_on_batch(inputs, outputs)
+            losses.append(loss[0] if isinstance(loss, list) else loss)
+            for callback in callbacks:
+                callback.on_batch_end(batch, {'batch': batch, 'loss': losses[-1]})
+
+            if save_every and (batch + 1) % save_every == 0 and batch + 1 < len(dataseq):
+                save_checkpoint(checkpoint_dir, model, epoch, batch + 1, dataseq, callbacks)
+
+        logs = {'loss': float(np.mean(losses))}
+        print('Epoch {}/{} - {:.0f}s - loss: {:.4f}'.format(
+            epoch + 1, epochs, time.time() - epoch_start, logs['loss']))
+        for callback in callbacks:
+            callback.on_epoch_end(epoch, logs)
+        history['loss'].append(logs['loss'])
+
+        dataseq.on_epoch_end()
+        save_checkpoint(checkpoint_dir, model, epoch + 1, 0, dataseq, callbacks)
+
+    for callback in callbacks:
+        callback.on_train_end()
+    return history
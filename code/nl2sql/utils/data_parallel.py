@@ -0,0 +1,218 @@
+import os
+import time
+import queue
+import shutil
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+
+
+def shard(data, rank, world_size):
+    """
+    The part of `data` a worker trains on
+    """
+    return data[rank::world_size]
+
+
+class GradientReplica:
+    """
+    Split the training step of a compiled keras model in two: compute the
+    gradients of a batch, and apply (already all-reduced) gradients with the
+    model's own optimizer, so RAdam / Adam keep their usual update rule and state
+    """
+    def __init__(self, model):
+        # 不调用 model._make_train_function()，否则优化器会多建一份 ms / vs
+        self.model = model
+        self.params = model._collected_trainable_weights
+        self.shapes = [K.int_shape(p) for p in self.params]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.num_params = sum(self.sizes)
+
+        optimizer = model.optimizer
+        grads = optimizer.get_gradients(model.total_loss, self.params)
+        grads = [tf.convert_to_tensor(g) for g in grads]  # embedding 的梯度是 IndexedSlices
+        feed = model._feed_inputs + model._feed_targets + model._feed_sample_weights
+        if model._uses_dynamic_learning_phase():
+            feed += [K.learning_phase()]
+        self._grad_function = K.function(feed, [model.total_loss] + grads)
+
+        grad_placeholders = [K.placeholder(shape=shape, dtype=K.dtype(p))
+                             for shape, p in zip(self.shapes, self.params)]
+        optimizer.get_gradients = lambda loss, params: grad_placeholders
+        updates = optimizer.get_updates(loss=model.total_loss, params=self.params)
+        self._apply_function = K.function(grad_placeholders, [], updates=updates)
+
+    def compute_gradients(self, inputs, outputs):
+        """
+        Returns the loss and the flattened float32 gradients of one batch
+        """
+        x, y, sample_weights = self.model._standardize_user_data(inputs, outputs)
+        feed = x + y + sample_weights
+        if self.model._uses_dynamic_learning_phase():
+            feed += [1]
+        results = self._grad_function(feed)
+        flat = np.concatenate([g.astype('float32').ravel() for g in results[1:]])
+        return float(results[0]), flat
+
+    def apply_gradients(self, flat):
+        grads = []
+        offset = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            grads.append(flat[offset: offset + size].reshape(shape))
+            offset += size
+        self._apply_function(grads)
+
+
+class SharedMemoryAllReduce:
+    """
+    Average equally sized float32 vectors across local worker processes.
+
+    Every worker writes its vector to its own row of a memory-mapped buffer in
+    `shm_dir` (/dev/shm), then reduces one contiguous chunk of the columns over
+    all rows into the result row (reduce-scatter), and after a barrier reads
+    the full result (all-gather).
+    """
+    def __init__(self, rank, world_size, size, barrier, shm_dir):
+        self.rank = rank
+        self.world_size = world_size
+        self.barrier = barrier
+        buffer_file = os.path.join(shm_dir, 'allreduce.f32')
+        if rank == 0:
+            self.buffer = np.memmap(buffer_file, dtype='float32', mode='w+', shape=(world_size + 1, size))
+        barrier.wait()
+        if rank != 0:
+            self.buffer = np.memmap(buffer_file, dtype='float32', mode='r+', shape=(world_size + 1, size))
+
+        bounds = np.linspace(0, size, world_size + 1).astype('int64')
+        self.chunk = slice(bounds[rank], bounds[rank + 1])
+
+    def allreduce_mean(self, vector):
+        self.buffer[self.rank] = vector
+        self.barrier.wait()
+        self.buffer[self.world_size, self.chunk] = self.buffer[:self.world_size, self.chunk].mean(axis=0)
+        self.barrier.wait()
+        result = np.array(self.buffer[self.world_size])
+        self.barrier.wait()  # 所有 worker 读完之后才能开始写下一步的梯度
+        return result
+
+
+def _worker_main(rank, world_size, build_fn, dataseq_fn, callbacks_fn, epochs, max_steps,
+                 threads_per_worker, shm_dir, weights_file, barrier, lengths, result_queue):
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads_per_worker,
+                                                   inter_op_parallelism_threads=2)))
+    model = build_fn()
+    dataseq = dataseq_fn(rank, world_size)
+    replica = GradientReplica(model)
+
+    # 所有 replica 从 rank 0 的权重开始
+    init_weights_file = os.path.join(shm_dir, 'init_weights.h5')
+    if rank == 0:
+        model.save_weights(init_weights_file)
+    barrier.wait()
+    if rank != 0:
+        model.load_weights(init_weights_file)
+
+    allreduce = SharedMemoryAllReduce(rank, world_size, replica.num_params, barrier, shm_dir)
+    lengths[rank] = len(dataseq)
+    barrier.wait()
+    steps_per_epoch = min(lengths)
+    if max_steps:
+        steps_per_epoch = min(steps_per_epoch, max_steps)
+
+    callbacks = callbacks_fn() if callbacks_fn is not None and rank == 0 else []
+    for callback in callbacks:
+        callback.set_model(model)
+        callback.on_train_begin()
+
+    history = {'loss': []}
+    num_examples = 0
+    start = time.time()
+    for epoch in range(epochs):
+        for callback in callbacks:
+            callback.on_epoch_begin(epoch)
+        losses = []
+        for batch in range(steps_per_epoch):
+            inputs, outputs = dataseq[batch]
+            loss, grads = replica.compute_gradients(inputs, outputs)
+            replica.apply_gradients(allreduce.allreduce_mean(grads))
+            losses.append(loss)
+            num_examples += len(next(iter(inputs.values())))
+        dataseq.on_epoch_end()
+
+        epoch_loss = float(allreduce.allreduce_mean(np.array([np.mean(losses)], dtype='float32'))[0])
+        history['loss'].append(epoch_loss)
+        if rank == 0:
+            print('Epoch {}/{} - {:.0f}s - loss: {:.4f}'.format(epoch + 1, epochs, time.time() - start,
+                                                                 epoch_loss))
+        for callback in callbacks:
+            callback.on_epoch_end(epoch, {'loss': epoch_loss})
+    elapsed = time.time() - start
+
+    for callback in callbacks:
+        callback.on_train_end()
+    if rank == 0 and weights_file:
+        model.save_weights(weights_file)
+    result_queue.put({'rank': rank, 'examples': num_examples, 'elapsed': elapsed, 'history': history})
+
+
+def train_data_parallel(build_fn, dataseq_fn, num_workers, epochs=1, callbacks_fn=None,
+                        weights_file=None, max_steps=None, threads_per_worker=None):
+    """
+    Data-parallel training on one CPU machine with `num_workers` processes.
+
+    Every worker builds its own compiled replica with `build_fn()` and its own
+    shard with `dataseq_fn(rank, num_workers)` (e.g. a DataSequence over
+    `shard(data, rank, num_workers)`). In every step the gradients of all workers
+    are averaged through shared memory before the optimizer update, so the
+    replicas stay identical and the effective batch size is
+    `num_workers * batch_size`. `build_fn`, `dataseq_fn` and `callbacks_fn`
+    must be picklable (module level functions), the workers are spawned.
+    Callbacks only run in worker 0; the trained weights are saved by worker 0
+    to `weights_file`.
+
+    Returns a dict with the loss history, elapsed time and examples per second.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, mp.cpu_count() // num_workers)
+    ctx = mp.get_context('spawn')
+    shm_dir = tempfile.mkdtemp(prefix='nl2sql_allreduce_',
+                               dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    barrier = ctx.Barrier(num_workers)
+    lengths = ctx.Array('i', num_workers)
+    result_queue = ctx.Queue()
+
+    workers = [ctx.Process(target=_worker_main,
+                           args=(rank, num_workers, build_fn, dataseq_fn, callbacks_fn, epochs, max_steps,
+                                 threads_per_worker, shm_dir, weights_file, barrier, lengths, result_queue))
+               for rank in range(num_workers)]
+    try:
+        for worker in workers:
+            worker.start()
+        results = []
+        while len(results) < num_workers:
+            try:
+                results.append(result_queue.get(timeout=10))
+            except queue.Empty:
+                failed = [w for w in workers if w.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError('data parallel worker exited with code {}'.format(failed[0].exitcode))
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        shutil.rmtree(shm_dir, ignore_errors=True)
+
+    results = sorted(results, key=lambda r: r['rank'])
+    elapsed = max(r['elapsed'] for r in results)
+    num_examples = sum(r['examples'] for r in results)
+    return {
+        'num_workers': num_workers,
+        'history': results[0]['history'],
+        'elapsed': elapsed,
+        'examples': num_examples,
+        'examples_per_sec': num_examples / elapsed
+    }
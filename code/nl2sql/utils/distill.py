@@ -0,0 +1,115 @@
+import re
+import json
+import numpy as np
+import keras.backend as K
+from keras.models import Model
+from keras.utils.data_utils import Sequence
+from keras_bert import get_model
+
+
+def get_bert_layer(model):
+    """
+    The bert encoder is nested in model1 / model2 as a single Model layer
+    """
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            return layer
+    raise ValueError('no bert encoder found in model {}'.format(model.name))
+
+
+def build_student_bert(config_file, num_layers):
+    """
+    Build a bert encoder with the same embedding and hidden sizes as the
+    pretrained one but only `num_layers` transformer layers
+    """
+    with open(config_file) as f:
+        config = json.load(f)
+    inputs, outputs = get_model(
+        token_num=config['vocab_size'],
+        pos_num=config['max_position_embeddings'],
+        seq_len=None,
+        embed_dim=config['hidden_size'],
+        transformer_num=num_layers,
+        head_num=config['num_attention_heads'],
+        feed_forward_dim=config['intermediate_size'],
+        feed_forward_activation=config['hidden_act'],
+        training=False,
+        trainable=True
+    )
+    return Model(inputs, outputs)
+
+
+def init_student_from_teacher(teacher, student, teacher_layers):
+    """
+    Copy the embeddings, the transformer layers listed in `teacher_layers`
+    (0-based, one per student layer) and the output heads of the teacher
+    into the student
+    """
+    teacher_bert = get_bert_layer(teacher)
+    student_bert = get_bert_layer(student)
+    layer_map = {i + 1: j + 1 for i, j in enumerate(teacher_layers)}  # keras-bert 的层号从 1 开始
+    encoder_pattern = re.compile(r'^Encoder-(\d+)-(.*)$')
+
+    for layer in student_bert.layers:
+        if not layer.weights:
+            continue
+        match = encoder_pattern.match(layer.name)
+        if match:
+            name = 'Encoder-{}-{}'.format(layer_map[int(match.group(1))], match.group(2))
+        else:
+            name = layer.name
+        layer.set_weights(teacher_bert.get_layer(name).get_weights())
+
+    for layer in student.layers:
+        if layer is student_bert or not layer.weights:
+            continue
+        layer.set_weights(teacher.get_layer(layer.name).get_weights())
+
+
+def soft_target_loss(alpha=0.5, binary=False):
+    """
+    Loss on targets packed by `DistillationSequence`: y_true[..., 0] is the
+    hard label, y_true[..., 1:] the teacher probabilities.
+    `alpha` weights the hard label loss against the teacher soft label loss.
+    """
+    def soft_target_crossentropy(y_true, y_pred):
+        hard_true = y_true[..., :1]
+        soft_true = y_true[..., 1:]
+        if binary:
+            hard_loss = K.mean(K.binary_crossentropy(hard_true, y_pred), axis=-1)
+            soft_loss = K.mean(K.binary_crossentropy(soft_true, y_pred), axis=-1)
+        else:
+            hard_loss = K.sparse_categorical_crossentropy(hard_true, y_pred)
+            soft_loss = K.categorical_crossentropy(soft_true, y_pred)
+        return alpha * hard_loss + (1 - alpha) * soft_loss
+    return soft_target_crossentropy
+
+
+class DistillationSequence(Sequence):
+    """
+    Wrap a training DataSequence / QuestionCondPairsDataseq, and pack the
+    teacher predictions next to the hard labels of every output
+    """
+    def __init__(self, dataseq, teacher):
+        self.dataseq = dataseq
+        self.teacher = teacher
+        self.teacher._make_predict_function()
+
+    def __getitem__(self, batch_id):
+        inputs, outputs = self.dataseq[batch_id]
+        soft_targets = self.teacher.predict_on_batch(inputs)
+        if not isinstance(soft_targets, list):
+            soft_targets = [soft_targets]
+
+        targets = {}
+        for name, soft_target in zip(self.teacher.output_names, soft_targets):
+            hard_target = outputs[name].astype(soft_target.dtype)
+            targets[name] = np.concatenate([hard_target, soft_target], axis=-1)
+        return inputs, targets
+
+    def __len__(self):
+        return len(self.dataseq)
+
+    def on_epoch_end(self):
+        self.dataseq.on_epoch_end()
+
@@ -0,0 +1,275 @@
+import math
+import operator
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from nl2sql.utils import SQL
+
+# SQL.op_sql_dict 的下标 -> 比较函数
+OPS = {0: operator.gt, 1: operator.lt, 2: operator.eq, 3: operator.ne}
+
+
+def to_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return number
+
+
+def _as_sql(sql):
+    return SQL.from_dict(sql) if isinstance(sql, dict) else sql
+
+
+class ColumnarTable:
+    """
+    Typed columnar view of `Table.rows`: every column as a string array and a
+    float array (nan where the cell is not a number)
+    """
+    def __init__(self, table):
+        self.types = list(table.header.types)
+        self.num_rows = len(table.rows)
+        columns = list(zip(*table.rows)) if table.rows else [()] * len(self.types)
+        self.strings = [np.array([str(v) for v in col], dtype=str) for col in columns]
+        self.numbers = [np.array([to_number(v) for v in col], dtype='float64') for col in columns]
+
+    def refresh(self, table, col_ids):
+        """
+        Rebuild only the given columns after the table changed
+        """
+        if len(table.header) != len(self.types):
+            self.__init__(table)
+            return
+        self.types = list(table.header.types)
+        self.num_rows = len(table.rows)
+        for col_id in col_ids:
+            column = [row[col_id] for row in table.rows]
+            self.strings[col_id] = np.array([str(v) for v in column], dtype=str)
+            self.numbers[col_id] = np.array([to_number(v) for v in column], dtype='float64')
+
+    def cond_mask(self, col_id, op, value):
+        """
+        real 列且条件值是数字时按数值比较（nan 不满足任何条件），否则按字符串比较
+        """
+        number = to_number(value)
+        if self.types[col_id] == 'real' and not math.isnan(number):
+            column = self.numbers[col_id]
+            with np.errstate(invalid='ignore'):
+                return OPS[op](column, number) & ~np.isnan(column)
+        return OPS[op](self.strings[col_id], str(value))
+
+    def aggregate(self, col_id, agg, mask):
+        if agg == 0:
+            return tuple(self.strings[col_id][mask].tolist())
+        if agg == 4:
+            return int(mask.sum())
+        numbers = self.numbers[col_id][mask]
+        numbers = numbers[~np.isnan(numbers)]
+        if len(numbers) == 0:
+            return None
+        if agg == 1:
+            return float(numbers.mean())
+        if agg == 2:
+            return float(numbers.max())
+        if agg == 3:
+            return float(numbers.min())
+        return float(numbers.sum())
+
+
+class NumericIndex:
+    """
+    Sorted float values of every `real` column of a table, to count the rows
+    selected by a numeric cond in O(log n) with the same semantics as
+    `ColumnarTable.cond_mask`. Only the columns where every value is a number
+    are indexed: with empty or non numeric cells the rows a cond selects
+    depend on how the sql engine compares them, so the count is unknown.
+    """
+    def __init__(self, table):
+        self.sorted_values = {}
+        self.refresh(table, range(len(table.header)))
+
+    def refresh(self, table, col_ids):
+        """
+        Rebuild only the given columns after the table changed
+        """
+        for col_id in list(self.sorted_values):
+            if col_id >= len(table.header):
+                del self.sorted_values[col_id]
+        for col_id in col_ids:
+            self.sorted_values.pop(col_id, None)
+            if table.header.types[col_id] != 'real':
+                continue
+            numbers = np.array([to_number(row[col_id]) for row in table.rows], dtype='float64')
+            if len(numbers) and not np.isnan(numbers).any():
+                self.sorted_values[col_id] = np.sort(numbers)
+
+    def count(self, col_id, op, value):
+        """
+        Number of rows matching the cond, None if it is not a numeric cond on an
+        indexed real column
+        """
+        number = to_number(value)
+        if col_id not in self.sorted_values or math.isnan(number):
+            return None
+        values = self.sorted_values[col_id]
+        left = int(np.searchsorted(values, number, side='left'))
+        right = int(np.searchsorted(values, number, side='right'))
+        if op == 0:
+            return len(values) - right
+        if op == 1:
+            return left
+        if op == 2:
+            return right - left
+        return len(values) - (right - left)
+
+    def selects_any(self, col_id, op, value):
+        """
+        False only when the cond is known to select no row
+        """
+        return self.count(col_id, op, value) != 0
+
+
+class SqlExecutor:
+    """
+    Execute `SQL` objects against tables with numpy masks. The columnar view of
+    the most recent `max_tables` tables is cached, and the masks of the conds
+    shared by the sqls of one `execute_batch` call are computed once.
+
+    Results are a list with one item per (sel, agg): a tuple of the selected
+    cells when there is no agg, the number of rows for COUNT, a float (or None
+    when there is no number) for AVG / MAX / MIN / SUM. An sql referring to a
+    column not in the table gives None.
+    """
+    def __init__(self, max_tables=1024):
+        self.max_tables = max_tables
+        self._tables = OrderedDict()
+
+    def columnar(self, table):
+        # 按内容缓存，内容相同的表共用一份
+        columnar = self._tables.pop(table.content_hash, None)
+        if columnar is None:
+            columnar = ColumnarTable(table)
+        self._tables[table.content_hash] = columnar
+        if len(self._tables) > self.max_tables:
+            self._tables.popitem(last=False)
+        return columnar
+
+    def refresh_table(self, table, changed_col_ids, old_content_hash):
+        """
+        Listener for `Tables.subscribe`: move the cached columnar view of the old
+        content to the new one, rebuilding only the changed columns
+        """
+        columnar = self._tables.pop(old_content_hash, None)
+        if columnar is not None:
+            columnar.refresh(table, changed_col_ids)
+            self._tables[table.content_hash] = columnar
+
+    def execute(self, table, sql):
+        return self.execute_batch(table, [sql])[0]
+
+    def execute_batch(self, table, sqls):
+        columnar = self.columnar(table)
+        num_cols = len(columnar.types)
+        mask_cache = {}
+        results = []
+        for sql in sqls:
+            sql = _as_sql(sql)
+            col_ids = list(sql.sel) + [cond[0] for cond in sql.conds]
+            if any(not 0 <= col_id < num_cols for col_id in col_ids):
+                results.append(None)
+                continue
+
+            masks = []
+            for col_id, op, value in sql.conds:
+                key = (col_id, op, str(value))
+                if key not in mask_cache:
+                    mask_cache[key] = columnar.cond_mask(col_id, op, value)
+                masks.append(mask_cache[key])
+            if not masks:
+                mask = np.ones(columnar.num_rows, dtype=bool)
+            elif sql.cond_conn_op == 2:
+                mask = np.logical_or.reduce(masks)
+            else:
+                mask = np.logical_and.reduce(masks)
+
+            results.append([columnar.aggregate(col_id, agg, mask) for col_id, agg in zip(sql.sel, sql.agg)])
+        return results
+
+
+def execute_reference(table, sql):
+    """
+    Row by row execution with the same semantics as SqlExecutor, for checking it
+    """
+    sql = _as_sql(sql)
+    num_cols = len(table.header)
+    if any(not 0 <= col_id < num_cols for col_id in list(sql.sel) + [cond[0] for cond in sql.conds]):
+        return None
+
+    def match(row, col_id, op, value):
+        number = to_number(value)
+        if table.header.types[col_id] == 'real' and not math.isnan(number):
+            cell = to_number(row[col_id])
+            return not math.isnan(cell) and OPS[op](cell, number)
+        return OPS[op](str(row[col_id]), str(value))
+
+    selected = []
+    for row in table.rows:
+        matches = [match(row, col_id, op, value) for col_id, op, value in sql.conds]
+        if not matches or (any(matches) if sql.cond_conn_op == 2 else all(matches)):
+            selected.append(row)
+
+    result = []
+    for col_id, agg in zip(sql.sel, sql.agg):
+        if agg == 0:
+            result.append(tuple(str(row[col_id]) for row in selected))
+        elif agg == 4:
+            result.append(len(selected))
+        else:
+            numbers = [to_number(row[col_id]) for row in selected]
+            numbers = [n for n in numbers if not math.isnan(n)]
+            if not numbers:
+                result.append(None)
+            elif agg == 1:
+                result.append(sum(numbers) / len(numbers))
+            elif agg == 2:
+                result.append(max(numbers))
+            elif agg == 3:
+                result.append(min(numbers))
+            else:
+                result.append(sum(numbers))
+    return result
+
+
+def results_equal(result, other, rel_tol=1e-6):
+    if result is None or other is None:
+        return result is None and other is None
+    if len(result) != len(other):
+        return False
+    for value, other_value in zip(result, other):
+        if isinstance(value, float) and isinstance(other_value, float):
+            if not math.isclose(value, other_value, rel_tol=rel_tol, abs_tol=rel_tol):
+                return False
+        elif value != other_value:
+            return False
+    return True
+
+
+def execution_accuracy(queries, pred_sqls, executor=None):
+    """
+    Fraction of queries whose predicted sql (SQL or dict) gives the same result
+    as `query.sql`. A predicted sql that fails to execute is counted as wrong.
+    """
+    executor = executor or SqlExecutor()
+    by_table = defaultdict(list)
+    for query_id, query in enumerate(queries):
+        by_table[query.table.id].append(query_id)
+
+    correct = 0
+    for query_ids in by_table.values():
+        table = queries[query_ids[0]].table
+        true_results = executor.execute_batch(table, [queries[i].sql for i in query_ids])
+        pred_results = executor.execute_batch(table, [pred_sqls[i] for i in query_ids])
+        for true_result, pred_result in zip(true_results, pred_results):
+            correct += pred_result is not None and results_equal(pred_result, true_result)
+    return correct / max(len(queries), 1)
@@ -0,0 +1,155 @@
+import numpy as np
+import keras.backend as K
+from keras.layers import Input, Layer
+from keras.models import Model
+from keras.utils.data_utils import Sequence
+
+
+class AttachMask(Layer):
+    """
+    Pass the hidden states through, with the padding mask of the token ids
+    attached (the mask keras-bert gets from its token embedding)
+    """
+    def __init__(self, **kwargs):
+        super(AttachMask, self).__init__(**kwargs)
+        self.supports_masking = True
+
+    def call(self, inputs, mask=None):
+        return inputs[0]
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
+
+    def compute_mask(self, inputs, mask=None):
+        return K.not_equal(inputs[1], 0)
+
+
+def split_bert(bert_model, num_frozen_layers):
+    """
+    Split a keras-bert encoder after its `num_frozen_layers`-th transformer layer.
+
+    Returns:
+    prefix_model: [token_ids, segment_ids] -> hidden states of the lower layers
+    upper_model: [token_ids, hidden_states] -> output of the whole encoder,
+        made of the same layer objects as `bert_model`, so training it trains
+        the original encoder
+    """
+    boundary = bert_model.get_layer('Encoder-{}-FeedForward-Norm'.format(num_frozen_layers)).get_output_at(0)
+    prefix_model = Model(bert_model.inputs, boundary)
+
+    hidden_size = K.int_shape(boundary)[-1]
+    token_ids = Input(shape=(None,), name='Input-Token-Upper')
+    hidden_states = Input(shape=(None, hidden_size), name='Input-Hidden-States')
+    tensor_map = {id(boundary): AttachMask(name='Hidden-States-Mask')([hidden_states, token_ids])}
+
+    # bert_model.layers 按拓扑顺序排列，依次在新的输入上重新调用边界之后的层
+    for layer in bert_model.layers:
+        node = layer._inbound_nodes[0]
+        if not node.input_tensors or not all(id(t) in tensor_map for t in node.input_tensors):
+            continue
+        layer_inputs = [tensor_map[id(t)] for t in node.input_tensors]
+        outputs = layer(layer_inputs[0] if len(layer_inputs) == 1 else layer_inputs)
+        tensor_map[id(node.output_tensors[0])] = outputs
+
+    upper_model = Model([token_ids, hidden_states], tensor_map[id(bert_model.outputs[0])])
+    return prefix_model, upper_model
+
+
+class HiddenStateStore:
+    """
+    Memory-mapped float16 store of per-item hidden states (padding stripped).
+
+    params:
+        - max_bytes: 内存映射文件的大小上限，存满之后的新 item 不再缓存，每次重新计算
+    """
+    def __init__(self, cache_file, hidden_size, max_bytes=8 * 1024 ** 3):
+        self.hidden_size = hidden_size
+        num_rows = max(1, max_bytes // (2 * hidden_size))
+        self.states = np.memmap(cache_file, dtype='float16', mode='w+', shape=(num_rows, hidden_size))
+        self.index = {}
+        self._next_row = 0
+        self.num_rejected = 0
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        start, length = self.index[key]
+        return self.states[start: start + length]
+
+    def put(self, key, hidden_states):
+        length = len(hidden_states)
+        if self._next_row + length > len(self.states):
+            self.num_rejected += 1
+            return False
+        self.states[self._next_row: self._next_row + length] = hidden_states
+        self.index[key] = (self._next_row, length)
+        self._next_row += length
+        return True
+
+    def nbytes(self):
+        return self._next_row * self.hidden_size * 2
+
+
+class CachedFeatureSequence(Sequence):
+    """
+    Wrap a training DataSequence / QuestionCondPairsDataseq: the hidden states
+    of the frozen lower bert layers are computed once per item by `prefix_model`
+    and then read from `store`, and added to the inputs as `input_hidden_states`.
+    Items the store has no room for are recomputed every time.
+
+    params:
+        - input_names: token ids 和 segment ids 在 inputs 中的名字，model2 为 ('input_x1', 'input_x2')
+    """
+    def __init__(self, dataseq, prefix_model, store,
+                 input_names=('input_token_ids', 'input_segment_ids')):
+        if getattr(dataseq, 'shuffle_header', False) or getattr(dataseq, 'column_window', False):
+            raise ValueError('cached features need a fixed column order, set shuffle_header=False '
+                             'and column_window=False')
+        self.dataseq = dataseq
+        self.prefix_model = prefix_model
+        self.prefix_model._make_predict_function()
+        self.store = store
+        self.input_names = input_names
+        self.num_computed = 0
+        self.num_cached = 0
+
+    def __getitem__(self, batch_id):
+        inputs, outputs = self.dataseq[batch_id]
+        keys = self.dataseq.batch_keys(batch_id)
+        token_ids = inputs[self.input_names[0]]
+        segment_ids = inputs[self.input_names[1]]
+        lengths = np.sum(token_ids != 0, axis=-1)
+
+        hidden_states = np.zeros(token_ids.shape + (self.store.hidden_size,), dtype='float32')
+        missing = [i for i, key in enumerate(keys) if key not in self.store]
+        missing_set = set(missing)
+        if missing:
+            computed = self.prefix_model.predict_on_batch([token_ids[missing], segment_ids[missing]])
+            for i, states in zip(missing, computed):
+                hidden_states[i, :lengths[i]] = states[:lengths[i]]
+                self.store.put(keys[i], states[:lengths[i]].astype('float16'))
+        for i, key in enumerate(keys):
+            if i not in missing_set:
+                hidden_states[i, :lengths[i]] = self.store.get(key)
+        self.num_computed += len(missing)
+        self.num_cached += len(keys) - len(missing)
+
+        inputs = dict(inputs, input_hidden_states=hidden_states)
+        return inputs, outputs
+
+    @property
+    def TOKEN_IDS_INPUT(self):
+        return self.input_names[0]
+
+    def __len__(self):
+        return len(self.dataseq)
+
+    def on_epoch_end(self):
+        self.dataseq.on_epoch_end()
+
+    def get_state(self):
+        return self.dataseq.get_state()
+
+    def set_state(self, state):
+        self.dataseq.set_state(state)
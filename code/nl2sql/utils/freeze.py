@@ -0,0 +1,148 @@
+import json
+import time
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+from tensorflow.tools.graph_transforms import TransformGraph
+
+
+GRAPH_TRANSFORMS = [
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'strip_unused_nodes',
+    'sort_by_execution_order'
+]
+
+
+def freeze_model(model, graph_file, transforms=GRAPH_TRANSFORMS):
+    """
+    Export a keras model to an inference-only frozen graph.
+
+    `K.set_learning_phase(0)` must be called before the model is built, so that
+    dropout and other training-only branches are not part of the graph.
+    Variables are converted to constants, training nodes are removed and
+    constants are folded. The input / output tensor names are written next to
+    the graph as `<graph_file>.signature.json`.
+    """
+    session = K.get_session()
+    input_names = [t.op.name for t in model.inputs]
+    output_names = [t.op.name for t in model.outputs]
+
+    graph_def = session.graph.as_graph_def()
+    graph_def = tf.graph_util.convert_variables_to_constants(session, graph_def, output_names)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=input_names + output_names)
+    if transforms:
+        graph_def = TransformGraph(graph_def, input_names, output_names, transforms)
+
+    with tf.gfile.GFile(graph_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    signature = {
+        'inputs': {name: t.name for name, t in zip(model.input_names, model.inputs)},
+        'outputs': {name: t.name for name, t in zip(model.output_names, model.outputs)}
+    }
+    with open(signature_file_of(graph_file), 'w') as f:
+        json.dump(signature, f, indent=2)
+    return signature
+
+
+def signature_file_of(graph_file):
+    return graph_file + '.signature.json'
+
+
+class FrozenModel:
+    """
+    Run a graph exported by `freeze_model`, a drop-in replacement of the keras
+    model for `predict_on_batch` / `predict_generator`.
+    """
+    def __init__(self, graph_file, intra_op_threads=0, inter_op_threads=0):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(graph_file, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        with open(signature_file_of(graph_file)) as f:
+            self.signature = json.load(f)
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                inter_op_parallelism_threads=inter_op_threads)
+        self.session = tf.Session(graph=self.graph, config=config)
+
+        self.input_names = list(self.signature['inputs'])
+        self.output_names = list(self.signature['outputs'])
+        self._inputs = {name: self.graph.get_tensor_by_name(tensor_name)
+                        for name, tensor_name in self.signature['inputs'].items()}
+        self._outputs = [self.graph.get_tensor_by_name(tensor_name)
+                         for tensor_name in self.signature['outputs'].values()]
+
+    def predict_on_batch(self, inputs):
+        if not isinstance(inputs, dict):
+            inputs = dict(zip(self.input_names, inputs))
+        feed_dict = {self._inputs[name]: inputs[name] for name in self.input_names}
+        outputs = self.session.run(self._outputs, feed_dict=feed_dict)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def predict_generator(self, generator, verbose=0):
+        all_outputs = []
+        for batch_id in range(len(generator)):
+            batch_data = generator[batch_id]
+            if isinstance(batch_data, tuple):
+                batch_data = batch_data[0]
+            outputs = self.predict_on_batch(batch_data)
+            if not isinstance(outputs, list):
+                outputs = [outputs]
+            all_outputs.append(outputs)
+            if verbose:
+                print('\r{}/{}'.format(batch_id + 1, len(generator)), end='')
+        if verbose:
+            print()
+        all_outputs = [np.concatenate(outputs) for outputs in zip(*all_outputs)]
+        return all_outputs[0] if len(all_outputs) == 1 else all_outputs
+
+    def close(self):
+        self.session.close()
+
+
+def compare_latency(keras_model, frozen_model, dataseq, num_batches=20, atol=1e-5):
+    """
+    Time `predict_on_batch` of both models on the first batches of `dataseq`
+    and check that their outputs are identical (up to `atol`).
+    The first batch is used for warming up and is not timed.
+    """
+    keras_times, frozen_times = [], []
+    max_abs_diff = 0.
+    num_batches = min(num_batches, len(dataseq))
+    for batch_id in range(num_batches):
+        batch_data = dataseq[batch_id]
+        if isinstance(batch_data, tuple):
+            batch_data = batch_data[0]
+
+        start = time.perf_counter()
+        keras_outputs = keras_model.predict_on_batch(batch_data)
+        keras_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frozen_outputs = frozen_model.predict_on_batch(batch_data)
+        frozen_time = time.perf_counter() - start
+
+        if not isinstance(keras_outputs, list):
+            keras_outputs, frozen_outputs = [keras_outputs], [frozen_outputs]
+        for keras_output, frozen_output in zip(keras_outputs, frozen_outputs):
+            max_abs_diff = max(max_abs_diff, float(np.max(np.abs(keras_output - frozen_output))))
+
+        if batch_id > 0 or num_batches == 1:
+            keras_times.append(keras_time)
+            frozen_times.append(frozen_time)
+
+    keras_latency = float(np.mean(keras_times)) * 1000
+    frozen_latency = float(np.mean(frozen_times)) * 1000
+    return {
+        'num_batches': len(keras_times),
+        'keras_latency_ms': keras_latency,
+        'frozen_latency_ms': frozen_latency,
+        'speedup': keras_latency / frozen_latency,
+        'max_abs_diff': max_abs_diff,
+        'identical': max_abs_diff <= atol
+    }
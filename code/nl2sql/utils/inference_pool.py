@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import traceback
+import multiprocessing as mp
+import tensorflow as tf
+import keras.backend as K
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(mp.cpu_count()))
+
+
+def core_sets(num_instances, cores=None):
+    """
+    Split the cores into `num_instances` disjoint contiguous sets
+    """
+    cores = available_cores() if cores is None else list(cores)
+    if num_instances > len(cores):
+        raise ValueError('{} instances for {} cores'.format(num_instances, len(cores)))
+    size, rest = divmod(len(cores), num_instances)
+    sets, start = [], 0
+    for i in range(num_instances):
+        end = start + size + (1 if i < rest else 0)
+        sets.append(cores[start: end])
+        start = end
+    return sets
+
+
+def _instance_main(rank, cores, intra_op_threads, inter_op_threads, build_fn, predict_fn,
+                   task_queue, result_queue, warmup_payload=None):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                                   inter_op_parallelism_threads=inter_op_threads)))
+    try:
+        state = build_fn()
+        if warmup_payload is not None:
+            predict_fn(state, warmup_payload)
+    except Exception:
+        result_queue.put(('error', rank, traceback.format_exc()))
+        return
+    result_queue.put(('ready', rank, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, payload = task
+        try:
+            result_queue.put((task_id, rank, predict_fn(state, payload)))
+        except Exception:
+            result_queue.put(('error', rank, traceback.format_exc()))
+
+
+class InferencePool:
+    """
+    `num_instances` spawned model instances, each pinned to its own set of cores
+    and running tensorflow with `intra_op_threads` / `inter_op_threads`.
+
+    Every instance calls `build_fn()` once (e.g. build the model and load the
+    weights) and then `predict_fn(state, payload)` for each payload given to
+    `map`; both must be module level functions. `map` returns the results in
+    the order of the payloads.
+
+    params:
+        - intra_op_threads: 默认为每个实例分到的核数
+        - warmup_payload: 每个实例在 build_fn 之后先预测一次，全部预热完成后才返回
+    """
+    def __init__(self, build_fn, predict_fn, num_instances, intra_op_threads=None, inter_op_threads=1,
+                 cores=None, warmup_payload=None):
+        self.num_instances = num_instances
+        self.core_sets = core_sets(num_instances, cores)
+        self.intra_op_threads = intra_op_threads or len(self.core_sets[-1])
+        self.inter_op_threads = inter_op_threads
+
+        ctx = mp.get_context('spawn')
+        self.task_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.instances = []
+        # MKL / OpenMP 的线程数在子进程 import tensorflow 时读取，启动前通过环境变量设置
+        old_omp = os.environ.get('OMP_NUM_THREADS')
+        os.environ['OMP_NUM_THREADS'] = str(self.intra_op_threads)
+        try:
+            for rank, cores_ in enumerate(self.core_sets):
+                instance = ctx.Process(target=_instance_main,
+                                       args=(rank, cores_, self.intra_op_threads, self.inter_op_threads,
+                                             build_fn, predict_fn, self.task_queue, self.result_queue,
+                                             warmup_payload))
+                instance.start()
+                self.instances.append(instance)
+        finally:
+            if old_omp is None:
+                os.environ.pop('OMP_NUM_THREADS')
+            else:
+                os.environ['OMP_NUM_THREADS'] = old_omp
+
+        for _ in range(num_instances):
+            self._get_result()
+
+    def _get_result(self):
+        while True:
+            try:
+                result = self.result_queue.get(timeout=10)
+            except queue.Empty:
+                failed = [p for p in self.instances if p.exitcode not in (None, 0)]
+                if failed:
+                    self.close()
+                    raise RuntimeError('inference instance exited with code {}'.format(failed[0].exitcode))
+                continue
+            if result[0] == 'error':
+                self.close()
+                raise RuntimeError('inference instance {} failed:\n{}'.format(result[1], result[2]))
+            return result
+
+    def map(self, payloads):
+        for task_id, payload in enumerate(payloads):
+            self.task_queue.put((task_id, payload))
+        results = [None] * len(payloads)
+        for _ in range(len(payloads)):
+            task_id, _, result = self._get_result()
+            results[task_id] = result
+        return results
+
+    def close(self):
+        for instance in self.instances:
+            if instance.is_alive():
+                self.task_queue.put(None)
+        for instance in self.instances:
+            instance.join(timeout=30)
+            if instance.is_alive():
+                instance.terminate()
+        self.instances = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def chunks(items, chunk_size):
+    return [items[i: i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def tuning_candidates(num_cores=None, max_instances=None):
+    """
+    (num_instances, intra_op_threads, inter_op_threads) to try: powers of two
+    instances sharing all cores, 1 or 2 inter-op threads
+    """
+    num_cores = num_cores or len(available_cores())
+    max_instances = max_instances or num_cores
+    candidates = []
+    num_instances = 1
+    while num_instances <= min(num_cores, max_instances):
+        intra = num_cores // num_instances
+        for inter in (1, 2):
+            candidates.append((num_instances, intra, inter))
+        num_instances *= 2
+    return candidates
+
+
+def autotune(build_fn, predict_fn, payloads, candidates=None, num_items=None):
+    """
+    Run `payloads` with every candidate configuration and return the results
+    sorted by throughput (items per second, `num_items` defaults to the total
+    length of the payloads). Each instance is warmed up with the first payload
+    before the timing starts.
+    """
+    candidates = candidates or tuning_candidates()
+    num_items = num_items or sum(len(payload) for payload in payloads)
+    results = []
+    for num_instances, intra, inter in candidates:
+        with InferencePool(build_fn, predict_fn, num_instances, intra, inter,
+                           warmup_payload=payloads[0]) as pool:
+            start = time.time()
+            pool.map(payloads)
+            seconds = time.time() - start
+        results.append({
+            'num_instances': num_instances,
+            'intra_op_threads': intra,
+            'inter_op_threads': inter,
+            'seconds': seconds,
+            'items_per_sec': num_items / seconds
+        })
+        print('~~ {} instances x {} intra / {} inter threads: {:.1f} items/s'.format(
+            num_instances, intra, inter, results[-1]['items_per_sec']))
+    return sorted(results, key=lambda r: r['items_per_sec'], reverse=True)
@@ -0,0 +1,112 @@
+import re
+import time
+import keras.backend as K
+from keras.callbacks import Callback
+
+
+ENCODER_PATTERN = re.compile(r'^Encoder-(\d+)-')
+
+
+def num_encoder_layers(bert_model):
+    return max(int(ENCODER_PATTERN.match(layer.name).group(1))
+               for layer in bert_model.layers if ENCODER_PATTERN.match(layer.name))
+
+
+def freeze_bert_layers(bert_model, num_frozen_layers):
+    """
+    Freeze the embeddings and the lower `num_frozen_layers` transformer layers
+    of a keras-bert encoder, everything above stays trainable.
+    `num_frozen_layers=0` makes the whole encoder trainable.
+    """
+    for layer in bert_model.layers:
+        match = ENCODER_PATTERN.match(layer.name)
+        if match:
+            layer.trainable = int(match.group(1)) > num_frozen_layers
+        else:
+            layer.trainable = num_frozen_layers == 0
+
+
+def _optimizer_slots(weights, params):
+    """
+    Split optimizer weights into scalar counters (iterations etc.) and groups of
+    one slot per param (ms, vs, ...), which is how RAdam and the keras
+    optimizers lay them out
+    """
+    counters, groups = [], []
+    i = 0
+    while i < len(weights):
+        if len(K.int_shape(weights[i])) == 0:
+            counters.append(weights[i])
+            i += 1
+        else:
+            groups.append(dict(zip([p.name for p in params], weights[i: i + len(params)])))
+            i += len(params)
+    return counters, groups
+
+
+def recompile(model):
+    """
+    Compile `model` again after changing `trainable`, keeping the optimizer
+    state: counters are kept and the slots of params which stay trainable are
+    copied, slots of newly trainable params start from zero
+    """
+    model._make_train_function()
+    old_params = model._collected_trainable_weights
+    old_counters, old_groups = _optimizer_slots(model.optimizer.weights, old_params)
+    old_counter_values = K.batch_get_value(old_counters)
+    old_group_values = [dict(zip(group.keys(), K.batch_get_value(list(group.values()))))
+                        for group in old_groups]
+
+    model.compile(optimizer=model.optimizer, loss=model.loss, metrics=model.metrics,
+                  loss_weights=model.loss_weights)
+    model._make_train_function()
+
+    counters, groups = _optimizer_slots(model.optimizer.weights, model._collected_trainable_weights)
+    value_pairs = list(zip(counters, old_counter_values))
+    for group, old_values in zip(groups, old_group_values):
+        for name, weight in group.items():
+            if name in old_values:
+                value_pairs.append((weight, old_values[name]))
+    K.batch_set_value(value_pairs)
+
+
+class UnfreezeSchedule(Callback):
+    """
+    Progressively unfreeze the bert encoder during training.
+
+    params:
+        - schedule: {epoch 或 step: 冻结的层数}，例如 {0: 8, 2: 4, 4: 0} 表示
+          前 2 个 epoch 冻结 embedding 和前 8 层，之后冻结前 4 层，第 4 个 epoch 起全部训练
+        - by: 'epoch' 或 'step'（step 在整个训练中累计计数）
+    """
+    def __init__(self, bert_model, schedule, by='epoch'):
+        if by not in ('epoch', 'step'):
+            raise ValueError("by should be 'epoch' or 'step'")
+        self.bert_model = bert_model
+        self.schedule = schedule
+        self.by = by
+        self.num_frozen_layers = None
+        self.epoch_times = []
+        self._steps = 0
+        self._epoch_start = None
+
+    def _apply(self, key):
+        if key not in self.schedule or self.schedule[key] == self.num_frozen_layers:
+            return
+        self.num_frozen_layers = self.schedule[key]
+        freeze_bert_layers(self.bert_model, self.num_frozen_layers)
+        recompile(self.model)
+        print('~~ {} {}: {} bert layers frozen'.format(self.by, key, self.num_frozen_layers))
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.time()
+        if self.by == 'epoch':
+            self._apply(epoch)
+
+    def on_batch_begin(self, batch, logs=None):
+        if self.by == 'step':
+            self._apply(self._steps)
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.time() - self._epoch_start)
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process since it started, in bytes
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # linux 下单位是 KB
+
+
+def pair_nbytes(pair):
+    """
+    Approximate memory held by one QuestionCondPair (object, attribute dict,
+    strings and cond_sql tuple)
+    """
+    nbytes = sys.getsizeof(pair) + sys.getsizeof(pair.__dict__)
+    for value in pair.__dict__.values():
+        nbytes += sys.getsizeof(value)
+        if isinstance(value, tuple):
+            nbytes += sum(sys.getsizeof(v) for v in value)
+    return nbytes
+
+
+class MemoryTracker:
+    """
+    Record the RSS (and optionally the python allocations traced by tracemalloc)
+    of every stage:
+
+        tracker = MemoryTracker()
+        with tracker.stage('build_pairs'):
+            ...
+        tracker.dump('memory_report.json')
+
+    params:
+        - trace_python: 用 tracemalloc 记录每个阶段 python 对象分配的峰值，会明显拖慢运行速度
+
+    tracemalloc.reset_peak 在 python 3.9 才有，这里在每个阶段开始和结束时重新开始
+    tracemalloc，把每一段的分配量和峰值累加到所有未结束的阶段上（可以嵌套）。
+    重新开始后之前分配的对象被释放时不再计入，所以 traced_delta 是近似值。
+    """
+    def __init__(self, trace_python=False):
+        self.trace_python = trace_python
+        self.stages = []
+        self._open_traces = []  # 未结束的阶段：[从阶段开始累计的分配量, 峰值]
+        if trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _restart_trace(self):
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        for open_trace in self._open_traces:
+            open_trace[1] = max(open_trace[1], open_trace[0] + traced_peak)
+            open_trace[0] += traced
+        tracemalloc.stop()
+        tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = current_rss()
+        if self.trace_python:
+            self._restart_trace()
+            self._open_traces.append([0, 0])
+        start = time.time()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'seconds': time.time() - start,
+                'rss_before': rss_before,
+                'rss_after': current_rss(),
+                'peak_rss': peak_rss()
+            }
+            record['rss_delta'] = record['rss_after'] - rss_before
+            if self.trace_python:
+                self._restart_trace()
+                record['traced_delta'], record['traced_peak'] = self._open_traces.pop()
+            self.stages.append(record)
+
+    def top_allocations(self, limit=10):
+        """
+        The source lines holding the most traced memory allocated since the
+        last stage ended
+        """
+        if not self.trace_python:
+            return []
+        stats = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+        return [{'location': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in stats]
+
+    def report(self):
+        lines = ['{:<28} {:>8} {:>12} {:>12} {:>12}'.format('stage', 'seconds', 'rss_after', 'rss_delta', 'peak_rss')]
+        for record in self.stages:
+            lines.append('{:<28} {:>8.1f} {:>10.1f}MB {:>10.1f}MB {:>10.1f}MB'.format(
+                record['stage'], record['seconds'], record['rss_after'] / 2 ** 20,
+                record['rss_delta'] / 2 ** 20, record['peak_rss'] / 2 ** 20))
+        return '\n'.join(lines)
+
+    def dump(self, json_file):
+        with open(json_file, 'w') as f:
+            json.dump({'stages': self.stages, 'top_allocations': self.top_allocations()}, f, indent=2)
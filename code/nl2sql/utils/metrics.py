@@ -0,0 +1,192 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+FILL_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'buckets': OrderedDict(zip([str(b) for b in self.buckets], self.bucket_counts))
+        }
+
+
+class Registry:
+    """
+    Counters and histograms of one process, safe to update from the keras
+    worker threads
+    """
+    def __init__(self):
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'time': time.time(),
+                'counters': dict(self.counters),
+                'histograms': {name: h.to_dict() for name, h in self.histograms.items()}
+            }
+
+    def to_prometheus(self, prefix='nl2sql_'):
+        """
+        Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, value in self.counters.items():
+                lines.append('# TYPE {}{} counter'.format(prefix, name))
+                lines.append('{}{} {}'.format(prefix, name, value))
+            for name, h in self.histograms.items():
+                full_name = prefix + name
+                lines.append('# TYPE {} histogram'.format(full_name))
+                cumulative = 0
+                for upper, count in zip(h.buckets, h.bucket_counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(full_name, upper, cumulative))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(full_name, h.count))
+                lines.append('{}_sum {}'.format(full_name, h.sum))
+                lines.append('{}_count {}'.format(full_name, h.count))
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_registry = None
+
+
+# 默认关闭，关闭时每次调用只有一次全局变量判断的开销
+
+def enable():
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def enabled():
+    return _registry is not None
+
+
+def get_registry():
+    return _registry
+
+
+def inc(name, value=1):
+    if _registry is not None:
+        _registry.inc(name, value)
+
+
+def observe(name, value, buckets=TIME_BUCKETS):
+    if _registry is not None:
+        _registry.observe(name, value, buckets)
+
+
+def timer(name):
+    """
+    with metrics.timer('read_data_seconds'):
+        ...
+    """
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer(_registry, name)
+
+
+def timed(name):
+    """
+    Decorator version of `timer`
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _registry is None:
+                return fn(*args, **kwargs)
+            with _Timer(_registry, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_json(json_file):
+    with open(json_file, 'w') as f:
+        json.dump(_registry.snapshot() if _registry is not None else {}, f, indent=2)
+
+
+def write_prometheus(prom_file, prefix='nl2sql_'):
+    with open(prom_file, 'w') as f:
+        f.write(_registry.to_prometheus(prefix) if _registry is not None else '')
+
+
+def dump(metrics_file):
+    """
+    Write the metrics as Prometheus text if `metrics_file` ends with .prom,
+    otherwise as a JSON snapshot
+    """
+    if metrics_file.endswith('.prom'):
+        write_prometheus(metrics_file)
+    else:
+        write_json(metrics_file)
@@ -16,6 +16,11 @@ class RAdam(Optimizer):
         amsgrad: boolean. Whether to apply the AMSGrad variant of this
             algorithm from the paper "On the Convergence of Adam and
             Beyond".
+        accum_steps: int >= 1. Gradients are summed over this many
+            batches and the update is applied once with their mean, so
+            the effective batch size is `accum_steps` times the batch
+            size. `iterations` and the decay / rectification schedule
+            count applied updates, not batches.
     # References
         - [RAdam - A Method for Stochastic Optimization]
           (https://arxiv.org/abs/1908.03265)
@@ -24,10 +29,15 @@ class RAdam(Optimizer):
     """
 
     def __init__(self, lr=0.001, beta_1=0.9, beta_2=0.999,
-                 epsilon=None, decay=0., **kwargs):
+                 epsilon=None, decay=0., accum_steps=1, **kwargs):
         super(RAdam, self).__init__(**kwargs)
+        if accum_steps < 1:
+            raise ValueError('accum_steps should be >= 1, got {}'.format(accum_steps))
+        self.accum_steps = accum_steps
         with K.name_scope(self.__class__.__name__):
             self.iterations = K.variable(0, dtype='int64', name='iterations')
+            if accum_steps > 1:
+                self.accum_iterations = K.variable(0, dtype='int64', name='accum_iterations')
             self.lr = K.variable(lr, name='lr')
             self.beta_1 = K.variable(beta_1, name='beta_1')
             self.beta_2 = K.variable(beta_2, name='beta_2')
@@ -39,6 +49,9 @@ class RAdam(Optimizer):
 
     @interfaces.legacy_get_updates_support
     def get_updates(self, loss, params):
+        if self.accum_steps > 1:
+            return self._get_accum_updates(loss, params)
+
         grads = self.get_gradients(loss, params)
         self.updates = [K.update_add(self.iterations, 1)]
 
@@ -81,11 +94,65 @@ class RAdam(Optimizer):
             self.updates.append(K.update(p, new_p))
         return self.updates
 
+    def _get_accum_updates(self, loss, params):
+        grads = self.get_gradients(loss, params)
+        accum_iterations_t = self.accum_iterations + 1
+        self.updates = [K.update(self.accum_iterations, accum_iterations_t)]
+
+        # 每累积 accum_steps 个 batch 的梯度才真正更新一次参数
+        apply_int = K.cast(K.equal(accum_iterations_t % self.accum_steps, 0), 'int64')
+        apply = K.cast(apply_int, K.floatx())
+        self.updates.append(K.update_add(self.iterations, apply_int))
+
+        lr = self.lr
+        if self.initial_decay > 0:
+            lr = lr * (1. / (1. + self.decay * K.cast(self.iterations,
+                                                      K.dtype(self.decay))))
+
+        t = K.cast(self.iterations, K.floatx()) + 1
+        beta_1_t = K.pow(self.beta_1, t)
+        beta_2_t = K.pow(self.beta_2, t)
+        rho = 2 / (1 - self.beta_2) - 1
+        rho_t = rho - 2 * t * beta_2_t / (1 - beta_2_t)
+        r_t = K.sqrt(
+            K.relu(rho_t - 4) * K.relu(rho_t - 2) *
+            rho / ((rho - 4) * (rho - 2) * rho_t)
+        )
+        flag = K.cast(rho_t > 4, K.floatx())
+
+        ms = [K.zeros(K.int_shape(p), dtype=K.dtype(p)) for p in params]
+        vs = [K.zeros(K.int_shape(p), dtype=K.dtype(p)) for p in params]
+        gs = [K.zeros(K.int_shape(p), dtype=K.dtype(p)) for p in params]
+        self.weights = [self.iterations] + ms + vs + [self.accum_iterations] + gs
+
+        for p, g, m, v, acc_g in zip(params, grads, ms, vs, gs):
+            acc_g_t = acc_g + g
+            g_t = acc_g_t / self.accum_steps
+            m_t = (self.beta_1 * m) + (1. - self.beta_1) * g_t
+            v_t = (self.beta_2 * v) + (1. - self.beta_2) * K.square(g_t)
+            mhat_t = m_t / (1 - beta_1_t)
+            vhat_t = K.sqrt(v_t / (1 - beta_2_t))
+            p_t = p - apply * lr * mhat_t * \
+                (flag * r_t / (vhat_t + self.epsilon) + (1 - flag))
+
+            self.updates.append(K.update(m, apply * m_t + (1 - apply) * m))
+            self.updates.append(K.update(v, apply * v_t + (1 - apply) * v))
+            self.updates.append(K.update(acc_g, (1 - apply) * acc_g_t))
+            new_p = p_t
+
+            # Apply constraints.
+            if getattr(p, 'constraint', None) is not None:
+                new_p = p.constraint(new_p)
+
+            self.updates.append(K.update(p, new_p))
+        return self.updates
+
     def get_config(self):
         config = {'lr': float(K.get_value(self.lr)),
                   'beta_1': float(K.get_value(self.beta_1)),
                   'beta_2': float(K.get_value(self.beta_2)),
                   'decay': float(K.get_value(self.decay)),
-                  'epsilon': self.epsilon}
+                  'epsilon': self.epsilon,
+                  'accum_steps': self.accum_steps}
         base_config = super(RAdam, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
@@ -0,0 +1,212 @@
+import math
+import numpy as np
+import keras.backend as K
+from keras.layers import Input, Layer, Lambda
+from keras.models import Model
+from keras.preprocessing.sequence import pad_sequences
+from keras.utils.data_utils import Sequence
+
+from nl2sql.utils.distill import get_bert_layer
+
+
+class PackedPositionEmbedding(Layer):
+    """
+    Add the position embeddings of explicit position ids (reset at the start of
+    every packed pair), using the weights of the keras-bert `Embedding-Position` layer
+    """
+    def __init__(self, position_layer, **kwargs):
+        super(PackedPositionEmbedding, self).__init__(**kwargs)
+        self.supports_masking = True
+        self.position_layer = position_layer
+
+    def call(self, inputs, mask=None):
+        x, position_ids = inputs
+        return x + K.gather(self.position_layer.embeddings, K.cast(position_ids, 'int32'))
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
+
+    def compute_mask(self, inputs, mask=None):
+        return mask[0] if isinstance(mask, list) else mask
+
+
+class BlockDiagonalAttention(Layer):
+    """
+    Multi-head self-attention with the weights of a keras-multi-head
+    `MultiHeadAttention` layer, every token attending only to the tokens of its
+    own packed pair (same pack id, pack id 0 is padding)
+    """
+    def __init__(self, attention_layer, **kwargs):
+        super(BlockDiagonalAttention, self).__init__(**kwargs)
+        self.supports_masking = True
+        self.attention_layer = attention_layer
+
+    def _split_heads(self, x):
+        head_num = self.attention_layer.head_num
+        shape = K.shape(x)
+        x = K.reshape(x, (shape[0], shape[1], head_num, shape[2] // head_num))
+        return K.permute_dimensions(x, [0, 2, 1, 3])  # (batch, head, seq, head_dim)
+
+    def call(self, inputs, mask=None):
+        x, pack_ids = inputs
+        layer = self.attention_layer
+        q, k, v = K.dot(x, layer.Wq), K.dot(x, layer.Wk), K.dot(x, layer.Wv)
+        if layer.use_bias:
+            q, k, v = q + layer.bq, k + layer.bk, v + layer.bv
+        if layer.activation is not None:
+            q, k, v = layer.activation(q), layer.activation(k), layer.activation(v)
+        q, k, v = self._split_heads(q), self._split_heads(k), self._split_heads(v)
+
+        head_dim = K.cast(K.shape(q)[-1], K.floatx())
+        e = K.tf.matmul(q, k, transpose_b=True) / K.sqrt(head_dim)
+        pack_ids = K.cast(pack_ids, 'int32')
+        same_pack = K.equal(K.expand_dims(pack_ids, 2), K.expand_dims(pack_ids, 1))
+        same_pack = K.cast(same_pack, K.floatx()) * K.cast(K.expand_dims(K.greater(pack_ids, 0), 1), K.floatx())
+        # 与 ScaledDotProductAttention 相同的 -10000 掩码方式
+        e -= 10000.0 * (1.0 - K.expand_dims(same_pack, 1))
+        e = K.exp(e - K.max(e, axis=-1, keepdims=True))
+        attention = e / K.sum(e, axis=-1, keepdims=True)
+
+        y = K.permute_dimensions(K.tf.matmul(attention, v), [0, 2, 1, 3])
+        shape = K.shape(y)
+        y = K.reshape(y, (shape[0], shape[1], shape[2] * shape[3]))
+        y = K.dot(y, layer.Wo)
+        if layer.use_bias:
+            y += layer.bo
+        if layer.activation is not None:
+            y = layer.activation(y)
+        return y
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
+
+    def compute_mask(self, inputs, mask=None):
+        return mask[0] if isinstance(mask, list) else mask
+
+
+def build_packed_model(model):
+    """
+    Inference model taking packed model2 inputs, sharing the weights of the
+    trained `model`: the bert layers are re-applied in order, with the position
+    embedding and the self-attention layers replaced by their packed versions.
+
+    Inputs: input_x1, input_x2, input_positions, input_pack_ids, input_cls_positions
+    Output: (rows, pairs per row, 1) similarity of every packed pair
+    """
+    bert_model = get_bert_layer(model)
+    x1_in = Input(shape=(None,), name='input_x1', dtype='int32')
+    x2_in = Input(shape=(None,), name='input_x2')
+    positions_in = Input(shape=(None,), name='input_positions', dtype='int32')
+    pack_ids_in = Input(shape=(None,), name='input_pack_ids', dtype='int32')
+    cls_positions_in = Input(shape=(None,), name='input_cls_positions', dtype='int32')
+
+    tensor_map = {id(bert_model.inputs[0]): x1_in, id(bert_model.inputs[1]): x2_in}
+    for layer in bert_model.layers:
+        node = layer._inbound_nodes[0]
+        if not node.input_tensors or not all(id(t) in tensor_map for t in node.input_tensors):
+            continue
+        layer_inputs = [tensor_map[id(t)] for t in node.input_tensors]
+        layer_input = layer_inputs[0] if len(layer_inputs) == 1 else layer_inputs
+        if layer.name == 'Embedding-Position':
+            outputs = PackedPositionEmbedding(layer, name=layer.name + '-Packed')([layer_input, positions_in])
+        elif type(layer).__name__ == 'MultiHeadAttention':
+            outputs = BlockDiagonalAttention(layer, name=layer.name + '-Packed')([layer_input, pack_ids_in])
+        else:
+            outputs = layer(layer_input)
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        for tensor, output in zip(node.output_tensors, outputs):
+            tensor_map[id(tensor)] = output
+
+    x = tensor_map[id(bert_model.outputs[0])]
+    x_cls = Lambda(lambda x: K.tf.batch_gather(x[0], K.cast(x[1], 'int32')))([x, cls_positions_in])
+    y_pred = model.get_layer('output_similarity')(x_cls)
+    return Model([x1_in, x2_in, positions_in, pack_ids_in, cls_positions_in], y_pred)
+
+
+class PackedPairsDataseq(Sequence):
+    """
+    Inference data sequence of a QuestionCondPairsDataset with several pairs
+    packed into each row of `pack_len` tokens, in dataset order. Each pair is
+    truncated to `max_len` like in QuestionCondPairsDataseq, so the scores are
+    the same as the unpacked ones.
+
+    params:
+        - pack_len: 每行拼接后的最大长度
+        - batch_size: 每个 batch 的行数
+    """
+    def __init__(self, dataset, tokenizer, max_len=120, pack_len=120, batch_size=32):
+        if pack_len < max_len:
+            raise ValueError('pack_len should be at least max_len')
+        self.dataset = dataset
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.pack_len = pack_len
+        self.batch_size = batch_size
+
+        # SimpleTokenizer 每个字符一个 token，[CLS] question [SEP] cond_text [SEP]
+        pair_lens = [min(len(pair.question) + len(pair.cond_text) + 3, max_len) for pair in dataset]
+        self.rows = []  # 每行的 (第一个 pair 的下标, pair 数)
+        start, row_len = 0, 0
+        for i, pair_len in enumerate(pair_lens):
+            if row_len + pair_len > pack_len:
+                self.rows.append((start, i - start))
+                start, row_len = i, 0
+            row_len += pair_len
+        if len(pair_lens) > start:
+            self.rows.append((start, len(pair_lens) - start))
+
+    def __len__(self):
+        return math.ceil(len(self.rows) / self.batch_size)
+
+    def batch_rows(self, batch_id):
+        return self.rows[batch_id * self.batch_size: (batch_id + 1) * self.batch_size]
+
+    def __getitem__(self, batch_id):
+        X1, X2, POSITIONS, PACK_IDS, CLS_POSITIONS = [], [], [], [], []
+        for start, num_pairs in self.batch_rows(batch_id):
+            x1, x2, positions, pack_ids, cls_positions = [], [], [], [], []
+            for pack_id in range(num_pairs):
+                pair = self.dataset[start + pack_id]
+                pair_x1, pair_x2 = self.tokenizer.encode(first=pair.question.lower(),
+                                                         second=pair.cond_text.lower())
+                pair_x1, pair_x2 = pair_x1[:self.max_len], pair_x2[:self.max_len]
+                cls_positions.append(len(x1))
+                x1 += pair_x1
+                x2 += pair_x2
+                positions += list(range(len(pair_x1)))
+                pack_ids += [pack_id + 1] * len(pair_x1)
+            X1.append(x1)
+            X2.append(x2)
+            POSITIONS.append(positions)
+            PACK_IDS.append(pack_ids)
+            CLS_POSITIONS.append(cls_positions)
+
+        def pad(seqs):
+            return pad_sequences(seqs, maxlen=None, padding='post')
+
+        return {
+            'input_x1': pad(X1),
+            'input_x2': pad(X2),
+            'input_positions': pad(POSITIONS),
+            'input_pack_ids': pad(PACK_IDS),
+            'input_cls_positions': pad(CLS_POSITIONS)
+        }
+
+
+def predict_packed(packed_model, packed_seq, progress=None):
+    """
+    Scores of all pairs in dataset order, shaped (num_pairs, 1) like the output
+    of `predict_generator` on the unpacked sequence
+    """
+    scores = []
+    batch_ids = range(len(packed_seq))
+    if progress is not None:
+        batch_ids = progress(batch_ids)
+    for batch_id in batch_ids:
+        preds = packed_model.predict_on_batch(packed_seq[batch_id])
+        for row_id, (_, num_pairs) in enumerate(packed_seq.batch_rows(batch_id)):
+            scores.append(preds[row_id, :num_pairs])
+    if not scores:
+        return np.zeros((0, 1), dtype='float32')
+    return np.concatenate(scores)
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def save_ragged(prefix, seqs, dtype='int32'):
+    """
+    Save a list of int sequences as `prefix.values.npy` (all sequences
+    concatenated) and `prefix.offsets.npy`
+    """
+    lens = np.array([len(seq) for seq in seqs], dtype='int64')
+    offsets = np.zeros(len(seqs) + 1, dtype='int64')
+    np.cumsum(lens, out=offsets[1:])
+    values = np.zeros(offsets[-1], dtype=dtype)
+    for seq, start, end in zip(seqs, offsets[:-1], offsets[1:]):
+        values[start: end] = seq
+    np.save(prefix + '.values.npy', values)
+    np.save(prefix + '.offsets.npy', offsets)
+
+
+class RaggedArray:
+    """
+    Read-only view of sequences saved by `save_ragged`. The values are memory
+    mapped, so processes opening the same files share them through the page cache.
+    """
+    def __init__(self, prefix):
+        self.values = np.load(prefix + '.values.npy', mmap_mode='r')
+        self.offsets = np.load(prefix + '.offsets.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]: self.offsets[i + 1]]
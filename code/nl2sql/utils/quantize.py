@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from nl2sql.utils.freeze import FrozenModel, signature_file_of
+
+
+QUANTIZE_TRANSFORMS = [
+    'add_default_attributes',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'quantize_weights(minimum_size=1024)',  # dense kernels and embedding tables
+    'quantize_nodes',
+    'strip_unused_nodes',
+    'sort_by_execution_order'
+]
+
+REQUANT_LOG_MESSAGE = '__requant_min_max:'
+
+
+def _load_graph_def(graph_file):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(graph_file, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def _save_graph_def(graph_def, graph_file):
+    with tf.gfile.GFile(graph_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+
+def _op_names(tensor_names):
+    return [name.split(':')[0] for name in tensor_names]
+
+
+def _run_with_stderr_to(log_file, fn):
+    """
+    The logging ops inserted by `insert_logging` print from C++ to stderr,
+    redirect the file descriptor so the requantization ranges end up in `log_file`
+    """
+    sys.stderr.flush()
+    saved_stderr = os.dup(2)
+    with open(log_file, 'w') as f:
+        os.dup2(f.fileno(), 2)
+        try:
+            fn()
+        finally:
+            sys.stderr.flush()
+            os.dup2(saved_stderr, 2)
+            os.close(saved_stderr)
+
+
+def quantize_graph(graph_file, quantized_file, calibration_batches):
+    """
+    Post-training int8 quantization of a graph exported by `freeze_model`.
+
+    Weights of dense and embedding layers are stored as int8, the matmuls run
+    as quantized ops, and the requantization ranges of the activations are
+    calibrated by running `calibration_batches` (a list of input dicts, e.g.
+    batches of sampled training queries) and frozen into the graph.
+    """
+    with open(signature_file_of(graph_file)) as f:
+        signature = json.load(f)
+    input_names = _op_names(signature['inputs'].values())
+    output_names = _op_names(signature['outputs'].values())
+
+    graph_def = _load_graph_def(graph_file)
+    quantized_def = TransformGraph(graph_def, input_names, output_names, QUANTIZE_TRANSFORMS)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        # 1. 插入记录 requantization range 的节点，并在校准数据上运行
+        logging_def = TransformGraph(
+            quantized_def, input_names, output_names,
+            ['insert_logging(op=RequantizationRange, show_name=true, message="{}")'.format(REQUANT_LOG_MESSAGE)])
+        logging_file = os.path.join(work_dir, 'logging.pb')
+        _save_graph_def(logging_def, logging_file)
+        shutil.copy(signature_file_of(graph_file), signature_file_of(logging_file))
+
+        logging_model = FrozenModel(logging_file)
+
+        def calibrate():
+            for batch_data in calibration_batches:
+                logging_model.predict_on_batch(batch_data)
+
+        min_max_log_file = os.path.join(work_dir, 'min_max.log')
+        _run_with_stderr_to(min_max_log_file, calibrate)
+        logging_model.close()
+
+        # 2. 把校准得到的范围固定到图中
+        calibrated_def = TransformGraph(
+            quantized_def, input_names, output_names,
+            ['freeze_requantization_ranges(min_max_log_file="{}")'.format(min_max_log_file),
+             'fold_constants(ignore_errors=true)',
+             'strip_unused_nodes',
+             'sort_by_execution_order'])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    _save_graph_def(calibrated_def, quantized_file)
+    shutil.copy(signature_file_of(graph_file), signature_file_of(quantized_file))
+    return {
+        'fp32_size': os.path.getsize(graph_file),
+        'int8_size': os.path.getsize(quantized_file)
+    }
@@ -0,0 +1,137 @@
+import os
+import glob
+import json
+import time
+import itertools
+import traceback
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+import keras.backend as K
+from keras.callbacks import Callback
+
+from nl2sql.utils.memory import peak_rss
+
+
+def expand_grid(grid):
+    """
+    {'learning_rate': [1e-5, 2e-5], 'max_len': [128, 160]} -> list of 4 configs
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def max_concurrent_trials(cpu_budget, memory_budget_gb, threads_per_trial, memory_per_trial_gb):
+    return max(1, min(cpu_budget // threads_per_trial, int(memory_budget_gb // memory_per_trial_gb)))
+
+
+def _progress_file(progress_dir, trial_id):
+    return os.path.join(progress_dir, 'trial_{:03d}.jsonl'.format(trial_id))
+
+
+def _read_progress(progress_file):
+    records = []
+    with open(progress_file) as f:
+        for line in f:
+            # 其他 trial 可能正在追加，没有换行符的最后一行还没写完，跳过
+            if not line.endswith('\n'):
+                break
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+class MedianStopping(Callback):
+    """
+    Record the monitored metric of every epoch in the progress file of the trial
+    and stop the trial when it is below the median of the other trials at the
+    same epoch (only after the first `grace_epochs` epochs, and once
+    `min_trials` other trials have reached that epoch).
+
+    Put it after the callback that computes `monitor` (e.g. EvaluateCallback).
+    """
+    def __init__(self, progress_dir, trial_id, monitor='val_tot_acc', grace_epochs=1, min_trials=3):
+        self.progress_dir = progress_dir
+        self.trial_id = trial_id
+        self.monitor = monitor
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+        self.stopped_epoch = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = float(logs[self.monitor])
+        progress_file = _progress_file(self.progress_dir, self.trial_id)
+        with open(progress_file, 'a') as f:
+            f.write(json.dumps({'epoch': epoch, self.monitor: value, 'time': time.time()}) + '\n')
+
+        if epoch + 1 <= self.grace_epochs:
+            return
+        others = []
+        for other_file in glob.glob(os.path.join(self.progress_dir, 'trial_*.jsonl')):
+            if other_file == progress_file:
+                continue
+            for record in _read_progress(other_file):
+                if record['epoch'] == epoch:
+                    others.append(record[self.monitor])
+        if len(others) >= self.min_trials and value < np.median(others):
+            print('~~ trial {} stopped at epoch {}: {} {:.4f} < median {:.4f}'.format(
+                self.trial_id, epoch + 1, self.monitor, value, np.median(others)))
+            self.stopped_epoch = epoch
+            self.model.stop_training = True
+
+
+def _run_trial(args):
+    trial_fn, trial_id, config, progress_dir, monitor, grace_epochs, min_trials, threads = args
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                   inter_op_parallelism_threads=2)))
+
+    stopping = MedianStopping(progress_dir, trial_id, monitor, grace_epochs, min_trials)
+    start = time.time()
+    result = {'trial_id': trial_id}
+    result.update(config)
+    try:
+        metrics = trial_fn(config, [stopping])
+        result.update(metrics)
+        result['status'] = 'stopped' if stopping.stopped_epoch is not None else 'completed'
+    except Exception:
+        traceback.print_exc()
+        result['status'] = 'failed'
+    result['elapsed'] = time.time() - start
+    result['peak_rss_gb'] = peak_rss() / 2 ** 30
+
+    progress_file = _progress_file(progress_dir, trial_id)
+    history = _read_progress(progress_file) if os.path.exists(progress_file) else []
+    result['epochs'] = len(history)
+    result['best_' + monitor] = max([r[monitor] for r in history], default=np.nan)
+    with open(os.path.join(progress_dir, 'result_{:03d}.json'.format(trial_id)), 'w') as f:
+        json.dump(result, f)
+    return result
+
+
+def run_sweep(trial_fn, configs, progress_dir, max_concurrent, threads_per_trial,
+              monitor='val_tot_acc', grace_epochs=1, min_trials=3):
+    """
+    Run `trial_fn(config, callbacks)` for every config, `max_concurrent` at a
+    time, each in a fresh spawned process (so `trial_fn` must be a module level
+    function). `trial_fn` trains with the given callbacks appended to its own
+    and returns a dict of final metrics. Trials losing to the median of the
+    others are stopped early (see MedianStopping).
+
+    Returns all trial results as one DataFrame, sorted by the best `monitor`.
+    """
+    os.makedirs(progress_dir, exist_ok=True)
+    for old_file in glob.glob(os.path.join(progress_dir, '*.json*')):
+        os.remove(old_file)
+
+    tasks = [(trial_fn, trial_id, config, progress_dir, monitor, grace_epochs, min_trials, threads_per_trial)
+             for trial_id, config in enumerate(configs)]
+    ctx = mp.get_context('spawn')
+    results = []
+    with ctx.Pool(processes=max_concurrent, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(_run_trial, tasks):
+            print('~~ trial {} {} in {:.0f}s, best {}: {:.4f}'.format(
+                result['trial_id'], result['status'], result['elapsed'], monitor, result['best_' + monitor]))
+            results.append(result)
+
+    return pd.DataFrame(results).sort_values('best_' + monitor, ascending=False).reset_index(drop=True)
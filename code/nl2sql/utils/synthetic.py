@@ -0,0 +1,161 @@
+import json
+import random
+
+
+CN_DIGITS = '零一二三四五六七八九'
+CN_UNITS = ['', '十', '百', '千']
+
+TEXT_COLUMNS = {
+    '城市': ['北京', '上海', '广州', '深圳', '杭州', '成都', '武汉', '南京', '西安', '重庆'],
+    '公司名称': ['华夏科技', '东方电气', '南方传媒', '长江证券', '中信建投', '招商银行', '海通证券'],
+    '影片名称': ['密室逃生', '流浪地球', '哪吒之魔童降世', '我和我的祖国', '中国机长', '少年的你'],
+    '产品类型': ['手机', '电视', '冰箱', '空调', '洗衣机', '笔记本电脑'],
+    '地区': ['华北', '华东', '华南', '华中', '西南', '西北', '东北'],
+    '负责人': ['张伟', '王芳', '李娜', '刘洋', '陈静', '杨磊', '赵敏'],
+    '学校': ['北京大学', '清华大学', '复旦大学', '浙江大学', '南京大学', '武汉大学']
+}
+REAL_COLUMNS = ['销量(万台)', '价格(元)', '票房(亿)', '增长率(%)', '人数', '面积(平方米)', '收入(万元)', '排名']
+YEAR_COLUMN = '年份'
+
+AGG_WORDS = {0: '', 1: '平均', 2: '最高', 3: '最低', 4: '数量', 5: '总'}
+OP_WORDS = {0: '大于', 1: '小于', 2: '是', 3: '不是'}
+
+
+def int_to_cn(value):
+    """
+    0 <= value < 10000 的整数转中文数字，如 305 -> 三百零五
+    """
+    if value == 0:
+        return CN_DIGITS[0]
+    digits = [int(d) for d in str(value)]
+    result = ''
+    for i, d in enumerate(digits):
+        unit = CN_UNITS[len(digits) - i - 1]
+        if d == 0:
+            if result and not result.endswith(CN_DIGITS[0]):
+                result += CN_DIGITS[0]
+        else:
+            result += CN_DIGITS[d] + unit
+    result = result.rstrip(CN_DIGITS[0])
+    if result.startswith('一十'):
+        result = result[1:]
+    return result
+
+
+class SyntheticGenerator:
+    """
+    Seeded generator of tables and questions in the competition format, for
+    benchmarking without the real data: mixed text / real columns, year
+    columns, values written as chinese numerals in the question and optionally
+    wide headers.
+
+    params:
+        - wide_ratio: 生成宽表（wide_cols 列）的比例
+    """
+    def __init__(self, seed=42, wide_ratio=0.1, wide_cols=40):
+        self.rng = random.Random(seed)
+        self.wide_ratio = wide_ratio
+        self.wide_cols = wide_cols
+
+    def make_table(self, table_id):
+        rng = self.rng
+        if rng.random() < self.wide_ratio:
+            num_cols = self.wide_cols
+        else:
+            num_cols = rng.randint(3, 10)
+        num_rows = rng.randint(5, 60)
+
+        text_names = rng.sample(sorted(TEXT_COLUMNS), rng.randint(1, 3))
+        header, types = list(text_names), ['text'] * len(text_names)
+        if rng.random() < 0.5:
+            header.append(YEAR_COLUMN)
+            types.append('real')
+        while len(header) < num_cols:
+            name = rng.choice(REAL_COLUMNS)
+            if name in header:
+                name = '{}{}'.format(name, len(header))  # 宽表中的重复列名
+            header.append(name)
+            types.append('real')
+
+        rows = []
+        for _ in range(num_rows):
+            row = []
+            for name, col_type in zip(header, types):
+                if col_type == 'text':
+                    row.append(rng.choice(TEXT_COLUMNS[name]))
+                elif name == YEAR_COLUMN:
+                    row.append(rng.randint(2000, 2020))
+                elif rng.random() < 0.3:
+                    row.append(round(rng.uniform(0, 1000), 2))
+                else:
+                    row.append(rng.randint(0, 5000))
+            rows.append(row)
+
+        return {
+            'id': table_id,
+            'name': 'Table_{}'.format(table_id),
+            'title': '{}统计表'.format(header[0]),
+            'header': header,
+            'types': types,
+            'rows': rows
+        }
+
+    def _cond(self, table, col_id):
+        rng = self.rng
+        name, col_type = table['header'][col_id], table['types'][col_id]
+        value = rng.choice(table['rows'])[col_id]
+        if col_type == 'text':
+            op = rng.choice([2, 2, 2, 3])
+            return [col_id, op, value], '{}{}{}'.format(name, OP_WORDS[op], value)
+
+        op = rng.choice([0, 1, 2])
+        if name == YEAR_COLUMN:
+            if rng.random() < 0.5:
+                value_text = '{}年'.format(str(value)[2:])
+            else:
+                value_text = '{}年'.format(''.join(CN_DIGITS[int(d)] for d in str(value)[2:]))
+        elif isinstance(value, int) and value < 10000 and rng.random() < 0.5:
+            value_text = int_to_cn(value)
+        else:
+            value_text = str(value)
+        name = name.split('(')[0]
+        return [col_id, op, str(value)], '{}{}{}'.format(name, OP_WORDS[op], value_text)
+
+    def make_query(self, table):
+        rng = self.rng
+        num_cols = len(table['header'])
+
+        sel = sorted(rng.sample(range(num_cols), rng.choice([1, 1, 1, 2])))
+        agg = [rng.choice([0, 0, 0, 1, 2, 3, 4, 5]) for _ in sel]
+
+        num_conds = rng.choice([1, 1, 2])
+        cond_cols = rng.sample(range(num_cols), num_conds)
+        conds, cond_texts = [], []
+        for col_id in cond_cols:
+            cond, cond_text = self._cond(table, col_id)
+            conds.append(cond)
+            cond_texts.append(cond_text)
+        cond_conn_op = rng.choice([1, 2]) if num_conds > 1 else 0
+
+        connector = '并且' if cond_conn_op == 1 else '或者'
+        sel_text = '和'.join('{}{}'.format(AGG_WORDS[a], table['header'][c].split('(')[0])
+                            for c, a in zip(sel, agg))
+        question = '{}的{}是多少？'.format(connector.join(cond_texts), sel_text)
+
+        return {
+            'table_id': table['id'],
+            'question': question,
+            'sql': {'agg': agg, 'cond_conn_op': cond_conn_op, 'sel': sel, 'conds': conds}
+        }
+
+    def write(self, table_file, data_file, num_tables=200, queries_per_table=10):
+        """
+        Write `num_tables` tables and `num_tables * queries_per_table` queries as
+        json lines, in the format read by `read_tables` / `read_data`
+        """
+        with open(table_file, 'w', encoding='utf-8') as tf, open(data_file, 'w', encoding='utf-8') as df:
+            for i in range(num_tables):
+                table = self.make_table('synthetic-{}'.format(i))
+                tf.write(json.dumps(table, ensure_ascii=False) + '\n')
+                for _ in range(queries_per_table):
+                    df.write(json.dumps(self.make_query(table), ensure_ascii=False) + '\n')
@@ -0,0 +1,173 @@
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+from keras.callbacks import Callback
+from keras.utils.data_utils import Sequence
+
+
+class InstrumentedSequence(Sequence):
+    """
+    Wrap a DataSequence / QuestionCondPairsDataseq and record for every batch
+    the fetch latency, the number of examples and the real / padded tokens.
+    The time of `on_epoch_end` (reshuffling, negative sampling) is recorded too.
+
+    The records are kept in fetch order and `pop_record` returns the oldest
+    one, the training step a record belongs to is the order in which it was
+    fetched, whatever batch index keras asked for.
+    """
+    def __init__(self, dataseq):
+        self.dataseq = dataseq
+        self.token_ids_input = dataseq.TOKEN_IDS_INPUT
+        self.batch_records = deque()  # [batch_id, record]，record 在 __getitem__ 结束前为 None
+        self.epoch_end_times = []
+        self._lock = threading.Lock()
+
+    def __getitem__(self, batch_id):
+        entry = [batch_id, None]
+        with self._lock:
+            self.batch_records.append(entry)  # 按开始取数的顺序排队
+        start = time.perf_counter()
+        batch = self.dataseq[batch_id]
+        fetch_time = time.perf_counter() - start
+
+        inputs = batch[0] if isinstance(batch, tuple) else batch
+        token_ids = inputs[self.token_ids_input]
+        entry[1] = {
+            'batch_id': batch_id,
+            'fetch_time': fetch_time,
+            'examples': len(token_ids),
+            'real_tokens': int(np.sum(token_ids != 0)),
+            'padded_tokens': int(token_ids.size)
+        }
+        return batch
+
+    def pop_record(self):
+        """
+        Record of the oldest fetched batch, None if nothing was fetched
+        """
+        with self._lock:
+            if not self.batch_records:
+                return None
+            return self.batch_records.popleft()[1]
+
+    def clear_records(self):
+        """
+        Drop the records of batches fetched but never trained on, returns how many
+        """
+        with self._lock:
+            num_records = len(self.batch_records)
+            self.batch_records.clear()
+        return num_records
+
+    def __len__(self):
+        return len(self.dataseq)
+
+    def on_epoch_end(self):
+        start = time.perf_counter()
+        self.dataseq.on_epoch_end()
+        self.epoch_end_times.append(time.perf_counter() - start)
+
+    def get_state(self):
+        return self.dataseq.get_state()
+
+    def set_state(self, state):
+        self.dataseq.set_state(state)
+
+
+class ThroughputCallback(Callback):
+    """
+    Per-step data-wait / compute time, tokens per second and padding ratio.
+
+    data_wait 是上一个 batch 结束到这个 batch 开始之间训练循环等待数据的时间，
+    fetch_time 是 __getitem__ 本身的耗时（使用 workers 预取时两者可能差很多）。
+    每个 step 一行写入 trace_file（json lines），每个 epoch 的汇总写入 summary_file 并加入 logs。
+
+    每个 step 对应按取数顺序排队的下一条记录。workers > 1 时多个线程同时取数，
+    完成顺序可能与训练顺序略有出入，因此 fit_generator 应使用 shuffle=False
+    （DataSequence / QuestionCondPairsDataseq 在 on_epoch_end 中自行打乱数据），
+    此时第 k 个 step 就是第 k 个 batch，记录中的 batch_id 可用于核对。
+    """
+    def __init__(self, instrumented_seq, trace_file=None, summary_file=None):
+        self.instrumented_seq = instrumented_seq
+        self.trace_file = trace_file
+        self.summary_file = summary_file
+        self.epoch_summaries = []
+        self._trace = None
+        self._steps = 0
+
+    def on_train_begin(self, logs=None):
+        if self.trace_file:
+            self._trace = open(self.trace_file, 'a')
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._step_records = []
+        self._epoch_start = self._last_batch_end = time.perf_counter()
+
+    def on_batch_begin(self, batch, logs=None):
+        self._batch_start = time.perf_counter()
+
+    def on_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        record = {
+            'step': self._steps,
+            'epoch': self._epoch,
+            'batch': batch,
+            'data_wait': self._batch_start - self._last_batch_end,
+            'compute': now - self._batch_start
+        }
+        record.update(self.instrumented_seq.pop_record() or {})
+        self._last_batch_end = now
+        self._steps += 1
+
+        self._step_records.append(record)
+        if self._trace is not None:
+            self._trace.write(json.dumps(record) + '\n')
+
+    def on_epoch_end(self, epoch, logs=None):
+        records = self._step_records
+        elapsed = time.perf_counter() - self._epoch_start
+        real_tokens = sum(r.get('real_tokens', 0) for r in records)
+        padded_tokens = sum(r.get('padded_tokens', 0) for r in records)
+        summary = {
+            'epoch': epoch,
+            'steps': len(records),
+            'elapsed': elapsed,
+            'data_wait': float(sum(r['data_wait'] for r in records)),
+            'compute': float(sum(r['compute'] for r in records)),
+            'fetch_time': float(sum(r.get('fetch_time', 0) for r in records)),
+            'examples_per_sec': sum(r.get('examples', 0) for r in records) / elapsed,
+            'tokens_per_sec': real_tokens / elapsed,
+            'padding_ratio': 1 - real_tokens / max(padded_tokens, 1)
+        }
+        self.epoch_summaries.append(summary)
+        print('~~ epoch {}: {:.1f} examples/s, {:.0f} tokens/s, padding {:.1%}, '
+              'data wait {:.1f}s, compute {:.1f}s'.format(
+                  epoch + 1, summary['examples_per_sec'], summary['tokens_per_sec'],
+                  summary['padding_ratio'], summary['data_wait'], summary['compute']))
+
+        if logs is not None:
+            for name in ['examples_per_sec', 'tokens_per_sec', 'padding_ratio']:
+                logs[name] = summary[name]
+        if self.summary_file:
+            with open(self.summary_file, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        if self._trace is not None:
+            self._trace.flush()
+
+    def on_train_end(self, logs=None):
+        # 每个 step 取走一条记录，剩下的只是训练结束时预取了但没有用到的 batch
+        self.instrumented_seq.clear_records()
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+def load_trace(trace_file):
+    """
+    Load a step trace written by ThroughputCallback as a pandas DataFrame
+    """
+    return pd.read_json(trace_file, lines=True)
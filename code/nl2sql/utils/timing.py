@@ -0,0 +1,68 @@
+import json
+import time
+import numpy as np
+
+
+class TimedModel:
+    """
+    Record the latency of every `predict_on_batch` call
+    """
+    def __init__(self, model):
+        self.model = model
+        self.batch_times = []
+
+    def predict_on_batch(self, inputs):
+        start = time.perf_counter()
+        outputs = self.model.predict_on_batch(inputs)
+        self.batch_times.append(time.perf_counter() - start)
+        return outputs
+
+    def latency_ms(self):
+        # 第一个 batch 用于预热，不计时
+        batch_times = self.batch_times[1:] or self.batch_times
+        return float(np.mean(batch_times)) * 1000
+
+
+def time_it(fn, repeats=5, warmup=1):
+    """
+    Run `fn()` `warmup + repeats` times, returns the timings of the repeats in
+    seconds and the result of the last call
+    """
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def summarize(timings, num_items):
+    return {
+        'median': float(np.median(timings)),
+        'min': float(np.min(timings)),
+        'items': num_items,
+        'items_per_sec': num_items / float(np.median(timings))
+    }
+
+
+def compare_with_baseline(results, baseline_file, tolerance=0.2, tolerances=None):
+    """
+    Compare the median timings with a stored baseline. A benchmark regresses
+    when its median is more than `tolerance` (or `tolerances[name]`) slower
+    than the baseline. Returns a list of (name, baseline, current, ratio, ok).
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    tolerances = tolerances or {}
+
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        ok = ratio <= 1 + tolerances.get(name, tolerance)
+        rows.append((name, baseline[name]['median'], result['median'], ratio, ok))
+    return rows
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Multi-instance CPU prediction: N model instances, each pinned to its own
+# cores, model1 over chunks of queries and model2 over chunks of cond pairs,
+# results gathered in order. `mode = 'autotune'` times the (instances,
+# intra-op, inter-op threads) candidates on a sample, separately for model1
+# and model2, and saves the results of both.
+# The instances are spawned and import this file, so everything that runs is
+# under `if __name__ == '__main__'` or in functions.
+
+import json
+
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.inference_pool import InferencePool, chunks, autotune, tuning_candidates
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+test_table_file = '../data/test/test.tables.json'
+test_data_file = '../data/test/test.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_model_path = 'task1_best_model.h5'
+task2_model_path = 'task2_model.h5'
+
+mode = 'predict'  # 'predict' 或 'autotune'
+tuning_file = 'inference_tuning.json'  # autotune 的结果，predict 时如果存在则 model1 / model2 各自使用最好的配置
+num_instances = 4
+intra_op_threads = None  # None 表示每个实例分到的核数
+inter_op_threads = 1
+
+column_window = False  # 需与 model1 训练时的设置一致
+query_chunk_size = 256
+pair_chunk_size = 2048
+autotune_num_queries = 1024
+autotune_num_pairs = 8192
+
+threshold = 0.995
+final_output_file = 'final_output.json'
+
+
+# ## Instance side
+
+def build_task1():
+    token_dict = load_vocabulary(paths.vocab)
+    model = model1.construct_model(paths)
+    model.load_weights(task1_model_path)
+    return model, model1.QueryTokenizer(token_dict), model1.SqlLabelEncoder()
+
+
+def predict_task1(state, queries):
+    model, query_tokenizer, label_encoder = state
+    dataseq = model1.DataSequence(queries, query_tokenizer, label_encoder, is_train=False,
+                                  shuffle_header=False, max_len=160, shuffle=False, batch_size=32,
+                                  column_window=column_window)
+    return model1.predict_sqls(model, dataseq)
+
+
+def build_task2():
+    model, pair_tokenizer = model2.construct_model(paths)
+    model.load_weights(task2_model_path)
+    return model, pair_tokenizer
+
+
+def predict_task2(state, pairs):
+    model, pair_tokenizer = state
+    # FullSampler 直接使用 pairs 列表
+    qc_pairs_seq = model2.QuestionCondPairsDataseq(pairs, pair_tokenizer, is_train=False,
+                                                   sampler=model2.FullSampler(), shuffle=False, batch_size=128)
+    return model.predict_generator(qc_pairs_seq)
+
+
+# ## Predict
+
+def run_predict(test_data, task1_config, task2_config):
+    with InferencePool(build_task1, predict_task1, **task1_config) as pool:
+        task1_result = [sql for result in pool.map(chunks(test_data, query_chunk_size)) for sql in result]
+
+    qc_pairs = model2.QuestionCondPairsDataset(test_data,
+                                               candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+                                               has_label=False,
+                                               model_1_outputs=task1_result)
+    task2_result = {}
+    if len(qc_pairs) > 0:
+        with InferencePool(build_task2, predict_task2, **task2_config) as pool:
+            scores = [score for result in pool.map(chunks(qc_pairs.data, pair_chunk_size)) for score in result]
+        task2_result = model2.merge_result(qc_pairs, scores, threshold=threshold)
+
+    with open(final_output_file, 'w') as f:
+        for query_id, pred_sql in enumerate(task1_result):
+            pred_sql['conds'] = list(task2_result.get(query_id, []))
+            f.write(json.dumps(pred_sql, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    test_data = read_data(test_data_file, read_tables(test_table_file))
+
+    if mode == 'autotune':
+        sample = test_data[:autotune_num_queries]
+        results = {'task1': autotune(build_task1, predict_task1, chunks(sample, query_chunk_size),
+                                     candidates=tuning_candidates())}
+        # model2 的 pairs 长度和 batch 形状都与 model1 不同，单独调优；
+        # 不依赖 model1 的预测，用 sample 中所有列的候选 pairs
+        sample_qc_pairs = model2.QuestionCondPairsDataset(
+            sample, candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True), has_label=False)
+        sample_pairs = sample_qc_pairs.data[:autotune_num_pairs]
+        if sample_pairs:
+            results['task2'] = autotune(build_task2, predict_task2, chunks(sample_pairs, pair_chunk_size),
+                                        candidates=tuning_candidates())
+        with open(tuning_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        for task, task_results in results.items():
+            print('~~ best for {}: {}'.format(task, task_results[0]))
+    else:
+        config = {'num_instances': num_instances, 'intra_op_threads': intra_op_threads,
+                  'inter_op_threads': inter_op_threads}
+        task_configs = {'task1': config, 'task2': config}
+        try:
+            with open(tuning_file) as f:
+                tuned = json.load(f)
+            for task, task_results in tuned.items():
+                task_configs[task] = {name: task_results[0][name] for name in config}
+                print('~~ using tuned config for {}: {}'.format(task, task_configs[task]))
+        except FileNotFoundError:
+            pass
+        run_predict(test_data, task_configs['task1'], task_configs['task2'])
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# End-to-end prediction: question + table -> model1 -> model2 -> final sql,
+# repeated (question, table) pairs are served from the result cache.
+
+import json
+from tqdm import tqdm_notebook as tqdm
+
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables, metrics
+from nl2sql.utils.cache import ResultCache, model_fingerprint
+from nl2sql.utils.freeze import FrozenModel
+from nl2sql.utils.distill import build_student_bert
+from nl2sql.utils.packing import build_packed_model, PackedPairsDataseq, predict_packed
+from nl2sql import model1, model2, multitask
+
+
+# ## Configuration
+
+test_table_file = '../data/test/test.tables.json'
+test_data_file = '../data/test/test.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_model_path = 'task1_best_model.h5'
+task2_model_path = 'task2_model.h5'
+
+# 使用 export.py 导出的冻结图代替 keras 模型
+use_frozen_graph = False
+task1_graph_file = 'task1_frozen.pb'
+task2_graph_file = 'task2_frozen.pb'
+
+# 使用 distill.py 训练的学生模型，与 distill.py 中的 student_layers 保持一致
+use_student = False
+student_layers = [2, 5, 8, 11]
+task1_student_path = 'task1_student_model.h5'
+task2_student_path = 'task2_student_model.h5'
+
+# 使用 multitask.py 训练的共享 bert 编码器模型，两个阶段只占用一份编码器内存
+use_shared_encoder = False
+shared_model_path = 'shared_best_model.h5'
+
+cache_file = 'result_cache.sqlite'  # None 表示只用内存缓存
+cache_capacity = 100000
+cache_stats_file = 'result_cache_stats.json'
+
+# 超宽表按列切分成多个窗口编码，不再丢弃超出 max_len 的列；需与 model1 训练时的设置一致
+column_window = False
+
+task1_max_len = 160
+task2_max_len = 120
+threshold = 0.995
+# 丢弃在表中选不出任何行的数值条件，不送入 model2 打分
+prune_empty_conds = False
+# model2 把多个短 pair 拼接到一行（块对角 attention）再打分，不能与 use_frozen_graph 同时使用
+use_packed_pairs = False
+pack_len = 256
+final_output_file = 'final_output.json'
+
+# 各阶段耗时和计数，以 .prom 结尾时写 Prometheus 文本格式，否则写 JSON；None 表示不统计
+metrics_file = None
+
+if metrics_file is not None:
+    metrics.enable()
+
+
+# ## Read Data
+
+# 表格只读入一次，预测过程中不会更新，因此不订阅 Tables 的更新；ResultCache 按表的
+# content_hash 自行失效。长期运行、会 push / update_rows 表格的服务需要订阅
+# CandidateCondsExtractor.refresh_table 和 SqlExecutor.refresh_table
+test_tables = read_tables(test_table_file)
+test_data = read_data(test_data_file, test_tables)
+
+
+# ## Load Models
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+
+if use_frozen_graph:
+    task1_model = FrozenModel(task1_graph_file)
+    task2_model = FrozenModel(task2_graph_file)
+    pair_tokenizer = model2.SimpleTokenizer(token_dict)
+elif use_shared_encoder:
+    shared_model, pair_tokenizer = multitask.construct_model(paths)
+    shared_model.load_weights(shared_model_path)
+    task1_model, task2_model = shared_model.task1, shared_model.task2
+    task1_model_path = task2_model_path = shared_model_path
+elif use_student:
+    task1_model = model1.build_model(build_student_bert(paths.config, len(student_layers)))
+    task1_model.load_weights(task1_student_path)
+    task1_model_path = task1_student_path
+
+    task2_model = model2.build_model(build_student_bert(paths.config, len(student_layers)))
+    task2_model.load_weights(task2_student_path)
+    task2_model_path = task2_student_path
+    pair_tokenizer = model2.SimpleTokenizer(token_dict)
+else:
+    task1_model = model1.construct_model(paths)
+    task1_model.load_weights(task1_model_path)
+
+    task2_model, pair_tokenizer = model2.construct_model(paths)
+    task2_model.load_weights(task2_model_path)
+
+
+if use_packed_pairs:
+    task2_packed_model = build_packed_model(task2_model)
+
+
+# ## Predict
+
+def predict_queries(queries):
+    dataseq = model1.DataSequence(
+        data=queries,
+        tokenizer=query_tokenizer,
+        label_encoder=label_encoder,
+        is_train=False,
+        shuffle_header=False,
+        max_len=task1_max_len,
+        shuffle=False,
+        batch_size=32,
+        column_window=column_window
+    )
+    task1_result = model1.predict_sqls(task1_model, dataseq, progress=tqdm)
+
+    qc_pairs = model2.QuestionCondPairsDataset(
+        queries,
+        candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+        has_label=False,
+        model_1_outputs=task1_result,
+        prune_empty_conds=prune_empty_conds
+    )
+    task2_result = {}
+    if len(qc_pairs) > 0:
+        if use_packed_pairs:
+            packed_seq = PackedPairsDataseq(qc_pairs, pair_tokenizer, max_len=task2_max_len, pack_len=pack_len)
+            with metrics.timer('model2_predict_seconds'):
+                scores = predict_packed(task2_packed_model, packed_seq, progress=tqdm)
+        else:
+            qc_pairs_seq = model2.QuestionCondPairsDataseq(qc_pairs, pair_tokenizer, is_train=False,
+                                                           sampler=model2.FullSampler(), shuffle=False,
+                                                           max_len=task2_max_len, batch_size=128)
+            with metrics.timer('model2_predict_seconds'):
+                scores = task2_model.predict_generator(qc_pairs_seq, verbose=1)
+        task2_result = model2.merge_result(qc_pairs, scores, threshold=threshold)
+
+    for query_id, pred_sql in enumerate(task1_result):
+        pred_sql['conds'] = list(task2_result.get(query_id, []))
+    return task1_result
+
+
+# 所有会影响预测结果的配置都计入缓存的指纹，配置变化后旧的缓存结果作废
+if use_frozen_graph:
+    model_type, weight_files = 'frozen_graph', [task1_graph_file, task2_graph_file]
+elif use_shared_encoder:
+    model_type, weight_files = 'shared_encoder', [shared_model_path]
+elif use_student:
+    model_type, weight_files = 'student', [task1_student_path, task2_student_path]
+else:
+    model_type, weight_files = 'full', [task1_model_path, task2_model_path]
+inference_config = {
+    'model_type': model_type,
+    'student_layers': student_layers if use_student else None,
+    'column_window': column_window,
+    'task1_max_len': task1_max_len,
+    'task2_max_len': task2_max_len,
+    'threshold': threshold,
+    'prune_empty_conds': prune_empty_conds,
+    'use_packed_pairs': use_packed_pairs,
+    'pack_len': pack_len if use_packed_pairs else None
+}
+result_cache = ResultCache(model_fingerprint(*weight_files, config=inference_config),
+                           capacity=cache_capacity,
+                           cache_file=cache_file)
+pred_sqls = result_cache.predict(test_data, predict_queries)
+
+with open(final_output_file, 'w') as f:
+    for pred_sql in pred_sqls:
+        json_str = json.dumps(pred_sql, ensure_ascii=False)
+        f.write(json_str + '\n')
+
+print('~~ result cache: {}'.format(result_cache.stats()))
+result_cache.dump_stats(cache_stats_file)
+result_cache.close()
+
+if metrics_file is not None:
+    metrics.dump(metrics_file)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Post-training int8 quantization of the frozen model1 / model2 graphs
+# (run export.py first), with an accuracy-vs-latency report against fp32.
+
+import json
+import random
+import numpy as np
+
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.freeze import FrozenModel
+from nl2sql.utils.quantize import quantize_graph
+from nl2sql.utils.timing import TimedModel
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task1_graph_file = 'task1_frozen.pb'
+task2_graph_file = 'task2_frozen.pb'
+task1_int8_graph_file = 'task1_int8.pb'
+task2_int8_graph_file = 'task2_int8.pb'
+
+num_calibration_queries = 256
+threshold = 0.995
+report_file = 'quantization_report.json'
+
+random.seed(42)
+
+
+# ## Read Data
+
+train_tables = read_tables(train_table_file)
+train_data = read_data(train_data_file, train_tables)
+
+val_tables = read_tables(val_table_file)
+val_data = read_data(val_data_file, val_tables)
+
+token_dict = load_vocabulary(paths.vocab)
+query_tokenizer = model1.QueryTokenizer(token_dict)
+label_encoder = model1.SqlLabelEncoder()
+pair_tokenizer = model2.SimpleTokenizer(token_dict)
+
+
+def task1_dataseq(queries):
+    return model1.DataSequence(queries, query_tokenizer, label_encoder, is_train=False,
+                               shuffle=False, shuffle_header=False, max_len=160, batch_size=32)
+
+
+def task2_dataseq(queries, has_label):
+    qc_pairs = model2.QuestionCondPairsDataset(
+        queries,
+        candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+        has_label=has_label
+    )
+    return model2.QuestionCondPairsDataseq(qc_pairs, pair_tokenizer, is_train=has_label,
+                                           sampler=model2.FullSampler(), shuffle=False,
+                                           batch_size=128)
+
+
+def evaluate_task1(graph_file, dataseq):
+    model = TimedModel(FrozenModel(graph_file))
+    pred_sqls = model1.predict_sqls(model, dataseq)
+    metrics = model1.evaluate_sqls(pred_sqls, [query.sql for query in dataseq.data])
+    metrics['latency_ms'] = model.latency_ms()
+    model.model.close()
+    return metrics
+
+
+def evaluate_task2(graph_file, dataseq):
+    model = TimedModel(FrozenModel(graph_file))
+    scores, labels = [], []
+    for batch_id in range(len(dataseq)):
+        inputs, outputs = dataseq[batch_id]
+        scores.append(model.predict_on_batch(inputs).reshape(-1))
+        labels.append(outputs['output_similarity'].reshape(-1))
+    model.model.close()
+    scores, labels = np.concatenate(scores), np.concatenate(labels)
+    metrics = model2.evaluate_pairs(scores, labels, threshold)
+    metrics['latency_ms'] = model.latency_ms()
+    return metrics, scores
+
+
+# ## Quantize with calibration on sampled training queries
+
+calibration_queries = random.sample(train_data, num_calibration_queries)
+
+task1_calibration_seq = task1_dataseq(calibration_queries)
+task1_size = quantize_graph(task1_graph_file, task1_int8_graph_file,
+                            [task1_calibration_seq[i] for i in range(len(task1_calibration_seq))])
+
+task2_calibration_seq = task2_dataseq(calibration_queries, has_label=False)
+task2_size = quantize_graph(task2_graph_file, task2_int8_graph_file,
+                            [task2_calibration_seq[i] for i in range(len(task2_calibration_seq))])
+
+
+# ## Report
+
+val_task1_seq = task1_dataseq(val_data)
+task1_report = {
+    'fp32': evaluate_task1(task1_graph_file, val_task1_seq),
+    'int8': evaluate_task1(task1_int8_graph_file, val_task1_seq),
+    'size': task1_size
+}
+
+val_task2_seq = task2_dataseq(val_data, has_label=True)
+task2_fp32, fp32_scores = evaluate_task2(task2_graph_file, val_task2_seq)
+task2_int8, int8_scores = evaluate_task2(task2_int8_graph_file, val_task2_seq)
+task2_int8['agreement_with_fp32'] = float(np.mean((fp32_scores > threshold) == (int8_scores > threshold)))
+task2_report = {'fp32': task2_fp32, 'int8': task2_int8, 'size': task2_size}
+
+for task, report in [('task1', task1_report), ('task2', task2_report)]:
+    print('~~ {}'.format(task))
+    for name in report['fp32']:
+        print('{:<20} fp32: {:<12.4f} int8: {:.4f}'.format(name, report['fp32'][name], report['int8'][name]))
+
+with open(report_file, 'w') as f:
+    json.dump({'task1': task1_report, 'task2': task2_report}, f, indent=2)
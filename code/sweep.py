@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Hyperparameter sweep for model1 / model2. The data is read, the model2
+# candidates are extracted and everything is tokenized once into
+# `artifacts_dir`, every trial memory-maps these arrays read-only, so the
+# trials share one copy through the page cache. Trials run concurrently in
+# spawned processes under a CPU / memory budget and the ones below the median
+# are stopped early.
+
+import os
+
+import numpy as np
+from keras.callbacks import Callback
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.sweep import expand_grid, max_concurrent_trials, run_sweep
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task = 'task1'  # 'task1' 或 'task2'
+artifacts_dir = 'sweep_artifacts'
+progress_dir = 'sweep_{}'.format(task)
+results_file = 'sweep_{}_results.csv'.format(task)
+
+grids = {
+    'task1': {
+        'learning_rate': [1e-5, 2e-5, 5e-5],
+        'max_len': [128, 160],
+        'shuffle_header': [False, True]
+    },
+    'task2': {
+        'learning_rate': [1e-5, 2e-5],
+        'max_len': [96, 120],
+        'neg_sample_ratio': [5, 10, 20]
+    }
+}
+# model2 的 threshold 不需要重新训练，每个 epoch 在所有 threshold 上评估
+thresholds = [0.5, 0.9, 0.95, 0.99, 0.995, 0.999]
+num_epochs = {'task1': 10, 'task2': 5}
+batch_size = 32
+
+# 资源预算
+cpu_budget = os.cpu_count()
+memory_budget_gb = 64
+threads_per_trial = 8
+# 每个 trial 自身的内存（模型、优化器状态和 batch），共享的预处理数组不计入；
+# 结果中的 peak_rss_gb 是每个 trial 实测的峰值，可据此调整
+memory_per_trial_gb = 6
+
+
+# ## Trials (run in the spawned processes)
+
+def artifact(name):
+    return os.path.join(artifacts_dir, name)
+
+
+def preprocess():
+    """
+    Read the data, extract the model2 pairs and tokenize everything once
+    """
+    os.makedirs(artifacts_dir, exist_ok=True)
+    token_dict = load_vocabulary(paths.vocab)
+    query_tokenizer = model1.QueryTokenizer(token_dict)
+    pair_tokenizer = model2.SimpleTokenizer(token_dict)
+
+    train_data = read_data(train_data_file, read_tables(train_table_file))
+    val_data = read_data(val_data_file, read_tables(val_table_file))
+    model1.save_encoded_queries(artifact('train_queries'), train_data, query_tokenizer)
+    model1.save_encoded_queries(artifact('val_queries'), val_data, query_tokenizer)
+
+    train_qc_pairs = model2.QuestionCondPairsDataset(
+        train_data, candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False))
+    model2.save_encoded_pairs(artifact('train_pairs'), train_qc_pairs, pair_tokenizer)
+    val_qc_pairs = model2.QuestionCondPairsDataset(
+        val_data, candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True))
+    model2.save_encoded_pairs(artifact('val_pairs'), val_qc_pairs, pair_tokenizer)
+
+    open(artifact('DONE'), 'w').close()  # 全部写完的标记，中断后重新运行会重新预处理
+
+
+def task1_trial(config, callbacks):
+    train_queries = model1.EncodedQueries(artifact('train_queries'))
+    val_queries = model1.EncodedQueries(artifact('val_queries'))
+    label_encoder = model1.SqlLabelEncoder()
+
+    model = model1.construct_model(paths, learning_rate=config['learning_rate'])
+    train_dataseq = model1.DataSequence(train_queries, train_queries.tokenizer, label_encoder,
+                                        is_train=True, shuffle_header=config['shuffle_header'],
+                                        max_len=config['max_len'], batch_size=batch_size)
+    val_dataseq = model1.DataSequence(val_queries, val_queries.tokenizer, label_encoder,
+                                      is_train=False, shuffle=False, shuffle_header=False,
+                                      max_len=config['max_len'], batch_size=batch_size)
+    evaluate_callback = model1.EvaluateCallback(val_dataseq)
+    model.fit_generator(train_dataseq, epochs=num_epochs['task1'], callbacks=[evaluate_callback] + callbacks)
+
+    decoded = model1.predict_decoded(model, val_dataseq)
+    return model1.evaluate_decoded(decoded, val_queries.sqls)
+
+
+class PairEvaluateCallback(Callback):
+    """
+    Score the val pairs once per epoch and evaluate every threshold,
+    `val_pair_acc` is the best of them
+    """
+    def __init__(self, val_qc_pairs_seq):
+        self.val_qc_pairs_seq = val_qc_pairs_seq
+        self.metrics = {}
+
+    def on_epoch_end(self, epoch, logs=None):
+        scores, labels = [], []
+        for batch_id in range(len(self.val_qc_pairs_seq)):
+            inputs, outputs = self.val_qc_pairs_seq[batch_id]
+            scores.append(self.model.predict_on_batch(inputs).reshape(-1))
+            labels.append(outputs['output_similarity'].reshape(-1))
+        scores, labels = np.concatenate(scores), np.concatenate(labels)
+
+        self.metrics = {}
+        for threshold in thresholds:
+            for name, value in model2.evaluate_pairs(scores, labels, threshold).items():
+                self.metrics['{}@{}'.format(name, threshold)] = value
+        logs['val_pair_acc'] = max(self.metrics['pair_acc@{}'.format(t)] for t in thresholds)
+
+
+def task2_trial(config, callbacks):
+    model, _ = model2.construct_model(paths, learning_rate=config['learning_rate'])
+    tr_qc_pairs_seq = model2.EncodedPairsDataseq(
+        model2.EncodedPairs(artifact('train_pairs')), max_len=config['max_len'],
+        sampler=model2.NegativeSampler(config['neg_sample_ratio']), shuffle=True, batch_size=batch_size)
+    val_qc_pairs_seq = model2.EncodedPairsDataseq(
+        model2.EncodedPairs(artifact('val_pairs')), max_len=config['max_len'],
+        sampler=model2.FullSampler(), shuffle=False, batch_size=128)
+    evaluate_callback = PairEvaluateCallback(val_qc_pairs_seq)
+    model.fit_generator(tr_qc_pairs_seq, epochs=num_epochs['task2'], callbacks=[evaluate_callback] + callbacks)
+    return evaluate_callback.metrics
+
+
+TRIALS = {
+    'task1': (task1_trial, 'val_tot_acc'),
+    'task2': (task2_trial, 'val_pair_acc')
+}
+
+
+# ## Preprocess once and sweep
+
+if __name__ == '__main__':
+    if not os.path.exists(artifact('DONE')):
+        preprocess()
+
+    trial_fn, monitor = TRIALS[task]
+    max_concurrent = max_concurrent_trials(cpu_budget, memory_budget_gb, threads_per_trial, memory_per_trial_gb)
+    print('~~ running {} trials, {} at a time'.format(len(expand_grid(grids[task])), max_concurrent))
+
+    results = run_sweep(trial_fn, expand_grid(grids[task]), progress_dir, max_concurrent,
+                        threads_per_trial, monitor=monitor)
+    results.to_csv(results_file, index=False)
+    print(results)
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def synthetic_queries(tmp_path_factory):
+    """
+    Seeded synthetic queries (the same generator as benchmark_preprocessing)
+    """
+    from nl2sql.utils import read_data, read_tables
+    from nl2sql.utils.synthetic import SyntheticGenerator
+
+    data_dir = str(tmp_path_factory.mktemp('synthetic'))
+    table_file = os.path.join(data_dir, 'tables.json')
+    data_file = os.path.join(data_dir, 'data.json')
+    SyntheticGenerator(seed=42, wide_ratio=0.1).write(table_file, data_file, num_tables=20, queries_per_table=5)
+    return read_data(data_file, read_tables(table_file))
+
+
+@pytest.fixture(scope='session')
+def token_dict(synthetic_queries):
+    """
+    Vocabulary of every character in the synthetic queries and tables
+    """
+    chars = set()
+    for query in synthetic_queries:
+        chars.update(query.question.text.lower())
+        for col_name, _ in query.table.header:
+            chars.update(col_name.lower())
+        for row in query.table.rows:
+            for value in row:
+                chars.update(str(value).lower())
+    special_tokens = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[unused1]', '[unused11]', '[unused12]']
+    return {token: i for i, token in enumerate(special_tokens + sorted(chars))}
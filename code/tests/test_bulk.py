@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('keras_bert')
+
+from nl2sql.utils import bulk, read_tables
+from nl2sql.utils.bulk import BulkRunner
+from nl2sql.utils.synthetic import SyntheticGenerator
+
+SHARD_SIZE = 7
+
+
+@pytest.fixture
+def data(tmp_path):
+    table_file, data_file = str(tmp_path / 'tables.json'), str(tmp_path / 'data.json')
+    SyntheticGenerator(seed=0).write(table_file, data_file, num_tables=5, queries_per_table=6)
+    return data_file, read_tables(table_file)
+
+
+def predict_questions(queries):
+    return [{'question': query.question.text} for query in queries]
+
+
+def read_questions(data_file):
+    with open(data_file, encoding='utf-8') as f:
+        return [json.loads(line)['question'] for line in f if line.strip()]
+
+
+def test_resume_after_crash_before_manifest_commit(data, tmp_path, monkeypatch):
+    data_file, tables = data
+    output_dir = str(tmp_path / 'output')
+    questions = read_questions(data_file)
+    assert len(questions) % SHARD_SIZE  # 最后一个 shard 不满
+
+    # 第 3 个 shard 已经落盘，但 manifest 提交之前进程崩溃
+    write_json_atomic = bulk._write_json_atomic
+    num_commits = []
+
+    def crash_on_third_commit(json_file, obj):
+        num_commits.append(json_file)
+        if len(num_commits) == 3:
+            raise KeyboardInterrupt
+        write_json_atomic(json_file, obj)
+
+    monkeypatch.setattr(bulk, '_write_json_atomic', crash_on_third_commit)
+    with pytest.raises(KeyboardInterrupt):
+        BulkRunner(output_dir, shard_size=SHARD_SIZE).run(data_file, tables, predict_questions)
+    monkeypatch.setattr(bulk, '_write_json_atomic', write_json_atomic)
+    assert os.path.exists(os.path.join(output_dir, 'part-00002.jsonl'))
+
+    predicted = []
+
+    def predict_and_record(queries):
+        predicted.extend(query.question.text for query in queries)
+        return predict_questions(queries)
+
+    runner = BulkRunner(output_dir, shard_size=SHARD_SIZE)
+    manifest = runner.run(data_file, tables, predict_and_record)
+    # 只重做未提交的 shard 及之后的部分
+    assert predicted == questions[2 * SHARD_SIZE:]
+    assert manifest['done'] and manifest['num_queries'] == len(questions)
+
+    output_file = str(tmp_path / 'output.jsonl')
+    runner.concat(output_file)
+    assert read_questions(output_file) == questions
+
+    # 已完成的任务再次运行不会重新预测
+    runner.run(data_file, tables, lambda queries: pytest.fail('finished run predicted again'))
@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip('keras_bert')
+
+from nl2sql.utils import Query, Table
+from nl2sql.utils.cache import ResultCache
+
+
+@pytest.fixture
+def queries(synthetic_queries):
+    # 问题互不相同的 query，每个对应一个缓存条目
+    by_question = {}
+    for query in synthetic_queries:
+        by_question.setdefault(query.question.text, query)
+    return list(by_question.values())[:5]
+
+
+def fake_sql(query):
+    return {'question': query.question.text}
+
+
+def with_changed_table(query):
+    table = query.table
+    rows = [list(row) for row in table.rows]
+    rows[0][0] = 'changed'
+    return Query(query.question, Table(table.id, table.name, table.title, table.header, rows))
+
+
+def test_lru_eviction(queries):
+    cache = ResultCache('model', capacity=3)
+    for query in queries[:3]:
+        cache.put(query, fake_sql(query))
+    assert cache.get(queries[0]) == fake_sql(queries[0])  # queries[0] 变为最近使用
+    cache.put(queries[3], fake_sql(queries[3]))
+
+    assert cache.get(queries[1]) is None
+    for query in [queries[0], queries[2], queries[3]]:
+        assert cache.get(query) == fake_sql(query)
+    assert cache.stats()['evictions'] == 1 and cache.stats()['size'] == 3
+
+
+def test_persistence_across_reopen(queries, tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    cache = ResultCache('model', capacity=2, cache_file=cache_file)
+    assert cache.predict(queries, lambda misses: [fake_sql(query) for query in misses]) == \
+        [fake_sql(query) for query in queries]
+    cache.close()
+
+    cache = ResultCache('model', capacity=2, cache_file=cache_file)
+    # 内存中只保留 capacity 个，其余的从磁盘读回
+    assert cache.predict(queries, lambda misses: pytest.fail('unexpected miss')) == \
+        [fake_sql(query) for query in queries]
+    assert cache.stats()['disk_hits'] == len(queries) and cache.stats()['misses'] == 0
+    cache.close()
+
+
+def test_invalidation_on_model_change(queries, tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    cache = ResultCache('model', cache_file=cache_file)
+    for query in queries:
+        cache.put(query, fake_sql(query))
+    cache.close()
+
+    cache = ResultCache('retrained model', cache_file=cache_file)
+    assert cache.stats()['invalidations'] == len(queries)
+    assert all(cache.get(query) is None for query in queries)
+    cache.close()
+
+
+def test_invalidation_on_table_change(queries, tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    query = queries[0]
+    changed_query = with_changed_table(query)
+    assert changed_query.table.content_hash != query.table.content_hash
+
+    cache = ResultCache('model', cache_file=cache_file)
+    cache.put(query, fake_sql(query))
+    assert cache.get(changed_query) is None
+    assert cache.stats()['invalidations'] == 1
+    cache.close()
+
+    # 重启后先见到新版本的表，磁盘中旧版本的结果也被清掉
+    cache = ResultCache('model', cache_file=cache_file)
+    cache.put(query, fake_sql(query))
+    cache.close()
+    cache = ResultCache('model', cache_file=cache_file)
+    assert cache.get(changed_query) is None
+    assert cache.stats()['invalidations'] == 1
+    cache.put(changed_query, fake_sql(changed_query))
+    assert cache.get(changed_query) == fake_sql(changed_query)
+    cache.close()
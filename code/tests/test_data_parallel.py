@@ -0,0 +1,91 @@
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from nl2sql.utils.data_parallel import GradientReplica, SharedMemoryAllReduce, shard
+
+NUM_STEPS = 3
+VECTOR_SIZE = 10  # 不能被 worker 数整除，每个 worker reduce 的列数不同
+
+
+def step_vector(rank, step):
+    return np.random.RandomState(rank * 100 + step).randn(VECTOR_SIZE).astype('float32')
+
+
+def _allreduce_worker(rank, world_size, barrier, shm_dir, result_queue):
+    allreduce = SharedMemoryAllReduce(rank, world_size, VECTOR_SIZE, barrier, shm_dir)
+    # 多步复用同一个 buffer，每一步的输入都不同
+    results = [allreduce.allreduce_mean(step_vector(rank, step)) for step in range(NUM_STEPS)]
+    result_queue.put((rank, results))
+
+
+@pytest.mark.parametrize('world_size', [2, 3])
+def test_allreduce_mean(tmp_path, world_size):
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(world_size)
+    result_queue = ctx.Queue()
+    workers = [ctx.Process(target=_allreduce_worker,
+                           args=(rank, world_size, barrier, str(tmp_path), result_queue))
+               for rank in range(world_size)]
+    for worker in workers:
+        worker.start()
+    try:
+        results = dict(result_queue.get(timeout=120) for _ in range(world_size))
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    for step in range(NUM_STEPS):
+        expected = np.mean([step_vector(rank, step) for rank in range(world_size)], axis=0)
+        for rank in range(world_size):
+            np.testing.assert_allclose(results[rank][step], expected, rtol=1e-6)
+
+
+def build_model(seed):
+    from keras.layers import Input, Dense
+    from keras.models import Model
+    from nl2sql.utils.optimizer import RAdam
+
+    np.random.seed(seed)
+    inputs = Input(shape=(4,), name='input_x')
+    hidden = Dense(8, activation='tanh')(inputs)
+    outputs = Dense(1, name='output_y')(hidden)
+    model = Model(inputs=inputs, outputs=outputs)
+    model.compile(loss='mse', optimizer=RAdam(lr=0.01))
+    return model
+
+
+def test_replica_update_matches_single_process():
+    import keras.backend as K
+
+    K.clear_session()
+    world_size, batch_size = 2, 8
+    rng = np.random.RandomState(0)
+    # 每一步的全局 batch 由各 worker 的 shard 组成
+    global_batches = [(rng.randn(world_size * batch_size, 4).astype('float32'),
+                       rng.randn(world_size * batch_size, 1).astype('float32'))
+                      for _ in range(3)]
+
+    single_model = build_model(seed=1)
+    replica_model = build_model(seed=2)
+    replica_model.set_weights(single_model.get_weights())
+    replica = GradientReplica(replica_model)
+
+    for x, y in global_batches:
+        single_model.train_on_batch({'input_x': x}, {'output_y': y})
+
+        grads = [replica.compute_gradients({'input_x': shard(x, rank, world_size)},
+                                           {'output_y': shard(y, rank, world_size)})[1]
+                 for rank in range(world_size)]
+        replica.apply_gradients(np.mean(grads, axis=0))
+
+    for weights, replica_weights in zip(single_model.get_weights(), replica_model.get_weights()):
+        np.testing.assert_allclose(replica_weights, weights, rtol=1e-4, atol=1e-6)
+    assert K.get_value(replica_model.optimizer.iterations) == len(global_batches)
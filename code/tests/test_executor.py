@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+pytest.importorskip('keras_bert')
+
+from nl2sql.utils import SQL, Header, Table
+from nl2sql.utils.executor import SqlExecutor, ColumnarTable, NumericIndex, execute_reference, results_equal
+
+
+def random_sqls(query, rng, num_sqls=5):
+    """
+    Random sqls on the table of `query`: values taken from the rows, numbers,
+    text, empty strings and out of range columns in the conds
+    """
+    num_cols = len(query.table.header)
+    sqls = []
+    for _ in range(num_sqls):
+        conds = []
+        for _ in range(rng.randint(0, 3)):
+            col_id = rng.randrange(num_cols + 1)
+            value = rng.choice([str(rng.choice(query.table.rows)[min(col_id, num_cols - 1)]),
+                                'abc', '12.5', '100', ''])
+            conds.append([col_id, rng.randrange(len(SQL.op_sql_dict)), value])
+        sel = rng.sample(range(num_cols), rng.randint(1, min(2, num_cols)))
+        sqls.append(SQL(cond_conn_op=rng.randrange(len(SQL.conn_sql_dict)),
+                        agg=[rng.randrange(len(SQL.agg_sql_dict)) for _ in sel], sel=sel, conds=conds))
+    return sqls
+
+
+def test_execute_batch_matches_reference(synthetic_queries):
+    rng = random.Random(0)
+    executor = SqlExecutor()
+    for query in synthetic_queries:
+        sqls = [query.sql] + random_sqls(query, rng)
+        for sql, result in zip(sqls, executor.execute_batch(query.table, sqls)):
+            assert results_equal(result, execute_reference(query.table, sql)), sql.to_json()
+            assert results_equal(executor.execute(query.table, sql), result), sql.to_json()
+
+
+def test_numeric_index_counts_match_cond_mask(synthetic_queries):
+    rng = random.Random(0)
+    for query in synthetic_queries:
+        table = query.table
+        numeric_index, columnar = NumericIndex(table), ColumnarTable(table)
+        for col_id in range(len(table.header)):
+            values = ['0', '100', '2010', '-5', '1e9', 'abc', str(rng.choice(table.rows)[col_id])]
+            for value in values:
+                for op in range(len(SQL.op_sql_dict)):
+                    count = numeric_index.count(col_id, op, value)
+                    if count is not None:
+                        assert count == columnar.cond_mask(col_id, op, value).sum()
+
+
+def test_numeric_index_unknown_without_numbers():
+    header = Header(['a', 'b', 'c'], ['real', 'real', 'real'])
+    table = Table('t', 'name', 'title', header, [['1', 'x', '-'], ['2', '3', ''], ['3', '4', '']])
+    numeric_index = NumericIndex(table)
+    assert numeric_index.count(0, 3, '2') == 2
+    # 有不是数字的值或者没有数字时不知道选中多少行，不能剪掉
+    for col_id in (1, 2):
+        for op in range(len(SQL.op_sql_dict)):
+            assert numeric_index.count(col_id, op, '3') is None
+            assert numeric_index.selects_any(col_id, op, '3')
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('keras_bert')
+
+from nl2sql import model1
+
+
+def decode_rows(preds_cond_conn_op, preds_sel_agg, preds_cond_op, header_lens, label_encoder):
+    """
+    Row by row decoding that `decode_batch` replaced
+    """
+    preds_cond_conn_op = np.argmax(preds_cond_conn_op, axis=-1)
+    preds_cond_op = np.argmax(preds_cond_op, axis=-1)
+    sqls = []
+    for cond_conn_op, sel_agg, cond_op, header_len in zip(preds_cond_conn_op, preds_sel_agg,
+                                                          preds_cond_op, header_lens):
+        sel_agg = sel_agg[:header_len].copy()
+        # force to select at least one column for agg
+        sel_agg[sel_agg == sel_agg[:, :-1].max()] = 1
+        sel_agg = np.argmax(sel_agg, axis=-1)
+
+        sql = label_encoder.decode(cond_conn_op, sel_agg, cond_op)
+        sql['conds'] = [cond for cond in sql['conds'] if cond[0] < header_len]
+        sel_agg_pairs = [(col_id, agg_op) for col_id, agg_op in zip(sql['sel'], sql['agg']) if col_id < header_len]
+        sql['sel'] = [col_id for col_id, _ in sel_agg_pairs]
+        sql['agg'] = [agg_op for _, agg_op in sel_agg_pairs]
+        sqls.append(sql)
+    return sqls
+
+
+def test_decode_batch_matches_rows():
+    rng = np.random.RandomState(0)
+    label_encoder = model1.SqlLabelEncoder()
+    for trial in range(200):
+        batch_size, num_cols = rng.randint(1, 9), rng.randint(1, 12)
+        preds_cond_conn_op = rng.rand(batch_size, model1.num_cond_conn_op)
+        preds_sel_agg = rng.rand(batch_size, num_cols, model1.num_sel_agg)
+        preds_cond_op = rng.rand(batch_size, num_cols, model1.num_cond_op)
+        if trial % 3 == 0:
+            # 取值相同的情况（多个列同时是最大值）
+            preds_sel_agg, preds_cond_op = np.round(preds_sel_agg, 1), np.round(preds_cond_op, 1)
+        header_lens = rng.randint(1, num_cols + 1, size=batch_size)
+
+        decoded = label_encoder.decode_batch(preds_cond_conn_op, preds_sel_agg, preds_cond_op, header_lens)
+        expected = decode_rows(preds_cond_conn_op, preds_sel_agg, preds_cond_op, header_lens, label_encoder)
+        assert decoded.to_dicts() == expected
+
+
+def test_concatenate_decoded_sqls():
+    rng = np.random.RandomState(0)
+    label_encoder = model1.SqlLabelEncoder()
+    decoded_list = [label_encoder.decode_batch(rng.rand(2, model1.num_cond_conn_op),
+                                               rng.rand(2, num_cols, model1.num_sel_agg),
+                                               rng.rand(2, num_cols, model1.num_cond_op), [num_cols, num_cols - 1])
+                    for num_cols in (3, 5)]
+    decoded = model1.DecodedSqls.concatenate(decoded_list)
+    assert decoded.to_dicts() == decoded_list[0].to_dicts() + decoded_list[1].to_dicts()
+
+
+MAX_LEN = 64
+
+
+@pytest.fixture(scope='module')
+def wide_queries(tmp_path_factory):
+    """
+    Synthetic queries over tables that do not fit in MAX_LEN
+    """
+    from nl2sql.utils import read_data, read_tables
+    from nl2sql.utils.synthetic import SyntheticGenerator
+
+    data_dir = tmp_path_factory.mktemp('wide')
+    table_file, data_file = str(data_dir / 'tables.json'), str(data_dir / 'data.json')
+    SyntheticGenerator(seed=0, wide_ratio=1., wide_cols=45).write(table_file, data_file,
+                                                                 num_tables=3, queries_per_table=2)
+    return read_data(data_file, read_tables(table_file))
+
+
+def window_batch(queries, token_dict):
+    dataseq = model1.DataSequence(queries, model1.QueryTokenizer(token_dict), model1.SqlLabelEncoder(),
+                                  is_train=True, max_len=MAX_LEN, batch_size=len(queries),
+                                  shuffle=False, shuffle_header=True, column_window=True)
+    np.random.seed(0)
+    return dataseq.get_window_batch(0)
+
+
+def test_column_windows_cover_every_column(wide_queries, token_dict):
+    inputs, outputs, row_query_ids, row_col_orders = window_batch(wide_queries, token_dict)
+    assert inputs['input_token_ids'].shape[1] <= MAX_LEN
+
+    label_encoder = model1.SqlLabelEncoder()
+    for query_id, query in enumerate(wide_queries):
+        header = query.table.header
+        assert len(header) >= 40
+        rows = [row_id for row_id, row_query_id in enumerate(row_query_ids) if row_query_id == query_id]
+        assert len(rows) > 1
+        # 每一列恰好落在一个窗口中
+        col_ids = np.concatenate([row_col_orders[row_id] for row_id in rows])
+        assert sorted(col_ids.tolist()) == list(range(len(header)))
+
+        _, sel_agg, cond_op = label_encoder.encode(query.sql, num_cols=len(header))
+        for row_id in rows:
+            col_orders = row_col_orders[row_id]
+            num_cols = int(inputs['input_header_mask'][row_id].sum())
+            assert num_cols == len(col_orders)
+            header_ids = inputs['input_header_ids'][row_id][:num_cols]
+            assert (header_ids < MAX_LEN).all()
+            # header_ids 指向对应列的类型 token
+            col_type_tokens = [token_dict[model1.QueryTokenizer.col_type_token_dict[header[col_id][1]]]
+                               for col_id in col_orders]
+            assert inputs['input_token_ids'][row_id][header_ids].tolist() == col_type_tokens
+            assert outputs['output_sel_agg'][row_id, :num_cols, 0].tolist() == sel_agg[col_orders].tolist()
+            assert outputs['output_cond_op'][row_id, :num_cols, 0].tolist() == cond_op[col_orders].tolist()
+
+
+def test_merge_column_windows(wide_queries, synthetic_queries, token_dict):
+    # 窄表只有一个窗口，补齐到最宽的表
+    queries = wide_queries + synthetic_queries[:3]
+    inputs, _, row_query_ids, row_col_orders = window_batch(queries, token_dict)
+    header_lens = [len(query.table.header) for query in queries]
+    assert min(header_lens) < max(header_lens)
+    num_rows, max_row_cols = inputs['input_header_ids'].shape
+
+    # 每个窗口中某列的预测只取决于 query 和原始列号
+    def col_scores(query_id, col_id, size):
+        return np.random.RandomState(query_id * 1000 + col_id).rand(size)
+
+    rng = np.random.RandomState(1)
+    preds_cond_conn_op = rng.rand(num_rows, model1.num_cond_conn_op)
+    preds_sel_agg = rng.rand(num_rows, max_row_cols, model1.num_sel_agg)
+    preds_cond_op = rng.rand(num_rows, max_row_cols, model1.num_cond_op)
+    for row_id, (query_id, col_orders) in enumerate(zip(row_query_ids, row_col_orders)):
+        for i, col_id in enumerate(col_orders):
+            preds_sel_agg[row_id, i] = col_scores(query_id, col_id, model1.num_sel_agg)
+            preds_cond_op[row_id, i] = col_scores(query_id, col_id, model1.num_cond_op) + 1
+
+    merged_cond_conn_op, merged_sel_agg, merged_cond_op = model1.merge_column_windows(
+        preds_cond_conn_op, preds_sel_agg, preds_cond_op, row_query_ids, row_col_orders, header_lens)
+
+    row_query_ids = np.asarray(row_query_ids)
+    for query_id, header_len in enumerate(header_lens):
+        np.testing.assert_allclose(merged_cond_conn_op[query_id],
+                                   preds_cond_conn_op[row_query_ids == query_id].mean(axis=0))
+        for col_id in range(header_len):
+            np.testing.assert_array_equal(merged_sel_agg[query_id, col_id],
+                                          col_scores(query_id, col_id, model1.num_sel_agg))
+            np.testing.assert_array_equal(merged_cond_op[query_id, col_id],
+                                          col_scores(query_id, col_id, model1.num_cond_op) + 1)
+        # 补齐的列预测为不选择
+        assert (merged_sel_agg[query_id, header_len:].argmax(axis=-1) == model1.num_sel_agg - 1).all()
+        assert (merged_cond_op[query_id, header_len:].argmax(axis=-1) == model1.num_cond_op - 1).all()
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('keras_bert')
+
+from nl2sql import model2
+
+
+class FakeModel:
+    """
+    Deterministic score of every pair computed from its token ids
+    """
+    def __init__(self):
+        self.num_calls = 0
+
+    def predict_generator(self, seq):
+        self.num_calls += 1
+        scores = [np.sum(seq[i]['input_x1'], axis=1) % 100 / 100 for i in range(len(seq))]
+        return np.concatenate(scores).reshape(-1, 1)
+
+
+def test_predict_in_budget_matches_unbounded(synthetic_queries, token_dict):
+    tokenizer = model2.SimpleTokenizer(token_dict)
+    # 每隔一个 query 不预测条件列，这些 query 没有 pair，且会落在 chunk 的边界上
+    model_1_outputs = [dict(query.sql) if query_id % 2 else dict(query.sql, conds=[])
+                       for query_id, query in enumerate(synthetic_queries)]
+
+    qc_pairs = model2.QuestionCondPairsDataset(synthetic_queries,
+                                               candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+                                               has_label=False, model_1_outputs=model_1_outputs)
+    qc_pairs_seq = model2.QuestionCondPairsDataseq(qc_pairs, tokenizer, is_train=False,
+                                                   sampler=model2.FullSampler(), shuffle=False, batch_size=8)
+    expected = model2.merge_result(qc_pairs, FakeModel().predict_generator(qc_pairs_seq), threshold=0.5)
+
+    # memory_limit=0 时每个 chunk 只装 batch_size 个 pair 左右，切成很多个 chunk
+    model = FakeModel()
+    result = model2.predict_in_budget(model, synthetic_queries, model2.CandidateCondsExtractor(share_candidates=True),
+                                      tokenizer, threshold=0.5, memory_limit=0,
+                                      model_1_outputs=model_1_outputs, batch_size=8)
+    assert model.num_calls > 1
+    assert result == expected
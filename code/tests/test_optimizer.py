@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from nl2sql.utils.optimizer import RAdam
+
+ACCUM_STEPS = 4
+NUM_UPDATES = 8  # 前几步 rho_t <= 4 不做修正，之后做修正，两种更新都覆盖到
+
+
+def build_model(optimizer):
+    from keras.layers import Input, Dense
+    from keras.models import Model
+
+    inputs = Input(shape=(4,), name='input_x')
+    hidden = Dense(8, activation='tanh')(inputs)
+    outputs = Dense(1, name='output_y')(hidden)
+    model = Model(inputs=inputs, outputs=outputs)
+    model.compile(loss='mse', optimizer=optimizer)
+    return model
+
+
+def test_accum_steps_matches_concatenated_batch():
+    import keras.backend as K
+
+    K.clear_session()
+    micro_batch_size = 4
+    rng = np.random.RandomState(0)
+    global_batches = [(rng.randn(ACCUM_STEPS * micro_batch_size, 4).astype('float32'),
+                       rng.randn(ACCUM_STEPS * micro_batch_size, 1).astype('float32'))
+                      for _ in range(NUM_UPDATES)]
+
+    model = build_model(RAdam(lr=0.01))
+    accum_model = build_model(RAdam(lr=0.01, accum_steps=ACCUM_STEPS))
+    accum_model.set_weights(model.get_weights())
+
+    for x, y in global_batches:
+        model.train_on_batch(x, y)
+        for start in range(0, len(x), micro_batch_size):
+            accum_model.train_on_batch(x[start: start + micro_batch_size], y[start: start + micro_batch_size])
+
+    for weights, accum_weights in zip(model.get_weights(), accum_model.get_weights()):
+        np.testing.assert_allclose(accum_weights, weights, rtol=1e-4, atol=1e-6)
+    assert K.get_value(accum_model.optimizer.iterations) == K.get_value(model.optimizer.iterations) == NUM_UPDATES
+    assert K.get_value(accum_model.optimizer.accum_iterations) == NUM_UPDATES * ACCUM_STEPS
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('keras_bert')
+
+from nl2sql import model2
+from nl2sql.utils.packing import PackedPairsDataseq
+
+
+MAX_LEN = 24
+PACK_LEN = 64
+
+
+@pytest.fixture(scope='module')
+def qc_pairs(synthetic_queries):
+    queries = synthetic_queries[:20]
+    return model2.QuestionCondPairsDataset(queries,
+                                           candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True),
+                                           has_label=False,
+                                           model_1_outputs=[dict(query.sql) for query in queries])
+
+
+def test_packed_rows_keep_pairs_in_order(qc_pairs, token_dict):
+    tokenizer = model2.SimpleTokenizer(token_dict)
+    packed_seq = PackedPairsDataseq(qc_pairs, tokenizer, max_len=MAX_LEN, pack_len=PACK_LEN, batch_size=4)
+    unpacked_seq = model2.QuestionCondPairsDataseq(qc_pairs, tokenizer, is_train=False, max_len=MAX_LEN,
+                                                   sampler=model2.FullSampler(), shuffle=False, batch_size=len(qc_pairs))
+    unpacked_x1 = unpacked_seq[0]['input_x1']
+
+    pair_id = 0
+    for batch_id in range(len(packed_seq)):
+        inputs = packed_seq[batch_id]
+        assert inputs['input_x1'].shape[1] <= PACK_LEN
+        for row_id, (start, num_pairs) in enumerate(packed_seq.batch_rows(batch_id)):
+            assert start == pair_id
+            for pack_id in range(num_pairs):
+                # 每个 pair 的 token 与不拼接时（截断到 MAX_LEN）相同，position 从 0 开始
+                tokens = inputs['input_pack_ids'][row_id] == pack_id + 1
+                x1 = inputs['input_x1'][row_id][tokens]
+                assert np.array_equal(x1, unpacked_x1[pair_id][:len(x1)])
+                assert not unpacked_x1[pair_id][len(x1):].any()
+                assert np.array_equal(inputs['input_positions'][row_id][tokens], np.arange(len(x1)))
+                assert inputs['input_cls_positions'][row_id][pack_id] == np.flatnonzero(tokens)[0]
+                pair_id += 1
+    assert pair_id == len(qc_pairs)
+    assert len(packed_seq.rows) < len(qc_pairs)  # 确实有多个 pair 拼在同一行
+
+
+def test_packed_scores_match_unpacked(qc_pairs, token_dict):
+    pytest.importorskip('tensorflow')
+    from keras.models import Model
+    from keras_bert import get_model
+    from nl2sql.utils.packing import build_packed_model, predict_packed
+
+    # 随机初始化的小 bert，只比较拼接与不拼接的结果是否一致
+    inputs, outputs = get_model(token_num=len(token_dict), pos_num=PACK_LEN, seq_len=None, embed_dim=32,
+                                transformer_num=2, head_num=4, feed_forward_dim=64, training=False)
+    model = model2.build_model(Model(inputs=inputs, outputs=outputs))
+    packed_model = build_packed_model(model)
+
+    tokenizer = model2.SimpleTokenizer(token_dict)
+    unpacked_seq = model2.QuestionCondPairsDataseq(qc_pairs, tokenizer, is_train=False, max_len=MAX_LEN,
+                                                   sampler=model2.FullSampler(), shuffle=False, batch_size=16)
+    packed_seq = PackedPairsDataseq(qc_pairs, tokenizer, max_len=MAX_LEN, pack_len=PACK_LEN, batch_size=4)
+
+    unpacked_scores = model.predict_generator(unpacked_seq)
+    packed_scores = predict_packed(packed_model, packed_seq)
+    assert packed_scores.shape == unpacked_scores.shape
+    np.testing.assert_allclose(packed_scores, unpacked_scores, atol=1e-5)
@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('keras_bert')
+
+from nl2sql import model1, model2
+
+
+def seeded_batches(seq, seed=0):
+    # shuffle_header 在取 batch 时才打乱列顺序
+    np.random.seed(seed)
+    batches = []
+    for batch_id in range(len(seq)):
+        batch = seq[batch_id]
+        batches.append(batch if isinstance(batch, tuple) else (batch,))
+    return batches
+
+
+def assert_batches_equal(seq, other_seq):
+    batches, other_batches = seeded_batches(seq), seeded_batches(other_seq)
+    assert len(batches) == len(other_batches)
+    for batch, other_batch in zip(batches, other_batches):
+        for part, other_part in zip(batch, other_batch):
+            assert part.keys() == other_part.keys()
+            for name in part:
+                assert np.array_equal(part[name], other_part[name]), name
+
+
+def seeded(make_seq, seed=0):
+    # shuffle 和 NegativeSampler 分别用 np.random 和 random
+    random.seed(seed)
+    np.random.seed(seed)
+    return make_seq()
+
+
+@pytest.mark.parametrize('is_train', [True, False])
+def test_encoded_queries_match_tokenizer(synthetic_queries, token_dict, tmp_path, is_train):
+    tokenizer = model1.QueryTokenizer(token_dict)
+    prefix = str(tmp_path / 'queries')
+    model1.save_encoded_queries(prefix, synthetic_queries, tokenizer)
+    encoded_queries = model1.EncodedQueries(prefix)
+    label_encoder = model1.SqlLabelEncoder()
+
+    def make_seq(data, tokenizer):
+        return model1.DataSequence(data, tokenizer, label_encoder, is_train=is_train, max_len=64,
+                                   batch_size=8, shuffle=is_train, shuffle_header=is_train)
+
+    assert_batches_equal(seeded(lambda: make_seq(synthetic_queries, tokenizer)),
+                         seeded(lambda: make_seq(encoded_queries, encoded_queries.tokenizer)))
+
+
+@pytest.mark.parametrize('sampler', [model2.FullSampler(), model2.NegativeSampler(2)])
+def test_encoded_pairs_match_tokenizer(synthetic_queries, token_dict, tmp_path, sampler):
+    tokenizer = model2.SimpleTokenizer(token_dict)
+    qc_pairs = model2.QuestionCondPairsDataset(synthetic_queries,
+                                               candidate_extractor=model2.CandidateCondsExtractor(share_candidates=True))
+    prefix = str(tmp_path / 'pairs')
+    model2.save_encoded_pairs(prefix, qc_pairs, tokenizer)
+    encoded_pairs = model2.EncodedPairs(prefix)
+
+    qc_pairs_seq = seeded(lambda: model2.QuestionCondPairsDataseq(qc_pairs, tokenizer, max_len=48, sampler=sampler,
+                                                                  shuffle=True, batch_size=16))
+    encoded_seq = seeded(lambda: model2.EncodedPairsDataseq(encoded_pairs, max_len=48, sampler=sampler,
+                                                            shuffle=True, batch_size=16))
+    assert_batches_equal(qc_pairs_seq, encoded_seq)
+    assert encoded_seq.batch_keys(0) == qc_pairs_seq.batch_keys(0)
+
+    # checkpoint 中的采样结果在两种数据之间通用
+    state = qc_pairs_seq.get_state()
+    assert np.array_equal(encoded_seq.get_state()['sample_keys'], state['sample_keys'])
+    encoded_seq.on_epoch_end()
+    encoded_seq.set_state(state)
+    assert_batches_equal(qc_pairs_seq, encoded_seq)
+
+    scores = np.linspace(0, 1, len(qc_pairs)).reshape(-1, 1)
+    assert model2.merge_result(encoded_pairs, scores, 0.5) == model2.merge_result(qc_pairs, scores, 0.5)
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+pytest.importorskip('keras_bert')
+
+from nl2sql.utils import Header, Table, Tables, TablePool, read_tables, metrics
+from nl2sql.utils.synthetic import SyntheticGenerator
+
+
+@pytest.fixture
+def table_file(tmp_path):
+    table_file = os.path.join(str(tmp_path), 'tables.json')
+    SyntheticGenerator(seed=0).write(table_file, os.path.join(str(tmp_path), 'data.json'), num_tables=5)
+    return table_file
+
+
+def test_update_does_not_modify_shared_tables(table_file):
+    pool = TablePool()
+    val_tables, test_tables = read_tables(table_file, pool), read_tables(table_file, pool)
+    table_id, old = next(iter(val_tables))
+    assert test_tables[table_id] is old
+    old_rows, old_hash = old.rows, old.content_hash
+
+    merged = val_tables + test_tables
+    notified = []
+    merged.subscribe(lambda table, changed_col_ids, old_content_hash: notified.append(
+        (table, changed_col_ids, old_content_hash)))
+    row = list(old.rows[0])
+    row[0] = 'changed'
+    assert merged.update_rows(table_id, updated={0: row}) == {0}
+
+    new = merged[table_id]
+    assert new is not old and new.rows[0][0] == 'changed' and new.version == old.version + 1
+    # 旧的对象、下层的 registry 都不变，更新只写入视图的最上层
+    assert old.rows is old_rows and old.content_hash == old_hash
+    assert val_tables[table_id] is old and test_tables[table_id] is old
+    assert list(merged.table_dict.maps[0]) == [table_id]
+    assert notified == [(new, {0}, old_hash)]
+    # pool 中是新版本，旧内容已被移除
+    assert pool.tables[new.content_hash] is new and old_hash not in pool.tables
+
+
+def test_push_new_version():
+    header = Header(['a', 'b'], ['text', 'real'])
+    old = Table('t', 'name', 'title', header, [['x', '1'], ['y', '2']])
+    tables = Tables([old])
+    assert tables.push(Table('t', 'name', 'title', header, [['x', '1'], ['y', '2']])) is old
+
+    new = tables.push(Table('t', 'name', 'title', header, [['x', '1'], ['y', '3']]))
+    assert tables['t'] is new and new is not old
+    assert new.rows == [['x', '1'], ['y', '3']] and old.rows == [['x', '1'], ['y', '2']]
+    assert list(new.df['b']) == ['1', '3'] and list(old.df['b']) == ['1', '2']
+
+
+def test_update_refreshes_only_changed_columns(table_file):
+    was_enabled = metrics.enabled()
+    registry = metrics.enable()
+    try:
+        pool = TablePool()
+        val_tables, test_tables = read_tables(table_file, pool), read_tables(table_file, pool)
+        merged = val_tables + test_tables
+        table_id, old = next(iter(val_tables))
+        old_df = old.df.copy()
+        builds = registry.counters.get('table_df_builds_total', 0)
+        refreshes = registry.counters.get('table_df_column_refreshes_total', 0)
+
+        row = list(old.rows[0])
+        row[0] = 'changed'
+        merged.update_rows(table_id, updated={0: row})
+        new_rows = [list(row) for row in merged[table_id].rows]
+        new_rows[1][1] = 'pushed'
+        new = merged.push(Table(table_id, old.name, old.title, old.header, new_rows))
+
+        # 两次更新都只刷新变化的一列，没有重建整个 df
+        assert registry.counters.get('table_df_builds_total', 0) == builds
+        assert registry.counters['table_df_column_refreshes_total'] == refreshes + 2
+        assert new._df is not None and new.df is not old.df
+        assert new.df.iloc[0, 0] == 'changed' and new.df.iloc[1, 1] == 'pushed'
+        assert old.df.equals(old_df)
+        assert registry.counters.get('table_df_builds_total', 0) == builds
+        assert new.df.equals(Table(table_id, old.name, old.title, old.header, new_rows).df)
+    finally:
+        if not was_enabled:
+            metrics.disable()
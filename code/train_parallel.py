@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Data-parallel CPU training of model1 / model2 with N worker processes that
+# average their gradients through shared memory, and a scaling-efficiency
+# benchmark. The workers are spawned and import this file, so everything that
+# runs is under `if __name__ == '__main__'` or in functions.
+
+import json
+
+from keras_bert import load_vocabulary, get_checkpoint_paths
+
+from nl2sql.utils import read_data, read_tables
+from nl2sql.utils.data_parallel import shard, train_data_parallel
+from nl2sql import model1, model2
+
+
+# ## Configuration
+
+train_table_file = '../data/train/train.tables.json'
+train_data_file = '../data/train/train.json'
+
+val_table_file = '../data/val/val.tables.json'
+val_data_file = '../data/val/val.json'
+
+# Download pretrained BERT model from https://github.com/ymcui/Chinese-BERT-wwm
+bert_model_path = '../model/chinese_wwm_L-12_H-768_A-12'
+paths = get_checkpoint_paths(bert_model_path)
+
+task = 'task1'  # 'task1' 或 'task2'
+mode = 'train'  # 'train' 或 'benchmark'
+num_workers = 4
+batch_size = 8  # 每个 worker 的 batch，等效 batch 为 num_workers * batch_size
+num_epochs = {'task1': 30, 'task2': 5}
+weights_file = {'task1': 'task1_parallel_model.h5', 'task2': 'task2_parallel_model.h5'}
+
+benchmark_workers = [1, 2, 4, 8]
+benchmark_steps = 20
+benchmark_file = 'data_parallel_benchmark.json'
+
+
+# ## Worker side
+
+def build_task1_model():
+    return model1.construct_model(paths)
+
+
+def build_task2_model():
+    return model2.construct_model(paths)[0]
+
+
+def task1_dataseq(rank, world_size):
+    train_data = read_data(train_data_file, read_tables(train_table_file))
+    token_dict = load_vocabulary(paths.vocab)
+    return model1.DataSequence(shard(train_data, rank, world_size), model1.QueryTokenizer(token_dict),
+                               model1.SqlLabelEncoder(), is_train=True, shuffle_header=False,
+                               max_len=160, batch_size=batch_size)
+
+
+def task2_dataseq(rank, world_size):
+    train_data = read_data(train_data_file, read_tables(train_table_file))
+    qc_pairs = model2.QuestionCondPairsDataset(
+        shard(train_data, rank, world_size),
+        candidate_extractor=model2.CandidateCondsExtractor(share_candidates=False)
+    )
+    token_dict = load_vocabulary(paths.vocab)
+    return model2.QuestionCondPairsDataseq(qc_pairs, model2.SimpleTokenizer(token_dict),
+                                           sampler=model2.NegativeSampler(), shuffle=True,
+                                           batch_size=batch_size)
+
+
+def task1_callbacks():
+    val_data = read_data(val_data_file, read_tables(val_table_file))
+    token_dict = load_vocabulary(paths.vocab)
+    val_dataseq = model1.DataSequence(val_data, model1.QueryTokenizer(token_dict), model1.SqlLabelEncoder(),
+                                      is_train=False, shuffle=False, shuffle_header=False,
+                                      max_len=160, batch_size=32)
+    return [model1.EvaluateCallback(val_dataseq)]
+
+
+TASKS = {
+    'task1': (build_task1_model, task1_dataseq, task1_callbacks),
+    'task2': (build_task2_model, task2_dataseq, None)
+}
+
+
+# ## Train / Benchmark
+
+if __name__ == '__main__':
+    build_fn, dataseq_fn, callbacks_fn = TASKS[task]
+
+    if mode == 'train':
+        result = train_data_parallel(build_fn, dataseq_fn, num_workers, epochs=num_epochs[task],
+                                     callbacks_fn=callbacks_fn, weights_file=weights_file[task])
+        print('~~ {:.1f} examples/s with {} workers'.format(result['examples_per_sec'], num_workers))
+
+    else:
+        results = []
+        for n in benchmark_workers:
+            result = train_data_parallel(build_fn, dataseq_fn, n, epochs=1, max_steps=benchmark_steps)
+            result['efficiency'] = result['examples_per_sec'] / (n * results[0]['examples_per_sec']) \
+                if results else 1.0
+            results.append(result)
+            print('~~ {} workers: {:.1f} examples/s, scaling efficiency {:.1%}'.format(
+                n, result['examples_per_sec'], result['efficiency']))
+
+        with open(benchmark_file, 'w') as f:
+            json.dump({'task': task, 'batch_size': batch_size, 'steps': benchmark_steps,
+                       'results': results}, f, indent=2)